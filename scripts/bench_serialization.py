@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+序列化微基准
+
+对比流式块和非流式响应的两种序列化方式（单线程，即每核吞吐）:
+- legacy: 每块构建完整 dict + json.dumps + time.time()；非流式响应经 pydantic 模型和
+  FastAPI 的 jsonable_encoder
+- fast: vlinders_server.api.serialization（预编码外层，只编码 delta），分别测试
+  orjson 和标准库 json 两种后端
+
+示例:
+    python scripts/bench_serialization.py --seconds 2
+"""
+import argparse
+import importlib
+import importlib.util
+import json
+import sys
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Dict
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+
+from vlinders_server.api import serialization  # noqa: E402
+from vlinders_server.api.internal import (  # noqa: E402
+    ChatChoice, ChatUsage, InternalChatResponse, Message
+)
+from vlinders_server.inference import GenerationResult  # noqa: E402
+
+MODEL = "minimax-m2.5"
+DELTA = "def add(a, b):\n    return a + b  # “quoted”"
+TOKEN_IDS = [1734, 29898]
+RESULT = GenerationResult(
+    text="Here is the function you asked for:\n\n```python\n" + DELTA * 40 + "\n```",
+    finish_reason="stop",
+    usage={"prompt_tokens": 812, "completion_tokens": 640, "total_tokens": 1452},
+    queue_time=0.0
+)
+
+
+def legacy_chunk(request_id: str) -> bytes:
+    data = {
+        "id": request_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": MODEL,
+        "choices": [{
+            "index": 0,
+            "delta": {"content": DELTA, "token_ids": TOKEN_IDS},
+            "finish_reason": None
+        }]
+    }
+    return f"data: {json.dumps(data)}\n\n".encode("utf-8")
+
+
+def legacy_response() -> bytes:
+    response = InternalChatResponse(
+        id=f"chatcmpl_{uuid.uuid4().hex[:8]}",
+        created=int(time.time()),
+        model=MODEL,
+        choices=[ChatChoice(
+            message=Message(role="assistant", content=RESULT.text),
+            finish_reason=RESULT.finish_reason
+        )],
+        usage=ChatUsage(**RESULT.usage)
+    )
+    return json.dumps(
+        jsonable_encoder(response), ensure_ascii=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def rate(fn: Callable[[], Any], seconds: float) -> float:
+    """每秒调用次数"""
+    calls, started = 0, time.perf_counter()
+    deadline = started + seconds
+    while True:
+        for _ in range(1000):
+            fn()
+        calls += 1000
+        now = time.perf_counter()
+        if now >= deadline:
+            return calls / (now - started)
+
+
+def load_serialization(use_orjson: bool) -> Any:
+    """重新加载序列化模块（use_orjson=False 时屏蔽 orjson）"""
+    saved = sys.modules.get("orjson")
+    if not use_orjson:
+        sys.modules["orjson"] = None
+    try:
+        return importlib.reload(serialization)
+    finally:
+        if saved is not None:
+            sys.modules["orjson"] = saved
+        else:
+            sys.modules.pop("orjson", None)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serialisation microbenchmark")
+    parser.add_argument("--seconds", type=float, default=2.0, help="每项测试的时长")
+    args = parser.parse_args()
+
+    results: Dict[str, Dict[str, float]] = {
+        "legacy": {
+            "chunks_per_s": rate(lambda: legacy_chunk("chatcmpl_12345678"), args.seconds),
+            "responses_per_s": rate(legacy_response, args.seconds),
+        }
+    }
+
+    backends = [("fast_stdlib", False)]
+    if importlib.util.find_spec("orjson") is not None:
+        backends.append(("fast_orjson", True))
+    for name, use_orjson in backends:
+        module = load_serialization(use_orjson)
+        encoder = module.ChunkEncoder(MODEL)
+        results[name] = {
+            "chunks_per_s": rate(lambda: encoder.encode(DELTA, None, TOKEN_IDS), args.seconds),
+            "responses_per_s": rate(
+                lambda: module.dumps(module.chat_completion(MODEL, RESULT)), args.seconds
+            ),
+        }
+
+    baseline = results["legacy"]
+    for name, values in results.items():
+        values["chunk_speedup"] = round(values["chunks_per_s"] / baseline["chunks_per_s"], 2)
+        values["response_speedup"] = round(
+            values["responses_per_s"] / baseline["responses_per_s"], 2
+        )
+        values["chunks_per_s"] = round(values["chunks_per_s"])
+        values["responses_per_s"] = round(values["responses_per_s"])
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,459 @@
+#!/usr/bin/env python3
+"""
+开环压测脚本
+
+按目标 QPS 以泊松过程（或按 trace 回放的时间戳）发送请求。发送不等待之前的请求完成，
+服务端变慢时排队会如实体现在延迟中（闭环压测会随之降速，掩盖回归）。
+
+接口: chat（/internal/chat）、stream（/internal/chat/stream）、batch（/internal/chat/batch）
+结果以 JSON 输出: TTFT / token 间延迟 / 端到端延迟的 p50/p95/p99、token 吞吐和错误率
+
+示例:
+    # 对运行中的服务压测
+    python scripts/benchmark.py --model sim-small --endpoint stream --qps 20 --duration 30
+
+    # 自动启动使用 CPU 模拟引擎的服务（用于 CI）
+    python scripts/benchmark.py --spawn-server --endpoint stream --qps 20 \\
+        --num-requests 200 --output results.json --max-error-rate 0.01
+
+trace 文件为 JSONL，每行一个请求:
+    {"timestamp": 0.35, "prompt_tokens": 812, "output_tokens": 120}
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import httpx
+
+
+ROOT = Path(__file__).resolve().parent.parent
+
+ENDPOINTS = {
+    "chat": "/internal/chat",
+    "stream": "/internal/chat/stream",
+    "batch": "/internal/chat/batch",
+}
+
+_WORDS = (
+    "please review this function and explain how the cache handles concurrent "
+    "requests when the queue is full and the server returns an error to the client"
+).split()
+
+
+@dataclass
+class RequestSpec:
+    """一次计划发送的请求"""
+    index: int
+    send_at: float
+    prompt_tokens: int
+    output_tokens: int
+
+
+@dataclass
+class RequestResult:
+    """一次请求的测量结果（batch 接口为整批）"""
+    ok: bool = False
+    status: Optional[int] = None
+    error: Optional[str] = None
+    dispatch_lag: float = 0.0
+    ttft: Optional[float] = None
+    e2e: Optional[float] = None
+    # 每个 token 的间隔（一次收到 n 个 token 时按平均间隔记 n 次）
+    itl: List[float] = field(default_factory=list)
+    output_tokens: int = 0
+    items: int = 1
+    failed_items: int = 0
+
+
+def parse_range(value: str) -> Tuple[int, int]:
+    """"128" 或 "64-256"（均匀分布）"""
+    low, _, high = value.partition("-")
+    low_value = int(low)
+    high_value = int(high) if high else low_value
+    if low_value < 1 or high_value < low_value:
+        raise argparse.ArgumentTypeError(f"Invalid length range: {value}")
+    return low_value, high_value
+
+
+def build_schedule(args: argparse.Namespace, rng: random.Random) -> List[RequestSpec]:
+    """生成全部请求的发送时间（相对开始时间，秒）和长度"""
+    if args.arrival == "trace":
+        specs = []
+        with open(args.trace, encoding="utf-8") as f:
+            for index, line in enumerate(line for line in f if line.strip()):
+                record = json.loads(line)
+                specs.append(RequestSpec(
+                    index=index,
+                    send_at=record["timestamp"] / args.trace_speedup,
+                    prompt_tokens=record.get("prompt_tokens", args.prompt_tokens[0]),
+                    output_tokens=record.get("output_tokens", args.output_tokens[0])
+                ))
+        specs.sort(key=lambda spec: spec.send_at)
+        return specs[:args.num_requests] if args.num_requests else specs
+
+    count = args.num_requests or max(int(args.qps * args.duration), 1)
+    specs, now = [], 0.0
+    for index in range(count):
+        specs.append(RequestSpec(
+            index=index,
+            send_at=now,
+            prompt_tokens=rng.randint(*args.prompt_tokens),
+            output_tokens=rng.randint(*args.output_tokens)
+        ))
+        now += rng.expovariate(args.qps) if args.arrival == "poisson" else 1.0 / args.qps
+    return specs
+
+
+def make_messages(spec: RequestSpec, rng: random.Random) -> List[Dict[str, str]]:
+    """约 prompt_tokens 个单词的 user 消息（带序号，避免命中缓存）"""
+    words = [f"request-{spec.index}"]
+    words += rng.choices(_WORDS, k=max(spec.prompt_tokens - 1, 0))
+    return [{"role": "user", "content": " ".join(words)}]
+
+
+def chat_item(args: argparse.Namespace, spec: RequestSpec, rng: random.Random) -> Dict[str, Any]:
+    return {
+        "model": args.model,
+        "messages": make_messages(spec, rng),
+        "max_tokens": spec.output_tokens,
+        "temperature": args.temperature,
+        "priority": args.priority,
+    }
+
+
+async def send_chat(
+    client: httpx.AsyncClient,
+    args: argparse.Namespace,
+    spec: RequestSpec,
+    rng: random.Random
+) -> RequestResult:
+    result = RequestResult()
+    started = time.perf_counter()
+    response = await client.post(ENDPOINTS["chat"], json=chat_item(args, spec, rng))
+    result.e2e = time.perf_counter() - started
+    result.status = response.status_code
+    if response.status_code != 200:
+        result.error = f"HTTP {response.status_code}"
+        return result
+
+    usage = response.json()["usage"]
+    result.ok = True
+    result.output_tokens = usage["completion_tokens"]
+    return result
+
+
+async def send_stream(
+    client: httpx.AsyncClient,
+    args: argparse.Namespace,
+    spec: RequestSpec,
+    rng: random.Random
+) -> RequestResult:
+    result = RequestResult()
+    body = {**chat_item(args, spec, rng), "return_token_ids": True}
+    started = time.perf_counter()
+    last_token_at = None
+
+    async with client.stream("POST", ENDPOINTS["stream"], json=body) as response:
+        result.status = response.status_code
+        if response.status_code != 200:
+            await response.aread()
+            result.error = f"HTTP {response.status_code}"
+            return result
+
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            payload = line[len("data: "):]
+            if payload == "[DONE]":
+                result.ok = True
+                break
+            data = json.loads(payload)
+            if "error" in data:
+                result.error = f"stream error: {data['error']}"
+                break
+
+            tokens = len(data["choices"][0]["delta"].get("token_ids") or [])
+            if not tokens:
+                continue
+            now = time.perf_counter()
+            if last_token_at is None:
+                result.ttft = now - started
+            else:
+                result.itl.extend([(now - last_token_at) / tokens] * tokens)
+            last_token_at = now
+            result.output_tokens += tokens
+
+    result.e2e = time.perf_counter() - started
+    if not result.ok and result.error is None:
+        result.error = "stream ended without [DONE]"
+    return result
+
+
+async def send_batch(
+    client: httpx.AsyncClient,
+    args: argparse.Namespace,
+    spec: RequestSpec,
+    rng: random.Random
+) -> RequestResult:
+    result = RequestResult(items=args.batch_size)
+    body = {"requests": [chat_item(args, spec, rng) for _ in range(args.batch_size)]}
+    started = time.perf_counter()
+    response = await client.post(ENDPOINTS["batch"], json=body)
+    result.e2e = time.perf_counter() - started
+    result.status = response.status_code
+    if response.status_code != 200:
+        result.error = f"HTTP {response.status_code}"
+        result.failed_items = args.batch_size
+        return result
+
+    for item in response.json()["data"]:
+        if "error" in item:
+            result.failed_items += 1
+            continue
+        result.output_tokens += item["response"]["usage"]["completion_tokens"]
+    result.ok = result.failed_items == 0
+    if not result.ok:
+        result.error = f"{result.failed_items} batch items failed"
+    return result
+
+
+SENDERS = {"chat": send_chat, "stream": send_stream, "batch": send_batch}
+
+
+async def run_schedule(
+    client: httpx.AsyncClient,
+    args: argparse.Namespace,
+    specs: Sequence[RequestSpec]
+) -> Tuple[List[RequestResult], float]:
+    """按计划时间发送全部请求（不等待响应），返回结果和总耗时"""
+    sender = SENDERS[args.endpoint]
+    rng = random.Random(args.seed)
+
+    async def one(spec: RequestSpec, dispatch_lag: float) -> RequestResult:
+        try:
+            result = await sender(client, args, spec, rng)
+        except Exception as e:
+            items = args.batch_size if args.endpoint == "batch" else 1
+            result = RequestResult(
+                error=f"{type(e).__name__}: {e}", items=items, failed_items=items
+            )
+        result.dispatch_lag = dispatch_lag
+        return result
+
+    tasks = []
+    start = time.perf_counter()
+    for spec in specs:
+        delay = start + spec.send_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        lag = time.perf_counter() - start - spec.send_at
+        tasks.append(asyncio.create_task(one(spec, lag)))
+
+    results = await asyncio.gather(*tasks)
+    return results, time.perf_counter() - start
+
+
+def percentiles(values: Sequence[float], scale: float = 1000.0) -> Optional[Dict[str, float]]:
+    """p50 / p95 / p99 / 平均 / 最大（默认换算为毫秒，线性插值）"""
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def percentile(q: float) -> float:
+        rank = (len(ordered) - 1) * q
+        low, high = math.floor(rank), math.ceil(rank)
+        value = ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+        return round(value * scale, 3)
+
+    return {
+        "p50": percentile(0.50),
+        "p95": percentile(0.95),
+        "p99": percentile(0.99),
+        "mean": round(sum(ordered) / len(ordered) * scale, 3),
+        "max": round(ordered[-1] * scale, 3),
+        "count": len(ordered),
+    }
+
+
+def summarize(
+    args: argparse.Namespace,
+    specs: Sequence[RequestSpec],
+    results: Sequence[RequestResult],
+    elapsed: float
+) -> Dict[str, Any]:
+    """汇总为可比较的 JSON"""
+    offered = specs[-1].send_at if specs else 0.0
+    items = sum(result.items for result in results)
+    failed_items = sum(
+        result.failed_items if args.endpoint == "batch" else int(not result.ok)
+        for result in results
+    )
+    output_tokens = sum(result.output_tokens for result in results)
+    succeeded = [result for result in results if result.ok]
+    errors = Counter(result.error for result in results if result.error)
+
+    return {
+        "config": {
+            "endpoint": args.endpoint,
+            "model": args.model,
+            "arrival": args.arrival,
+            "qps": args.qps if args.arrival != "trace" else None,
+            "trace": args.trace,
+            "requests": len(results),
+            "batch_size": args.batch_size if args.endpoint == "batch" else None,
+            "prompt_tokens": list(args.prompt_tokens),
+            "output_tokens": list(args.output_tokens),
+            "seed": args.seed,
+        },
+        "duration_s": round(elapsed, 3),
+        # 实际发送速率（最后一个请求的发送时间之前）与含尾部的完成速率
+        "offered_qps": round((len(results) - 1) / offered, 3) if offered else None,
+        "achieved_qps": round(len(results) / elapsed, 3) if elapsed else 0.0,
+        "completed": len(succeeded),
+        "error_rate": round(failed_items / items, 4) if items else 0.0,
+        "errors": dict(errors.most_common(10)),
+        "status_codes": dict(Counter(str(result.status) for result in results)),
+        "throughput": {
+            "output_tokens_per_s": round(output_tokens / elapsed, 2) if elapsed else 0.0,
+            "output_tokens": output_tokens,
+        },
+        "ttft_ms": percentiles([result.ttft for result in succeeded if result.ttft is not None]),
+        "itl_ms": percentiles([gap for result in succeeded for gap in result.itl]),
+        "e2e_ms": percentiles([result.e2e for result in succeeded if result.e2e is not None]),
+        # 客户端发送落后于计划的时间；过大说明压测机本身成为瓶颈，结果不可信
+        "dispatch_lag_ms": percentiles([result.dispatch_lag for result in results]),
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def spawn_server(args: argparse.Namespace) -> Tuple[subprocess.Popen, str]:
+    """启动使用模拟引擎配置的服务，等待 /ready"""
+    port = free_port()
+    env = {**os.environ, "MODELS_CONFIG": args.models_config, "INTERNAL_SECRET": args.secret}
+    log = open(args.server_log, "w") if args.server_log else subprocess.DEVNULL
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "vlinders_server.main:app",
+            "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning",
+        ],
+        cwd=ROOT,
+        env=env,
+        stdout=log,
+        stderr=subprocess.STDOUT
+    )
+    base_url = f"http://127.0.0.1:{port}"
+
+    deadline = time.monotonic() + args.startup_timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"Server exited with code {process.returncode}")
+            try:
+                if (await client.get("/ready")).json().get("ready"):
+                    return process, base_url
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+
+    process.terminate()
+    raise RuntimeError(f"Server not ready after {args.startup_timeout}s")
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    """执行一次压测"""
+    specs = build_schedule(args, random.Random(args.seed))
+
+    process = None
+    base_url = args.base_url
+    if args.spawn_server:
+        process, base_url = await spawn_server(args)
+
+    try:
+        async with httpx.AsyncClient(
+            base_url=base_url,
+            headers={"X-Internal-Auth": args.secret},
+            timeout=args.timeout,
+            # 开环压测不能在客户端排队
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        ) as client:
+            if args.warmup:
+                warmup = build_schedule(
+                    argparse.Namespace(**{**vars(args), "num_requests": args.warmup}),
+                    random.Random(args.seed + 1)
+                )
+                await run_schedule(client, args, warmup)
+            results, elapsed = await run_schedule(client, args, specs)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+
+    return summarize(args, specs, results, elapsed)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Open-loop benchmark for the internal API")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--secret", default=os.environ.get("INTERNAL_SECRET", "benchmark"))
+    parser.add_argument("--model", default="sim-small")
+    parser.add_argument("--endpoint", choices=sorted(ENDPOINTS), default="stream")
+    parser.add_argument("--arrival", choices=["poisson", "constant", "trace"], default="poisson")
+    parser.add_argument("--qps", type=float, default=10.0, help="目标到达率（请求/秒）")
+    parser.add_argument("--duration", type=float, default=30.0, help="压测时长（秒）")
+    parser.add_argument("--num-requests", type=int, default=0, help="请求数（优先于 --duration）")
+    parser.add_argument("--trace", help="trace 回放文件（JSONL）")
+    parser.add_argument("--trace-speedup", type=float, default=1.0, help="trace 时间压缩倍数")
+    parser.add_argument("--prompt-tokens", type=parse_range, default=(256, 256),
+                        help="prompt 长度，如 512 或 128-1024")
+    parser.add_argument("--output-tokens", type=parse_range, default=(128, 128),
+                        help="生成长度（max_tokens），如 128 或 32-256")
+    parser.add_argument("--batch-size", type=int, default=8, help="batch 接口每次的会话数")
+    parser.add_argument("--temperature", type=float, default=0.7)
+    parser.add_argument("--priority", choices=["high", "normal", "low"], default="normal")
+    parser.add_argument("--timeout", type=float, default=300.0, help="单请求超时（秒）")
+    parser.add_argument("--warmup", type=int, default=0, help="正式压测前的预热请求数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--spawn-server", action="store_true",
+                        help="启动使用 --models-config 的本地服务（默认 CPU 模拟引擎）")
+    parser.add_argument("--models-config", default="configs/models.simulated.yaml")
+    parser.add_argument("--startup-timeout", type=float, default=60.0)
+    parser.add_argument("--server-log", help="启动的服务的日志写入路径（默认丢弃）")
+    parser.add_argument("--output", help="结果 JSON 的写入路径")
+    parser.add_argument("--max-error-rate", type=float,
+                        help="错误率超过该值时以非零状态退出（用于 CI）")
+    return parser
+
+
+def main() -> None:
+    args = build_parser().parse_args()
+    if args.arrival == "trace" and not args.trace:
+        sys.exit("--arrival trace requires --trace")
+
+    summary = asyncio.run(run(args))
+    report = json.dumps(summary, indent=2, ensure_ascii=False)
+    print(report)
+    if args.output:
+        Path(args.output).write_text(report + "\n", encoding="utf-8")
+
+    if args.max_error_rate is not None and summary["error_rate"] > args.max_error_rate:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
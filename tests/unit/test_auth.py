@@ -0,0 +1,131 @@
+"""
+认证测试（已验证 token 缓存、共用的认证路径）
+"""
+import asyncio
+import threading
+from datetime import timedelta
+
+import httpx
+import pytest
+from fastapi import FastAPI, HTTPException
+
+from vlinders_server import auth
+from vlinders_server.api.internal import router
+from vlinders_server.auth import AuthService
+from vlinders_server.config import config
+
+
+SECRET_A = "internal-secret-a-0123456789abcdef"
+SECRET_B = "internal-secret-b-0123456789abcdef"
+
+
+@pytest.fixture
+def service(monkeypatch):
+    """设置内部密钥并统计 jwt.decode 调用次数"""
+    monkeypatch.setattr(config.server, "internal_secret", SECRET_A)
+    decoded = []
+    decode = auth.jwt.decode
+
+    def counting_decode(*args, **kwargs):
+        decoded.append(args[0])
+        return decode(*args, **kwargs)
+
+    monkeypatch.setattr(auth.jwt, "decode", counting_decode)
+    auth_service = AuthService(cache_size=2)
+    auth_service.decoded = decoded
+    return auth_service
+
+
+def test_verified_tokens_are_cached_until_exp(service, monkeypatch):
+    """同一个 token 只验证一次签名；到达 exp 后重新验证"""
+    token = service.create_token("alice", "acme", expires_delta=timedelta(minutes=5))
+
+    for _ in range(3):
+        assert service.verify_token(token)["user_id"] == "alice"
+    assert len(service.decoded) == 1
+
+    now = auth.time.time()
+    monkeypatch.setattr(auth.time, "time", lambda: now + 301)
+    service.verify_token(token)
+    assert len(service.decoded) == 2
+
+
+def test_cache_is_bounded_and_cleared_on_secret_rotation(service, monkeypatch):
+    """超过容量时淘汰最久未用的条目；密钥轮换后旧 token 失效"""
+    tokens = [service.create_token(f"user-{i}", "acme") for i in range(3)]
+    for token in tokens:
+        service.verify_token(token)
+    assert service.get_stats()["entries"] == 2
+
+    monkeypatch.setattr(config.server, "internal_secret", SECRET_B)
+    with pytest.raises(HTTPException) as exc_info:
+        service.verify_token(tokens[-1])
+    assert exc_info.value.status_code == 401
+    assert service.get_stats()["entries"] == 0
+
+
+async def test_internal_router_accepts_secret_or_service_token(service, monkeypatch):
+    """内部路由接受内部密钥或服务 token，拒绝用户 token（其 user_id 会被用于限流）"""
+    monkeypatch.setattr(auth, "auth_service", service)
+    monkeypatch.setattr("vlinders_server.api.internal.auth_service", service)
+
+    app = FastAPI()
+    app.include_router(router, prefix="/internal")
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        service_token = service.create_token("svc", "platform", scope=auth.INTERNAL_SCOPE)
+        user_token = service.create_token("mallory", "acme")
+        for credential, expected in (
+            (SECRET_A, 200), (service_token, 200), (user_token, 403), (SECRET_B, 403)
+        ):
+            response = await client.get(
+                "/internal/models", headers={"X-Internal-Auth": credential}
+            )
+            assert response.status_code == expected
+
+    assert await auth.verify_internal_auth(
+        auth.HTTPAuthorizationCredentials(scheme="Bearer", credentials=user_token)
+    ) == {"type": "jwt", "authenticated": True, "user_id": "mallory", "tenant_id": "acme"}
+
+
+async def test_internal_auth_runs_on_the_event_loop(service, monkeypatch):
+    """内部认证不放到线程池执行，并发请求不会同时修改验证结果缓存"""
+    monkeypatch.setattr("vlinders_server.api.internal.auth_service", service)
+    threads = set()
+    verify = service.verify_token
+
+    def recording_verify(token):
+        threads.add(threading.get_ident())
+        return verify(token)
+
+    monkeypatch.setattr(service, "verify_token", recording_verify)
+
+    app = FastAPI()
+    app.include_router(router, prefix="/internal")
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        tokens = [
+            service.create_token(f"svc-{i}", "platform", scope=auth.INTERNAL_SCOPE)
+            for i in range(8)
+        ]
+        responses = await asyncio.gather(*(
+            client.get("/internal/models", headers={"X-Internal-Auth": token})
+            for token in tokens
+        ))
+
+    assert all(response.status_code == 200 for response in responses)
+    assert threads == {threading.get_ident()}
+
+
+async def test_bearer_auth_fails_closed_without_secret(service, monkeypatch):
+    """未设置 INTERNAL_SECRET 时 Bearer 认证拒绝所有请求，不再跳过"""
+    monkeypatch.setattr(auth, "auth_service", service)
+    token = service.create_token("svc", "platform", scope=auth.INTERNAL_SCOPE)
+    monkeypatch.setattr(config.server, "internal_secret", "")
+
+    for credential in ("", "anything", token):
+        with pytest.raises(HTTPException) as exc_info:
+            await auth.verify_internal_auth(
+                auth.HTTPAuthorizationCredentials(scheme="Bearer", credentials=credential)
+            )
+        assert exc_info.value.status_code == 401
@@ -0,0 +1,184 @@
+"""
+引擎后端测试（模拟后端，无需 GPU）
+"""
+import os
+import threading
+import time
+
+import pytest
+
+from vlinders_server.config import ModelConfig
+from vlinders_server.inference import VLLMInferenceService, incremental_text
+from vlinders_server.inference.backends import SimulatedBackend, VLLMBackend, create_backend
+
+
+def sim_config(**overrides) -> ModelConfig:
+    """快速的模拟模型配置"""
+    values = {
+        "name": "sim",
+        "path": "simulated",
+        "backend": "simulated",
+        "sim_prefill_latency": 0.0,
+        "sim_token_latency": 0.0,
+    }
+    values.update(overrides)
+    return ModelConfig(**values)
+
+
+def test_create_backend():
+    """按配置选择后端"""
+    assert isinstance(create_backend(sim_config()), SimulatedBackend)
+
+    with pytest.raises(ValueError):
+        create_backend(sim_config(backend="unknown"))
+
+
+async def test_service_generates_with_simulated_backend():
+    """推理服务通过模拟后端完成非流式和流式生成"""
+    service = VLLMInferenceService()
+    await service.load_model("sim", sim_config())
+
+    result = await service.generate("sim", "hello world", max_tokens=8, temperature=0)
+    assert result.usage["prompt_tokens"] == 2
+    assert result.usage["completion_tokens"] == 8
+    assert result.finish_reason == "length"
+
+    chunks = [
+        chunk async for chunk in service.generate_stream(
+            "sim", "hello world", max_tokens=8, temperature=0
+        )
+    ]
+    assert chunks[-1]["done"]
+    assert "".join(chunk["text"] for chunk in chunks) == result.text
+    assert sum(len(chunk["token_ids"]) for chunk in chunks) == 8
+
+
+async def test_simulated_natural_stop():
+    """sim_output_tokens 模拟模型自然结束"""
+    service = VLLMInferenceService()
+    await service.load_model("sim", sim_config(sim_output_tokens=3))
+
+    result = await service.generate("sim", "hi", max_tokens=16)
+    assert result.usage["completion_tokens"] == 3
+    assert result.finish_reason == "stop"
+
+
+def test_incremental_text_holds_back_partial_characters():
+    """未完整解码的多字节字符（U+FFFD）等下一次输出再发送"""
+    assert incremental_text("你好", 0, False) == ("你好", 2)
+    assert incremental_text("你好\ufffd", 2, False) == ("", 2)
+    assert incremental_text("你好世", 2, False) == ("世", 3)
+    assert incremental_text("你好世\ufffd", 3, True) == ("\ufffd", 4)
+
+
+async def test_replicas_dispatch_to_least_loaded():
+    """多副本时请求分发到在途 token 最少的副本"""
+    service = VLLMInferenceService()
+    await service.load_model("sim", sim_config(replicas=2, sim_token_latency=0.001))
+    pool = service.get_engine("sim")
+
+    assert [replica.devices for replica in pool.replicas] == ["0", "1"]
+
+    async with pool.lease(1000) as busy:
+        result = await service.generate("sim", "hello", max_tokens=4)
+        assert result.usage["completion_tokens"] == 4
+        idle = [replica for replica in pool.replicas if replica is not busy][0]
+        assert idle.total_requests == 1
+
+    stats = service.replica_stats()["sim"]
+    assert [replica["in_flight_tokens"] for replica in stats] == [0, 0]
+
+
+def test_devices_must_match_replicas():
+    """显式 devices 数量必须与副本数一致"""
+    from vlinders_server.inference.pool import assign_devices
+
+    with pytest.raises(ValueError):
+        assign_devices(sim_config(replicas=2, devices=["0"]))
+    assert assign_devices(sim_config(replicas=2, tensor_parallel_size=2)) == ["0,1", "2,3"]
+
+
+async def test_deadline_aborts_engine_request():
+    """超过截止时间时中止引擎请求并统计未生成的 token"""
+    service = VLLMInferenceService()
+    await service.load_model("sim", sim_config(sim_token_latency=0.01))
+
+    with pytest.raises(TimeoutError):
+        await service.generate("sim", "hello", max_tokens=1000, timeout=0.05)
+
+    stats = service.abort_stats
+    assert stats["deadline_exceeded"] == 1
+    assert stats["aborted_requests"] == 1
+    assert 0 < stats["wasted_tokens"] < 1000
+    assert stats["wasted_tokens"] + stats["aborted_tokens"] == 1000
+    assert service.get_engine("sim").replicas[0].backend.active == 0
+
+
+async def test_closing_stream_aborts_engine_request():
+    """消费方提前关闭流（客户端断开）时中止引擎请求"""
+    service = VLLMInferenceService()
+    await service.load_model("sim", sim_config(sim_token_latency=0.001))
+
+    stream = service.generate_stream("sim", "hello", max_tokens=1000)
+    async for _ in stream:
+        break
+    await stream.aclose()
+
+    assert service.abort_stats["aborted_requests"] == 1
+    assert service.abort_stats["aborted_tokens"] == 999
+    assert service.get_engine("sim").replicas[0].backend.active == 0
+    assert service.scheduler.get_stats("sim")["active"] == 0
+
+
+def test_unpinned_engine_never_sees_a_replica_device_mask(monkeypatch):
+    """固定 GPU 的副本临时修改 CUDA_VISIBLE_DEVICES 时，其他引擎的创建等它恢复后再进行"""
+    monkeypatch.delenv("CUDA_VISIBLE_DEVICES", raising=False)
+    pinned_started = threading.Event()
+    seen = {}
+
+    class RecordingEngine:
+        @staticmethod
+        def from_engine_args(name):
+            seen[name] = os.environ.get("CUDA_VISIBLE_DEVICES")
+            if name == "pinned":
+                pinned_started.set()
+                time.sleep(0.05)
+            return name
+
+    pinned = threading.Thread(
+        target=VLLMBackend(sim_config(), devices="3")._create_engine,
+        args=(RecordingEngine, "pinned")
+    )
+    pinned.start()
+    pinned_started.wait()
+    VLLMBackend(sim_config())._create_engine(RecordingEngine, "unpinned")
+    pinned.join()
+
+    assert seen == {"pinned": "3", "unpinned": None}
+
+
+def test_vllm_replicas_spawn_workers_on_their_own_gpus(monkeypatch):
+    """每个 vLLM 副本的 EngineCore 在新进程中启动，并在启动时看到分配给该副本的 GPU"""
+    from vlinders_server.inference.pool import assign_devices
+
+    monkeypatch.setenv("CUDA_VISIBLE_DEVICES", "0,1,2,3")
+    monkeypatch.delenv("VLLM_ENABLE_V1_MULTIPROCESSING", raising=False)
+    created = []
+
+    class RecordingEngine:
+        @staticmethod
+        def from_engine_args(engine_args):
+            created.append((
+                os.environ["CUDA_VISIBLE_DEVICES"],
+                os.environ.get("VLLM_WORKER_MULTIPROC_METHOD"),
+                os.environ.get("VLLM_ENABLE_V1_MULTIPROCESSING")
+            ))
+
+    model_config = sim_config(backend="vllm", replicas=2, tensor_parallel_size=2)
+    for devices in assign_devices(model_config):
+        backend = create_backend(model_config, devices=devices)
+        backend._create_engine(RecordingEngine, backend._engine_kwargs())
+
+    assert created == [("0,1", "spawn", "1"), ("2,3", "spawn", "1")]
+    assert os.environ["CUDA_VISIBLE_DEVICES"] == "0,1,2,3"
+    assert "VLLM_ENABLE_V1_MULTIPROCESSING" not in os.environ
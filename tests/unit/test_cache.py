@@ -0,0 +1,78 @@
+"""
+Redis 熔断测试（不需要 Redis 服务）
+"""
+import asyncio
+
+import pytest
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from vlinders_server import ratelimit
+from vlinders_server.cache import CacheService, CacheUnavailable
+from vlinders_server.config import config
+
+
+class FlakyClient:
+    """up=False 时所有命令都抛出连接错误"""
+
+    def __init__(self):
+        self.up = False
+        self.calls = 0
+
+    async def ping(self) -> bool:
+        if not self.up:
+            raise RedisConnectionError("connection refused")
+        return True
+
+    async def get(self, key: str) -> str:
+        self.calls += 1
+        if not self.up:
+            raise RedisConnectionError("connection refused")
+        return "value"
+
+
+async def test_failed_connect_degrades_to_local_fallbacks(monkeypatch):
+    """启动时连不上 Redis：立即熔断，调用不再等待超时，限流改用进程内计数"""
+    monkeypatch.setattr(config.server, "redis_url", "redis://127.0.0.1:1")
+    monkeypatch.setattr(config.server, "redis_reconnect_interval", 60.0)
+    service = CacheService()
+
+    with pytest.raises(Exception):
+        await service.connect()
+    assert service.state == "degraded"
+
+    assert await service.get("key") is None
+    with pytest.raises(CacheUnavailable):
+        await service.incr("key")
+    assert service.get_stats()["short_circuited"] == 2
+
+    monkeypatch.setattr(ratelimit, "cache", service)
+    rate_limiter = ratelimit.RateLimiter([ratelimit.UsageLimit("user", "requests", "minute", 1)])
+    await rate_limiter.reserve("frank", None, 0)
+    with pytest.raises(ratelimit.RateLimitExceeded):
+        await rate_limiter.reserve("frank", None, 0)
+
+    await service.disconnect()
+
+
+async def test_breaker_trips_and_reconnects_in_background(monkeypatch):
+    """连续失败达到阈值后熔断，后台重连成功后恢复"""
+    monkeypatch.setattr(config.server, "redis_reconnect_interval", 0.01)
+    service = CacheService()
+    client = service.client = FlakyClient()
+
+    for _ in range(service.breaker.failure_threshold):
+        assert await service.get("key") is None
+    assert service.state == "degraded"
+
+    # 熔断期间不访问 Redis
+    assert await service.get("key") is None
+    assert client.calls == service.breaker.failure_threshold
+
+    client.up = True
+    await asyncio.sleep(0.05)
+    assert service.state == "connected"
+    assert await service.get("key") == "value"
+    assert service.get_stats()["reconnects"] == 1
+
+    service.client = None
+    await service.disconnect()
@@ -0,0 +1,98 @@
+"""
+补全缓存测试
+"""
+import importlib
+
+from vlinders_server.config import ModelConfig
+from vlinders_server.inference import VLLMInferenceService
+from vlinders_server.inference.completion_cache import CompletionCache
+
+# 包中的 completion_cache 是全局实例，取模块本身
+module = importlib.import_module("vlinders_server.inference.completion_cache")
+
+
+MESSAGES = [{"role": "user", "content": "hello"}]
+SAMPLING = {"max_tokens": 16, "temperature": 0.0}
+
+
+def test_only_deterministic_requests_are_cacheable():
+    """只有 temperature=0 或指定 seed 的请求可缓存"""
+    assert CompletionCache.is_cacheable(0.0)
+    assert CompletionCache.is_cacheable(0.7, seed=1)
+    assert not CompletionCache.is_cacheable(0.7)
+
+
+async def test_l1_hit_and_byte_bound_eviction():
+    """L1 命中，并按字节数淘汰最久未使用的条目"""
+    completion_cache = CompletionCache(max_bytes=200)
+    first = completion_cache.make_key("m", MESSAGES, SAMPLING)
+    second = completion_cache.make_key("m", MESSAGES, {**SAMPLING, "max_tokens": 32})
+
+    await completion_cache.set("m", first, {"text": "a" * 100})
+    assert await completion_cache.get("m", first) == {"text": "a" * 100}
+
+    await completion_cache.set("m", second, {"text": "b" * 100})
+    assert await completion_cache.get("m", first) is None
+    assert completion_cache.stats["evictions"] == 1
+    assert completion_cache.get_stats()["l1_bytes"] <= 200
+
+
+async def test_invalidate_model_changes_namespace():
+    """模型失效后旧条目不再命中，新写入的条目属于新的代"""
+    completion_cache = CompletionCache()
+    key = completion_cache.make_key("m", MESSAGES, SAMPLING)
+    await completion_cache.set("m", key, {"text": "cached"})
+
+    await completion_cache.invalidate_model("m")
+
+    assert await completion_cache.get("m", key) is None
+    await completion_cache.set("m", key, {"text": "fresh"})
+    assert await completion_cache.get("m", key) == {"text": "fresh"}
+
+
+class SharedRedis:
+    """多个 worker 共享的 Redis（只实现补全缓存用到的命令）"""
+
+    available = True
+
+    def __init__(self):
+        self.values = {}
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def set(self, key, value, expire=None):
+        self.values[key] = value
+        return True
+
+    async def incr(self, key, amount=1):
+        self.values[key] = str(int(self.values.get(key, 0)) + amount)
+        return int(self.values[key])
+
+
+async def test_workers_pick_up_epoch_changes(monkeypatch):
+    """一个 worker 使模型缓存失效后，其他 worker 在 epoch_ttl 内读到新的代数"""
+    monkeypatch.setattr(module, "cache", SharedRedis())
+    first, second = CompletionCache(epoch_ttl=0.0), CompletionCache(epoch_ttl=0.0)
+    key = first.make_key("m", MESSAGES, SAMPLING)
+
+    await first.set("m", key, {"text": "old weights"})
+    assert await second.get("m", key) == {"text": "old weights"}
+
+    await first.invalidate_model("m")
+    assert await second.get("m", key) is None
+    await second.set("m", key, {"text": "new weights"})
+    assert await first.get("m", key) == {"text": "new weights"}
+
+
+async def test_shutdown_keeps_the_shared_cache(monkeypatch):
+    """worker 正常关闭（滚动重启）不递增共享的缓存代数"""
+    redis = SharedRedis()
+    monkeypatch.setattr(module, "cache", redis)
+    service = VLLMInferenceService()
+    await service.load_model(
+        "sim-epoch", ModelConfig(name="sim-epoch", path="simulated", backend="simulated")
+    )
+
+    await service.shutdown()
+    assert "completion:epoch:sim-epoch" not in redis.values
@@ -0,0 +1,105 @@
+"""
+上下文窗口预算测试
+"""
+from vlinders_server.config import ModelConfig
+from vlinders_server.inference import VLLMInferenceService
+from vlinders_server.inference.backends.simulated import SimpleTokenizer
+from vlinders_server.inference.context import MESSAGE_OVERHEAD_TOKENS, ContextWindow
+
+
+def words(count: int, word: str = "data") -> str:
+    return " ".join([word] * count)
+
+
+def conversation(turns: int, words_per_message: int = 50) -> list:
+    messages = [{"role": "system", "content": "be helpful"}]
+    for i in range(turns):
+        messages.append({"role": "user", "content": words(words_per_message, f"q{i}")})
+        messages.append({"role": "assistant", "content": words(words_per_message, f"a{i}")})
+    messages.append({"role": "user", "content": "latest question"})
+    return messages
+
+
+def test_short_conversation_is_untouched():
+    """未超出窗口时不做任何修改"""
+    window = ContextWindow(1000, SimpleTokenizer())
+    messages = conversation(2)
+
+    fitted = window.fit(messages, max_tokens=100)
+
+    assert fitted.messages == messages
+    assert fitted.max_tokens == 100
+    assert window.stats["trimmed"] == 0
+
+
+def test_oldest_turns_dropped_and_marked():
+    """从最早的轮次开始丢弃，保留系统 prompt 和本轮输入"""
+    window = ContextWindow(1000, SimpleTokenizer())
+    messages = conversation(20)
+
+    fitted = window.fit(messages, max_tokens=300)
+
+    assert fitted.prompt_tokens + fitted.max_tokens <= 1000
+    assert fitted.max_tokens == 300
+    assert fitted.dropped_messages > 0
+    assert fitted.messages[0]["content"].startswith("be helpful")
+    assert "earlier messages omitted" in fitted.messages[0]["content"]
+    assert fitted.messages[1]["role"] == "user"
+    assert fitted.messages[-1] == messages[-1]
+    # 保留的是最近的轮次
+    assert fitted.messages[-2] == messages[-2]
+
+
+def test_tool_output_truncated_to_budget():
+    """超大的工具输出截断到工具预算内"""
+    window = ContextWindow(1000, SimpleTokenizer())
+    messages = [
+        {"role": "user", "content": "read the file"},
+        {"role": "tool", "content": words(5000)},
+        {"role": "user", "content": "summarize it"},
+    ]
+
+    fitted = window.fit(messages, max_tokens=400)
+
+    tool = fitted.messages[1]
+    assert "tokens truncated" in tool["content"]
+    assert window.count(tool) <= 200 + MESSAGE_OVERHEAD_TOKENS
+    assert fitted.truncated_messages == 1
+    assert fitted.prompt_tokens + fitted.max_tokens <= 1000
+
+
+def test_max_tokens_clamped_to_output_reserve():
+    """max_tokens 超出窗口时压缩到剩余空间"""
+    window = ContextWindow(1000, SimpleTokenizer())
+
+    fitted = window.fit([{"role": "user", "content": "hi"}], max_tokens=5000)
+
+    assert fitted.max_tokens == 1000 - fitted.prompt_tokens
+    assert window.stats["clamped_max_tokens"] == 1
+
+
+def test_message_counts_are_cached():
+    """每一轮只对新消息分词"""
+    window = ContextWindow(100000, SimpleTokenizer())
+    messages = conversation(5)
+    window.fit(messages, max_tokens=10)
+    misses = window.stats["count_cache_misses"]
+
+    window.fit(messages + [{"role": "assistant", "content": "ok"}], max_tokens=10)
+
+    assert window.stats["count_cache_misses"] == misses + 1
+
+
+async def test_render_prompt_fits_context_window():
+    """渲染前裁剪，生成长度按实际 prompt 调整"""
+    service = VLLMInferenceService()
+    await service.load_model(
+        "sim",
+        ModelConfig(name="sim", path="simulated", backend="simulated", max_model_len=1000)
+    )
+
+    prompt = await service.render_prompt("sim", conversation(20), max_tokens=600)
+
+    assert prompt.dropped_messages > 0
+    assert len(prompt.token_ids) + prompt.max_tokens <= 1000
+    assert prompt.max_tokens >= 480
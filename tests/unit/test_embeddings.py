@@ -0,0 +1,84 @@
+"""
+嵌入服务与微批处理测试（CPU）
+"""
+import asyncio
+
+import httpx
+import numpy as np
+from fastapi import FastAPI
+
+from vlinders_server.api.internal import router
+from vlinders_server.config import EmbeddingConfig
+from vlinders_server.inference.batching import MicroBatcher
+from vlinders_server.inference.embeddings import EmbeddingService, embedding_service
+
+
+async def test_micro_batcher_merges_concurrent_requests():
+    """并发请求合并为满批，超出部分进入下一批"""
+    calls = []
+
+    def double(items):
+        calls.append(len(items))
+        return [item * 2 for item in items]
+
+    batcher = MicroBatcher(double, max_batch_size=8, max_wait=0.05)
+    results = await asyncio.gather(*(batcher.submit([i, i + 100]) for i in range(6)))
+
+    assert results[2] == [4, 204]
+    assert calls == [8, 4]
+    assert batcher.stats == {"batches": 2, "items": 12, "max_batch": 8}
+    await batcher.close()
+
+
+async def test_micro_batcher_flushes_after_max_wait():
+    """不满一批时等待 max_wait 后执行"""
+    batcher = MicroBatcher(lambda items: items, max_batch_size=64, max_wait=0.01)
+
+    assert await asyncio.wait_for(batcher.submit(["a"]), timeout=1) == ["a"]
+    await batcher.close()
+
+
+async def test_hash_embeddings_are_normalized_and_deterministic():
+    """hash 后端输出归一化向量，相同文本得到相同向量"""
+    service = EmbeddingService()
+    await service.start_loading(EmbeddingConfig(name="hash-test", backend="hash", dimension=64))
+
+    result = await service.embed(["def parse(data)", "def parse(data)", "unrelated words"])
+
+    vectors = np.array(result.embeddings)
+    assert vectors.shape == (3, 64)
+    assert np.allclose(np.linalg.norm(vectors, axis=1), 1.0)
+    assert vectors[0] @ vectors[1] > 0.999
+    assert result.prompt_tokens == 8
+    assert service.get_stats()["batch_size"]["count"] >= 1
+    await service.shutdown()
+
+
+async def test_embeddings_endpoint_accepts_str_and_list():
+    """接口接受单个字符串或字符串列表"""
+    embedding_service.start_loading(EmbeddingConfig(backend="hash", dimension=32))
+    app = FastAPI()
+    app.include_router(router, prefix="/internal")
+    transport = httpx.ASGITransport(app=app)
+    headers = {"X-Internal-Auth": "test"}
+
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            single = await client.post(
+                "/internal/embeddings", headers=headers, json={"input": "hello world"}
+            )
+            batch = await client.post(
+                "/internal/embeddings", headers=headers, json={"input": ["a", "b c"]}
+            )
+            missing = await client.post(
+                "/internal/embeddings", headers=headers, json={"model": "other", "input": "x"}
+            )
+    finally:
+        await embedding_service.shutdown()
+
+    assert single.status_code == 200
+    assert len(single.json()["data"]) == 1
+    assert len(single.json()["data"][0]["embedding"]) == 32
+    assert [item["index"] for item in batch.json()["data"]] == [0, 1]
+    assert batch.json()["usage"]["prompt_tokens"] == 3
+    assert missing.status_code == 404
@@ -0,0 +1,185 @@
+"""
+内部 API 测试（模拟后端）
+"""
+import asyncio
+import json
+
+import httpx
+import pytest
+from fastapi import FastAPI, HTTPException
+
+from vlinders_server.api import internal
+from vlinders_server.api.internal import InternalChatBatchRequest, InternalChatResponse, router
+from vlinders_server.config import ModelConfig
+from vlinders_server.inference import vllm_service
+
+
+HEADERS = {"X-Internal-Auth": "test"}
+
+
+@pytest.fixture
+async def client():
+    """挂载内部路由并加载一个模拟模型"""
+    await vllm_service.load_model(
+        "sim",
+        ModelConfig(
+            name="sim",
+            path="simulated",
+            backend="simulated",
+            sim_prefill_latency=0.0,
+            sim_token_latency=0.0
+        )
+    )
+
+    app = FastAPI()
+    app.include_router(router, prefix="/internal")
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as http_client:
+        yield http_client
+
+    await vllm_service.unload_model("sim")
+
+
+def chat_item(model: str = "sim", content: str = "hello") -> dict:
+    return {
+        "model": model,
+        "messages": [{"role": "user", "content": content}],
+        "max_tokens": 4
+    }
+
+
+async def test_batch_returns_results_in_order_with_item_errors(client):
+    """批量接口按顺序返回，单条失败不影响其他条目"""
+    response = await client.post(
+        "/internal/chat/batch",
+        json={"requests": [chat_item(), chat_item(model="missing"), chat_item(content="bye")]},
+        headers=HEADERS
+    )
+
+    assert response.status_code == 200
+    data = response.json()["data"]
+    assert [item["index"] for item in data] == [0, 1, 2]
+    assert data[0]["response"]["usage"]["completion_tokens"] == 4
+    assert data[1]["error"]["status"] == 404
+    assert "response" in data[2]
+
+
+async def test_batch_streams_ndjson(client):
+    """stream=true 时逐行返回 NDJSON"""
+    response = await client.post(
+        "/internal/chat/batch",
+        json={"requests": [chat_item(), chat_item(content="bye")], "stream": True},
+        headers=HEADERS
+    )
+
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(line["index"] for line in lines) == [0, 1]
+
+
+@pytest.fixture
+async def small_model():
+    """并发 4、队列 8 的模拟模型，每个请求生成约 40ms"""
+    await vllm_service.load_model(
+        "sim-small",
+        ModelConfig(
+            name="sim-small",
+            path="simulated",
+            backend="simulated",
+            sim_prefill_latency=0.0,
+            sim_token_latency=0.01,
+            max_concurrency=4,
+            max_queue_size=8
+        )
+    )
+    yield "sim-small"
+    await vllm_service.unload_model("sim-small")
+
+
+async def test_batch_larger_than_queue_is_not_rejected(client, small_model):
+    """条目数远超并发和队列容量时在本地等待，不会被调度器拒绝"""
+    response = await client.post(
+        "/internal/chat/batch",
+        json={"requests": [chat_item(small_model, f"item {i}") for i in range(50)]},
+        headers=HEADERS
+    )
+
+    data = response.json()["data"]
+    assert [item.get("error") for item in data] == [None] * 50
+    assert vllm_service.scheduler.get_stats(small_model)["rejected"] == 0
+
+
+class DisconnectedRequest:
+    """已断开的客户端"""
+
+    async def is_disconnected(self) -> bool:
+        return True
+
+
+async def test_batch_is_cancelled_when_client_disconnects(small_model, monkeypatch):
+    """客户端断开时取消尚未完成的会话，不再继续生成"""
+    monkeypatch.setattr(internal, "DISCONNECT_POLL_INTERVAL", 0.01)
+    request = InternalChatBatchRequest(
+        requests=[{**chat_item(small_model, f"item {i}"), "max_tokens": 1000} for i in range(8)]
+    )
+
+    with pytest.raises(HTTPException) as exc_info:
+        await internal.internal_chat_batch(request, DisconnectedRequest(), {})
+    assert exc_info.value.status_code == 499
+
+    await asyncio.sleep(0.05)
+    stats = vllm_service.scheduler.get_stats(small_model)
+    assert stats["active"] == 0 and stats["queue_depth"] == 0
+
+
+async def test_tokenize_counts_conversations(client):
+    """按模型分词器返回每组消息的 token 数"""
+    response = await client.post(
+        "/internal/tokenize",
+        headers=HEADERS,
+        json={
+            "model": "sim",
+            "conversations": [
+                [{"role": "user", "content": "hello"}],
+                [
+                    {"role": "system", "content": "be brief"},
+                    {"role": "user", "content": "hello there"}
+                ]
+            ]
+        }
+    )
+
+    assert response.status_code == 200
+    body = response.json()
+    # "user: hello\nassistant:" -> 3 个 token
+    assert body["counts"] == [3, 7]
+    assert body["total"] == 10
+    assert body["exact"] is True
+
+    response = await client.post(
+        "/internal/tokenize",
+        headers=HEADERS,
+        json={"model": "missing", "conversations": [[{"role": "user", "content": "hi"}]]}
+    )
+    assert response.status_code == 404
+
+
+async def test_chat_responses_match_schema(client):
+    """非流式响应符合 InternalChatResponse，流式块可逐行解析"""
+    response = await client.post("/internal/chat", json=chat_item(), headers=HEADERS)
+
+    assert response.status_code == 200
+    assert "X-Queue-Depth" in response.headers
+    body = InternalChatResponse.model_validate(response.json())
+    assert body.usage.completion_tokens == 4
+
+    response = await client.post(
+        "/internal/chat/stream",
+        json={**chat_item(), "return_token_ids": True},
+        headers=HEADERS
+    )
+    events = [line[len("data: "):] for line in response.text.splitlines() if line]
+    assert events[-1] == "[DONE]"
+    chunks = [json.loads(event) for event in events[:-1]]
+    assert sum(len(chunk["choices"][0]["delta"]["token_ids"]) for chunk in chunks) == 4
+    assert chunks[-1]["choices"][0]["finish_reason"] == "length"
@@ -0,0 +1,98 @@
+"""
+Prometheus 指标测试
+"""
+import httpx
+from fastapi import FastAPI
+from prometheus_client import REGISTRY
+
+from vlinders_server.api.health import router
+from vlinders_server.config import ModelConfig
+from vlinders_server.inference import VLLMInferenceService, vllm_service
+from vlinders_server.metrics import FastHistogram
+
+
+def sim_config(name: str) -> ModelConfig:
+    return ModelConfig(
+        name=name,
+        path="simulated",
+        backend="simulated",
+        sim_prefill_latency=0.0,
+        sim_token_latency=0.002
+    )
+
+
+def test_fast_histogram_exports_cumulative_buckets():
+    """分桶按 le 累计，count 个相同观测值一次记录"""
+    histogram = FastHistogram("test_latency_seconds", "test", buckets=(0.01, 0.1))
+    histogram.observe("m", 0.005)
+    histogram.observe("m", 0.05, count=3)
+    histogram.observe("m", 5.0)
+
+    samples = {
+        (sample.name, sample.labels.get("le")): sample.value
+        for sample in histogram.collect().samples
+    }
+    assert samples[("test_latency_seconds_bucket", "0.01")] == 1
+    assert samples[("test_latency_seconds_bucket", "0.1")] == 4
+    assert samples[("test_latency_seconds_bucket", "+Inf")] == 5
+    assert samples[("test_latency_seconds_count", None)] == 5
+    assert abs(samples[("test_latency_seconds_sum", None)] - 5.155) < 1e-9
+
+
+async def test_generation_records_latency_and_token_metrics():
+    """非流式和流式生成都记录 TTFT、ITL、端到端延迟和 token 数"""
+    service = VLLMInferenceService()
+    service.register_model("metrics-a", sim_config("metrics-a"))
+
+    await service.generate("metrics-a", "hello there", max_tokens=4)
+    async for _ in service.generate_stream("metrics-a", "hello again", max_tokens=4):
+        pass
+
+    labels = {"model": "metrics-a"}
+    assert REGISTRY.get_sample_value(
+        "vlinders_requests_total", {**labels, "status": "success"}
+    ) == 2
+    assert REGISTRY.get_sample_value("vlinders_time_to_first_token_seconds_count", labels) == 2
+    assert REGISTRY.get_sample_value("vlinders_queue_wait_seconds_count", labels) == 2
+    assert REGISTRY.get_sample_value("vlinders_response_seconds_count", labels) == 2
+    assert REGISTRY.get_sample_value("vlinders_completion_tokens_sum", labels) == 8
+    # 每个请求 4 个 token，首 token 之后有 3 个间隔
+    assert REGISTRY.get_sample_value("vlinders_inter_token_latency_seconds_count", labels) == 6
+
+
+async def test_closed_stream_counts_as_aborted():
+    """提前关闭的流记为 aborted，不计入端到端延迟"""
+    service = VLLMInferenceService()
+    service.register_model("metrics-b", sim_config("metrics-b"))
+
+    stream = service.generate_stream("metrics-b", "hello", max_tokens=50)
+    await anext(stream)
+    await stream.aclose()
+
+    labels = {"model": "metrics-b"}
+    assert REGISTRY.get_sample_value(
+        "vlinders_requests_total", {**labels, "status": "aborted"}
+    ) == 1
+    assert REGISTRY.get_sample_value("vlinders_response_seconds_count", labels) is None
+
+
+async def test_metrics_endpoint_exposes_scheduler_gauges():
+    """/metrics 输出 Prometheus 文本格式，包含调度器的瞬时指标"""
+    vllm_service.scheduler.configure(
+        "metrics-c", max_concurrency=4, max_queue_size=16, queue_timeout=30
+    )
+    app = FastAPI()
+    app.include_router(router)
+
+    try:
+        async with httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://test"
+        ) as client:
+            response = await client.get("/metrics")
+    finally:
+        vllm_service.scheduler.remove("metrics-c")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'vlinders_requests_running{model="metrics-c"} 0.0' in response.text
+    assert 'vlinders_requests_queued{model="metrics-c"} 0.0' in response.text
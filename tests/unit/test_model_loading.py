@@ -0,0 +1,140 @@
+"""
+按需加载与显存预算测试
+"""
+import asyncio
+import threading
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from vlinders_server.api import health
+from vlinders_server.config import ModelConfig, config
+from vlinders_server.inference import SchedulerOverloaded, VLLMInferenceService
+
+
+def sim_config(name: str, **overrides) -> ModelConfig:
+    values = {
+        "name": name,
+        "path": "simulated",
+        "backend": "simulated",
+        "load_policy": "on_demand",
+        "memory_gb": 10,
+        "sim_prefill_latency": 0.0,
+        "sim_token_latency": 0.0,
+    }
+    values.update(overrides)
+    return ModelConfig(**values)
+
+
+async def test_on_demand_model_loads_once_on_first_request():
+    """并发的首次请求共享同一次加载"""
+    service = VLLMInferenceService()
+    service.register_model("a", sim_config("a"))
+    assert service.model_state("a") == "cold"
+
+    results = await asyncio.gather(*[
+        service.generate("a", "hello", max_tokens=2) for _ in range(4)
+    ])
+
+    assert all(result.usage["completion_tokens"] == 2 for result in results)
+    assert service.model_state("a") == "loaded"
+    assert len(service.get_engine("a").replicas) == 1
+
+
+async def test_idle_models_evicted_lru_first(monkeypatch):
+    """超出显存预算时卸载最久未使用的空闲模型"""
+    monkeypatch.setattr(config.server, "model_memory_budget_gb", 20)
+    service = VLLMInferenceService()
+    for name in ("a", "b", "c"):
+        service.register_model(name, sim_config(name))
+
+    await service.generate("a", "hello", max_tokens=1)
+    await service.generate("b", "hello", max_tokens=1)
+    await service.generate("a", "hello", max_tokens=1)
+    await service.generate("c", "hello", max_tokens=1)
+
+    assert service.model_states() == {"a": "loaded", "b": "cold", "c": "loaded"}
+
+
+async def test_models_rendering_prompts_are_not_evicted(monkeypatch):
+    """渲染 prompt 中（尚未提交生成）的模型计为使用中，不会为加载其他模型而被卸载"""
+    monkeypatch.setattr(config.server, "model_memory_budget_gb", 10)
+    service = VLLMInferenceService()
+    for name in ("a", "b"):
+        service.register_model(name, sim_config(name))
+    await service.ensure_loaded("a")
+
+    started = threading.Event()
+    proceed = threading.Event()
+    render = service.renderers["a"].render
+
+    def slow_render(messages):
+        started.set()
+        proceed.wait(5)
+        return render(messages)
+
+    monkeypatch.setattr(service.renderers["a"], "render", slow_render)
+    rendering = asyncio.create_task(
+        service.render_prompt("a", [{"role": "user", "content": "hello"}])
+    )
+    await asyncio.to_thread(started.wait, 5)
+
+    with pytest.raises(SchedulerOverloaded):
+        await service.generate("b", "hello", max_tokens=1)
+
+    proceed.set()
+    assert (await rendering).text
+    assert service.model_states() == {"a": "loaded", "b": "cold"}
+
+    # 渲染结束后 a 空闲，可以被卸载
+    await service.generate("b", "hello", max_tokens=1)
+    assert service.model_states() == {"a": "cold", "b": "loaded"}
+    await service.unload_model("b")
+
+
+async def test_models_load_in_parallel_and_failures_are_isolated():
+    """启动时并行加载，单个模型失败不影响其他模型"""
+    service = VLLMInferenceService()
+    for name in ("a", "b"):
+        service.register_model(name, sim_config(name, sim_load_latency=0.2))
+    service.register_model("broken", sim_config("broken", backend="missing"))
+
+    start = asyncio.get_running_loop().time()
+    errors = await service.load_models(["a", "b", "broken"])
+    elapsed = asyncio.get_running_loop().time() - start
+
+    assert elapsed < 0.35
+    assert errors["a"] is None and errors["b"] is None
+    assert errors["broken"] is not None
+    assert service.model_states() == {"a": "loaded", "b": "loaded", "broken": "failed"}
+    await service.shutdown()
+    assert service.list_models() == []
+
+
+async def test_readiness_returns_503_until_required_models_load(monkeypatch):
+    """就绪探针只看状态码：必需模型加载完之前返回 503"""
+    service = VLLMInferenceService()
+    monkeypatch.setattr(health, "vllm_service", service)
+    monkeypatch.setattr(config.server, "required_models", "")
+
+    app = FastAPI()
+    app.include_router(health.router)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        response = await client.get("/ready")
+        assert response.status_code == 503
+        assert response.json() == {"ready": False, "reason": "No models configured"}
+
+        service.register_model("a", sim_config("a", load_policy="eager"))
+        service.register_model("b", sim_config("b"))
+        response = await client.get("/ready")
+        assert response.status_code == 503
+        assert response.json()["models"] == {"a": "cold", "b": "cold"}
+
+        await service.ensure_loaded("a")
+        response = await client.get("/ready")
+        assert response.status_code == 200
+        assert response.json() == {"ready": True, "models": {"a": "loaded", "b": "cold"}}
+
+    await service.unload_model("a")
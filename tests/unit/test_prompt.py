@@ -0,0 +1,61 @@
+"""
+Prompt 渲染测试
+"""
+from vlinders_server.inference.backends.simulated import SimpleTokenizer
+from vlinders_server.inference.prompt import PromptRenderer, legacy_template
+
+
+class TemplateTokenizer(SimpleTokenizer):
+    """带 chat template 的测试 tokenizer"""
+
+    chat_template = "test"
+
+    def apply_chat_template(self, messages, tokenize=False, add_generation_prompt=True):
+        text = "".join(f"<|{m['role']}|> {m['content']} <|end|> " for m in messages)
+        return text + "<|assistant|>" if add_generation_prompt else text
+
+
+SYSTEM = {"role": "system", "content": "you are a helpful assistant"}
+
+
+def test_without_tokenizer_uses_legacy_template():
+    """没有 tokenizer 时退回 `role: content` 格式，不返回 token ids"""
+    messages = [{"role": "user", "content": "hi"}]
+    rendered = PromptRenderer().render(messages)
+
+    assert rendered.text == legacy_template(messages) == "user: hi\nassistant:"
+    assert rendered.token_ids is None
+
+
+def test_multi_turn_reuses_history_tokens():
+    """多轮对话复用上一轮的前缀 token，结果与整体分词一致"""
+    tokenizer = TemplateTokenizer()
+    renderer = PromptRenderer(tokenizer)
+
+    first = [SYSTEM, {"role": "user", "content": "write a function"}]
+    renderer.render(first)
+    encoded_before = renderer.stats["tokens_encoded"]
+
+    second = first + [
+        {"role": "assistant", "content": "def f(): pass"},
+        {"role": "user", "content": "add a docstring"},
+    ]
+    rendered = renderer.render(second)
+
+    assert rendered.text == tokenizer.apply_chat_template(second)
+    assert rendered.token_ids == tokenizer.encode(rendered.text)
+    assert renderer.stats["prefix_hits"] >= 2
+    # 第二轮只对新增的两条消息和生成提示分词
+    assert renderer.stats["tokens_encoded"] - encoded_before < len(rendered.token_ids) // 2 + 10
+
+
+def test_shared_system_prompt_prefix():
+    """不同会话共享相同 system prompt 的前缀 token"""
+    renderer = PromptRenderer(TemplateTokenizer())
+
+    a = renderer.render([SYSTEM, {"role": "user", "content": "one"}])
+    b = renderer.render([SYSTEM, {"role": "user", "content": "two"}])
+
+    system_len = len(TemplateTokenizer().encode(renderer.render_text([SYSTEM], False)))
+    assert a.token_ids[:system_len] == b.token_ids[:system_len]
+    assert renderer.get_stats()["cached_prefixes"] >= 3
@@ -0,0 +1,424 @@
+"""
+按 token 限流测试（未连接 Redis，使用进程内计数）
+"""
+import math
+import time
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from starlette.requests import ClientDisconnect
+
+from vlinders_server import ratelimit
+from vlinders_server.api import internal
+from vlinders_server.config import ModelConfig, config
+from vlinders_server.inference import vllm_service
+from vlinders_server.ratelimit import RateLimiter, RateLimitExceeded, UsageLimit, _LocalWindows
+
+
+HEADERS = {"X-Internal-Auth": "test"}
+
+
+class ScriptedRedis:
+    """
+    代替 Redis 执行限流脚本（本地没有 Redis 服务）：按脚本的参数和返回格式调用同一算法，
+    并记录每次调用
+    """
+
+    available = True
+
+    def __init__(self):
+        self.windows = _LocalWindows()
+        self.calls = []
+        self.clock = time.time
+
+    async def eval_script(self, script, keys, args):
+        assert script is ratelimit._WINDOW_SCRIPT
+        self.calls.append((list(keys), list(args)))
+        values = args[2:]
+        specs = [tuple(values[i:i + 3]) for i in range(0, len(values), 3)]
+        result = self.windows.evaluate(keys, specs, args[0], args[1] == "force", self.clock())
+        return [
+            int(result.allowed),
+            math.ceil(result.retry_after * 1000),
+            0 if result.exceeded is None else result.exceeded + 1,
+            *result.remaining
+        ]
+
+
+@pytest.fixture
+def redis_calls(monkeypatch) -> ScriptedRedis:
+    scripted = ScriptedRedis()
+    monkeypatch.setattr(ratelimit, "cache", scripted)
+    return scripted
+
+
+def limiter(tpm: int = 100, rpm: int = 0, tenant_tpm: int = 0) -> RateLimiter:
+    return RateLimiter([
+        UsageLimit("user", "requests", "minute", rpm),
+        UsageLimit("user", "tokens", "minute", tpm),
+        UsageLimit("tenant", "tokens", "minute", tenant_tpm),
+    ])
+
+
+async def test_rejection_counts_nothing():
+    """任一限额超出时整次预留都不计数，不占用其他限额"""
+    rate_limiter = limiter(tpm=100, tenant_tpm=150)
+
+    await rate_limiter.reserve("alice", "acme", 60)
+    with pytest.raises(RateLimitExceeded) as exc_info:
+        await rate_limiter.reserve("bob", "acme", 100)
+    assert exc_info.value.scope == "tenant"
+    assert 0 < exc_info.value.retry_after <= 120
+    # 租户内已用 60，剩余 90 不足 100
+    assert exc_info.value.remaining == 90
+
+    # bob 的用户计数未被计入，租户内还剩 90
+    await rate_limiter.reserve("bob", "acme", 90)
+    assert rate_limiter.get_stats()["rejected"] == 1
+
+
+async def test_reservation_checks_all_limits_in_one_script_call(redis_calls):
+    """user 和 tenant 的所有限额一次调用检查，拒绝时不再回滚；结算按实际用量强制计入"""
+    rate_limiter = limiter(tpm=100, rpm=5, tenant_tpm=150)
+
+    reservation = await rate_limiter.reserve("alice", "acme", 60)
+    with pytest.raises(RateLimitExceeded):
+        await rate_limiter.reserve("bob", "acme", 100)
+    assert len(redis_calls.calls) == 2
+    keys, args = redis_calls.calls[0]
+    assert keys == [
+        "ratelimit:sliding:user:{acme}:alice:requests:minute",
+        "ratelimit:sliding:user:{acme}:alice:tokens:minute",
+        "ratelimit:sliding:tenant:{acme}:tokens:minute",
+    ]
+    assert args == ["sliding", "check", 5, 60, 1, 100, 60, 60, 150, 60, 60]
+
+    await reservation.reconcile(120)
+    keys, args = redis_calls.calls[-1]
+    assert args == ["sliding", "force", 100, 60, 60, 150, 60, 60]
+    assert len(keys) == 2
+
+
+def hash_tag(key: str) -> str:
+    """Redis Cluster 计算 slot 所用的部分：第一个 {...} 中的内容"""
+    start = key.index("{")
+    return key[start + 1:key.index("}", start)]
+
+
+async def test_keys_of_one_script_call_share_a_hash_tag(redis_calls):
+    """Redis Cluster 中一次脚本调用的所有 key 必须在同一个 slot"""
+    rate_limiter = RateLimiter(
+        [
+            UsageLimit("user", "requests", "minute", 100),
+            UsageLimit("user", "tokens", "day", 10000),
+            UsageLimit("tenant", "tokens", "minute", 1000),
+        ],
+        max_error=0.2
+    )
+
+    reservation = await rate_limiter.reserve("alice", "acme", 60)
+    await reservation.reconcile(10)
+    await rate_limiter.reserve("bob", None, 60)
+    await rate_limiter.reserve("carol", "globex", 60)
+    await rate_limiter.release_leases()
+
+    assert len(redis_calls.calls) >= 5
+    for keys, _ in redis_calls.calls:
+        assert len({hash_tag(key) for key in keys}) == 1
+    tags = {hash_tag(keys[0]) for keys, _ in redis_calls.calls}
+    assert tags == {"acme", "bob", "globex"}
+
+
+async def test_reconcile_refunds_unused_tokens():
+    """按实际用量结算后，多预留的 token 可以再次使用"""
+    rate_limiter = limiter(tpm=100)
+
+    reservation = await rate_limiter.reserve("alice", None, 80)
+    with pytest.raises(RateLimitExceeded):
+        await rate_limiter.reserve("alice", None, 80)
+
+    await reservation.reconcile(20)
+    await reservation.reconcile(0)  # 只生效一次
+    await rate_limiter.reserve("alice", None, 80)
+    with pytest.raises(RateLimitExceeded):
+        await rate_limiter.reserve("alice", None, 1)
+
+
+async def test_request_larger_than_limit_is_rejected_without_queueing():
+    """单个请求超过 token 限额时不排队，直接拒绝"""
+    rate_limiter = limiter(tpm=100)
+    rate_limiter.queue_timeout = 3600
+
+    with pytest.raises(RateLimitExceeded):
+        await rate_limiter.reserve("alice", None, 101)
+    assert rate_limiter.get_stats()["queued"] == 0
+
+
+@pytest.fixture
+async def client(monkeypatch):
+    """开启限流并挂载内部路由"""
+    await vllm_service.load_model(
+        "sim-limited",
+        ModelConfig(
+            name="sim-limited",
+            path="simulated",
+            backend="simulated",
+            sim_prefill_latency=0.0,
+            sim_token_latency=0.0
+        )
+    )
+    monkeypatch.setattr(config.server, "rate_limit_enabled", True)
+    monkeypatch.setattr(internal, "rate_limiter", limiter(tpm=0, rpm=1))
+
+    app = FastAPI()
+    app.include_router(internal.router, prefix="/internal")
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as http_client:
+        yield http_client
+
+    await vllm_service.unload_model("sim-limited")
+
+
+async def test_api_returns_429_with_retry_after(client):
+    """超出限额时在开始生成前返回 429 和 Retry-After"""
+    for path in ("/internal/chat", "/internal/chat/stream"):
+        body = {
+            "model": "sim-limited",
+            "messages": [{"role": "user", "content": path}],
+            "max_tokens": 4,
+            "user_id": f"user-{path}"
+        }
+        assert (await client.post(path, json=body, headers=HEADERS)).status_code == 200
+
+        response = await client.post(path, json=body, headers=HEADERS)
+        assert response.status_code == 429
+        retry_after = int(response.headers["Retry-After"])
+        assert 1 <= retry_after <= 120
+        assert response.headers["X-RateLimit-Scope"] == "user:requests:minute"
+        assert response.headers["X-RateLimit-Limit"] == "1"
+        assert response.headers["X-RateLimit-Remaining"] == "0"
+        reset = int(response.headers["X-RateLimit-Reset"]) - time.time()
+        assert retry_after - 1 <= reset <= retry_after + 1
+
+
+def check(windows: _LocalWindows, algorithm: str, cost: int, now: float) -> tuple:
+    result = windows.evaluate(["k"], [(LIMIT, 60, cost)], algorithm, False, now)
+    return result.allowed, result.retry_after, result.remaining
+
+
+LIMIT = 10
+
+
+def test_sliding_window_weights_previous_window():
+    """滑动窗口：上一个窗口的计数按剩余比例计入，窗口边界不会放行 2 倍请求"""
+    windows = _LocalWindows()
+
+    for _ in range(10):
+        assert check(windows, "sliding", 1, now=59.0)[0]
+    # 要等到下一个窗口中本窗口的计数衰减到 9 以下
+    allowed, retry_after, _ = check(windows, "sliding", 1, now=59.5)
+    assert not allowed and retry_after == pytest.approx(6.5)
+
+    # 下一个窗口过去 1/4 时，上一个窗口还计 7.5 个
+    assert check(windows, "sliding", 1, now=75.0) == (True, 0.0, [1])
+    assert check(windows, "sliding", 1, now=75.0) == (True, 0.0, [0])
+    allowed, retry_after, remaining = check(windows, "sliding", 1, now=75.0)
+    assert not allowed and retry_after == pytest.approx(3.0) and remaining == [0]
+
+
+def test_gcra_spaces_requests_after_burst():
+    """GCRA：突发一个窗口的限额后，按 window / limit 的间隔放行"""
+    windows = _LocalWindows()
+
+    assert [check(windows, "gcra", 1, now=0.0)[2] for _ in range(10)] == [
+        [9], [8], [7], [6], [5], [4], [3], [2], [1], [0]
+    ]
+    assert check(windows, "gcra", 1, now=3.0) == (False, 3.0, [0])
+    assert check(windows, "gcra", 1, now=6.0)[0]
+    # 只查询不计数
+    assert check(windows, "gcra", 0, now=30.0) == (True, 0.0, [4])
+
+
+async def test_every_request_window_is_checked_in_one_call(redis_calls):
+    """任一窗口超限时拒绝且不计数，报告超限的窗口"""
+    rate_limiter = RateLimiter([
+        UsageLimit("user", "requests", "minute", 5),
+        UsageLimit("user", "requests", "hour", 3),
+    ])
+
+    for _ in range(3):
+        await rate_limiter.reserve("carol", None, 0)
+    with pytest.raises(RateLimitExceeded) as exc_info:
+        await rate_limiter.reserve("carol", None, 0)
+    assert exc_info.value.window == "hour"
+    assert len(redis_calls.calls) == 4
+
+
+async def test_cache_hits_count_against_limits(client, monkeypatch):
+    """缓存命中之前先计入请求数，命中返回的 token 也计入用量"""
+    monkeypatch.setattr(config.server, "completion_cache_enabled", True)
+    rate_limiter = RateLimiter([
+        UsageLimit("user", "requests", "minute", 2),
+        UsageLimit("user", "tokens", "minute", 1000),
+    ])
+    monkeypatch.setattr(internal, "rate_limiter", rate_limiter)
+    body = {
+        "model": "sim-limited",
+        "messages": [{"role": "user", "content": "cached"}],
+        "max_tokens": 4,
+        "temperature": 0.0,
+        "user_id": "heidi"
+    }
+
+    first = await client.post("/internal/chat", json=body, headers=HEADERS)
+    second = await client.post("/internal/chat", json=body, headers=HEADERS)
+    assert second.headers["X-Cache"] == "HIT"
+    keys = ["ratelimit:sliding:user:{heidi}:tokens:minute"]
+    used = first.json()["usage"]["total_tokens"] + second.json()["usage"]["total_tokens"]
+    check = await rate_limiter.store.evaluate(keys, [(1000, 60, 0)])
+    assert check.remaining == [1000 - used]
+
+    response = await client.post("/internal/chat", json=body, headers=HEADERS)
+    assert response.status_code == 429
+    assert response.headers["X-RateLimit-Scope"] == "user:requests:minute"
+
+
+async def test_leased_quota_is_consumed_locally_and_returned(redis_calls):
+    """租用的额度在本地消耗，只在租约用完时执行脚本；关闭时退还剩余额度"""
+    rate_limiter = RateLimiter(
+        [UsageLimit("user", "requests", "minute", 100)], max_error=0.2
+    )
+
+    for _ in range(45):
+        await rate_limiter.reserve("dave", None, 0)
+    assert len(redis_calls.calls) == 3
+    assert rate_limiter.get_stats()["local"] == 42
+
+    await rate_limiter.release_leases()
+    keys = ["ratelimit:sliding:user:{dave}:requests:minute"]
+    check = await rate_limiter.store.evaluate(keys, [(100, 60, 0)])
+    assert check.remaining == [55]
+
+
+async def test_lease_shrinks_near_the_limit():
+    """剩余额度不足一批时只租用剩余的部分，不会超出限额"""
+    rate_limiter = RateLimiter(
+        [UsageLimit("user", "requests", "minute", 50)], max_error=0.6
+    )
+
+    for _ in range(50):
+        await rate_limiter.reserve("erin", None, 0)
+    with pytest.raises(RateLimitExceeded):
+        await rate_limiter.reserve("erin", None, 0)
+
+
+async def test_reconcile_refunds_into_the_local_lease(redis_calls):
+    """结算退还的 token 先还到本地租约，攒满两批后才还给 Redis"""
+    rate_limiter = RateLimiter(
+        [UsageLimit("user", "tokens", "minute", 1000)], max_error=0.1
+    )
+
+    reservation = await rate_limiter.reserve("frank", None, 50)
+    await reservation.reconcile(10)
+    assert len(redis_calls.calls) == 1
+
+    # 租约里有 100 + 40 个 token，不够 150 时补足 10 并再租 100；
+    # 退还 150 后租约超过两批，多出一批的部分还给 Redis
+    reservation = await rate_limiter.reserve("frank", None, 150)
+    assert redis_calls.calls[-1][1] == ["sliding", "check", 1000, 60, 110]
+    await reservation.reconcile(0)
+    assert redis_calls.calls[-1][1] == ["sliding", "force", 1000, 60, -150]
+    assert len(redis_calls.calls) == 3
+
+
+async def test_chat_requests_consume_leased_quota(client, redis_calls, monkeypatch):
+    """/internal/chat 经过的限流器使用租约：请求数和 token 各租用一次后都在本地消耗"""
+    rate_limiter = RateLimiter(
+        [
+            UsageLimit("user", "requests", "minute", 1000),
+            UsageLimit("user", "tokens", "minute", 100000),
+            UsageLimit("tenant", "tokens", "minute", 100000),
+        ],
+        max_error=0.1
+    )
+    monkeypatch.setattr(internal, "rate_limiter", rate_limiter)
+
+    for i in range(20):
+        body = {
+            "model": "sim-limited",
+            "messages": [{"role": "user", "content": f"request {i}"}],
+            "max_tokens": 4,
+            "user_id": "grace",
+            "tenant_id": "acme"
+        }
+        response = await client.post("/internal/chat", json=body, headers=HEADERS)
+        assert response.status_code == 200
+
+    assert len(redis_calls.calls) == 2
+    assert rate_limiter.get_stats()["local"] == 38
+
+
+async def test_stream_settles_when_the_body_never_starts(client, monkeypatch):
+    """发送响应头失败（客户端已断开）时仍中止引擎请求并退还预留的 token"""
+    rate_limiter = limiter(tpm=1000)
+    monkeypatch.setattr(internal, "rate_limiter", rate_limiter)
+    request = internal.InternalChatRequest(
+        model="sim-limited",
+        messages=[{"role": "user", "content": "hello"}],
+        max_tokens=50,
+        user_id="ivan"
+    )
+    response = await internal.internal_chat_stream(request, {})
+    assert vllm_service.scheduler.get_stats("sim-limited")["active"] == 1
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        raise OSError("connection reset")
+
+    scope = {"type": "http", "asgi": {"spec_version": "2.4"}}
+    with pytest.raises(ClientDisconnect):
+        await response(scope, receive, send)
+
+    assert vllm_service.scheduler.get_stats("sim-limited")["active"] == 0
+    assert rate_limiter.get_stats()["reconciled_tokens"] == -50
+
+
+async def test_expired_lease_is_refunded_to_longer_windows(redis_calls, monkeypatch):
+    """稀疏的请求：租约在分钟窗口后过期，未用完的额度从天窗口中退还"""
+    now = [1_000_000.0]
+
+    class Clock:
+        @staticmethod
+        def monotonic():
+            return now[0]
+
+        @staticmethod
+        def time():
+            return now[0]
+
+    monkeypatch.setattr(ratelimit, "time", Clock)
+    redis_calls.clock = Clock.time
+    rate_limiter = RateLimiter(
+        [
+            UsageLimit("user", "tokens", "minute", 10000),
+            UsageLimit("user", "tokens", "day", 1000000),
+        ],
+        max_error=0.1
+    )
+
+    for _ in range(10):
+        reservation = await rate_limiter.reserve("judy", None, 100)
+        await reservation.reconcile(100)
+        now[0] += 120
+
+    # 已用 1000，另有最后一次租用的 1000（下次访问该标识或关闭时退还）
+    keys = ["ratelimit:sliding:user:{judy}:tokens:day"]
+    check = await rate_limiter.store.evaluate(keys, [(1000000, 86400, 0)])
+    assert check.remaining == [1000000 - 2000]
+
+    await rate_limiter.release_leases()
+    check = await rate_limiter.store.evaluate(keys, [(1000000, 86400, 0)])
+    assert check.remaining == [1000000 - 1000]
@@ -0,0 +1,32 @@
+"""
+前缀亲和路由测试
+"""
+from vlinders_server.inference.routing import PrefixAffinityRouter
+
+
+def test_same_prefix_routes_to_same_replica():
+    """共享前缀的请求落在同一副本，并计入前缀命中"""
+    router = PrefixAffinityRouter(4, block_tokens=8)
+    shared = list(range(8))
+
+    keys = [router.prefix_key("", shared + [100 + i]) for i in range(5)]
+    assert len(set(keys)) == 1
+
+    chosen = {router.choose(keys[0], [0, 0, 0, 0], cost=10) for _ in range(5)}
+    assert len(chosen) == 1
+
+    index = chosen.pop()
+    assert router.record(index, keys[0]) is False
+    assert router.record(index, keys[0]) is True
+    assert router.get_stats(index)["prefix_hit_rate"] == 0.5
+
+
+def test_hot_replica_spills_over():
+    """目标副本过载时选择其他副本"""
+    router = PrefixAffinityRouter(2, load_factor=1.0)
+    key = router.prefix_key("system prompt", None)
+    preferred = router.choose(key, [0, 0], cost=10)
+
+    loads = [0, 0]
+    loads[preferred] = 1000
+    assert router.choose(key, loads, cost=10) != preferred
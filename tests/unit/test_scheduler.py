@@ -0,0 +1,72 @@
+"""
+请求调度器测试
+"""
+import asyncio
+
+import pytest
+
+from vlinders_server.inference.scheduler import RequestScheduler, SchedulerOverloaded
+
+
+async def test_rejects_when_queue_full():
+    """并发槽位和队列都满时立即拒绝"""
+    scheduler = RequestScheduler()
+    scheduler.configure("m", max_concurrency=1, max_queue_size=1, queue_timeout=5)
+    release = asyncio.Event()
+
+    async def hold():
+        async with scheduler.slot("m"):
+            await release.wait()
+
+    holder = asyncio.create_task(hold())
+    queued = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+
+    with pytest.raises(SchedulerOverloaded) as exc_info:
+        async with scheduler.slot("m"):
+            pass
+
+    assert exc_info.value.reason == "queue full"
+    assert scheduler.queue_depth("m") == 1
+
+    release.set()
+    await asyncio.gather(holder, queued)
+    assert scheduler.get_stats("m")["active"] == 0
+
+
+async def test_queue_timeout():
+    """排队超时返回 SchedulerOverloaded"""
+    scheduler = RequestScheduler()
+    scheduler.configure("m", max_concurrency=1, max_queue_size=4, queue_timeout=0.01)
+
+    async with scheduler.slot("m"):
+        with pytest.raises(SchedulerOverloaded) as exc_info:
+            async with scheduler.slot("m"):
+                pass
+
+    assert exc_info.value.reason == "queue timeout"
+    assert scheduler.get_stats("m")["timed_out"] == 1
+
+
+async def test_high_priority_served_first_and_preempts_low():
+    """高优先级先获得槽位，队列满时淘汰低优先级请求"""
+    scheduler = RequestScheduler()
+    scheduler.configure("m", max_concurrency=1, max_queue_size=1, queue_timeout=5)
+    order = []
+
+    async def run(name, priority):
+        async with scheduler.slot("m", priority):
+            order.append(name)
+
+    async with scheduler.slot("m"):
+        low = asyncio.create_task(run("low", "low"))
+        await asyncio.sleep(0)
+        high = asyncio.create_task(run("high", "high"))
+        await asyncio.sleep(0)
+
+    await high
+    with pytest.raises(SchedulerOverloaded):
+        await low
+
+    assert order == ["high"]
+    assert scheduler.get_stats("m")["preempted"] == 1
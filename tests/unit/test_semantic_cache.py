@@ -0,0 +1,128 @@
+"""
+语义缓存与向量索引测试
+"""
+import asyncio
+
+import numpy as np
+import pytest
+
+from vlinders_server.config import EmbeddingConfig, ModelConfig, config
+from vlinders_server.inference.embeddings import embedding_service
+from vlinders_server.inference.semantic_cache import SemanticCache
+from vlinders_server.inference.vector_index import VectorIndex
+
+
+def unit_vectors(count: int, dimension: int = 16, seed: int = 0) -> np.ndarray:
+    vectors = np.random.default_rng(seed).normal(size=(count, dimension)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize("ivf_threshold", [10**9, 100])
+def test_vector_index_finds_nearest(ivf_threshold):
+    """暴力搜索与 IVF 都能找到最近的向量，删除后不再返回"""
+    vectors = unit_vectors(500)
+    index = VectorIndex(16, ivf_threshold=ivf_threshold, nprobe=32)
+    for i, vector in enumerate(vectors):
+        index.add(i, vector)
+    assert index.uses_ivf == (ivf_threshold == 100)
+
+    assert index.search(vectors[123])[0][0] == 123
+    index.remove(123)
+    assert len(index) == 499
+    assert index.search(vectors[123])[0][0] != 123
+    assert index.search(vectors[499])[0][0] == 499
+
+
+@pytest.fixture
+async def cache(monkeypatch):
+    """开启语义缓存并使用 hash 嵌入后端"""
+    monkeypatch.setattr(config.server, "semantic_cache_enabled", True)
+    monkeypatch.setattr(config.server, "semantic_cache_verify_rate", 0.0)
+    embedding_service.start_loading(EmbeddingConfig(backend="hash", dimension=256))
+    yield SemanticCache()
+    await embedding_service.shutdown()
+
+
+def model_config(**overrides) -> ModelConfig:
+    values = {"name": "m", "path": "simulated", "semantic_cache": True}
+    values.update(overrides)
+    return ModelConfig(**values)
+
+
+def chat(question: str, system: str = "be brief") -> list:
+    return [{"role": "system", "content": system}, {"role": "user", "content": question}]
+
+
+async def test_near_duplicate_question_hits(cache):
+    """措辞差异（大小写、空白）命中，系统 prompt 不同则不命中"""
+    params = {"max_tokens": 16}
+    query = await cache.prepare(model_config(), chat("How do I reverse a list?"), params)
+    assert await cache.lookup(query) is None
+    await cache.store(query, {"text": "use reversed()", "finish_reason": "stop", "usage": {}})
+
+    similar = await cache.prepare(model_config(), chat("how do I  reverse a LIST"), params)
+    hit = await cache.lookup(similar)
+    assert hit is not None and hit.response["text"] == "use reversed()"
+
+    other_system = await cache.prepare(
+        model_config(), chat("How do I reverse a list?", system="be verbose"), params
+    )
+    assert await cache.lookup(other_system) is None
+    assert cache.get_stats()["hits"] == 1
+    assert cache.get_stats()["misses"] == 2
+
+
+async def test_disabled_model_and_expired_entries(cache):
+    """未开启的模型不参与；过期条目不再命中"""
+    assert await cache.prepare(model_config(semantic_cache=False), chat("hi"), {}) is None
+
+    query = await cache.prepare(model_config(semantic_cache_ttl=0), chat("hi there"), {})
+    await cache.store(query, {"text": "hello", "finish_reason": "stop", "usage": {}})
+    assert await cache.lookup(query) is None
+    assert cache.get_stats()["entries"] == 0
+
+
+async def test_false_hit_is_detected_and_evicted(cache, monkeypatch):
+    """抽样验证发现回答不一致时记为误命中并删除条目"""
+    monkeypatch.setattr(config.server, "semantic_cache_verify_rate", 1.0)
+    query = await cache.prepare(model_config(), chat("what is the capital"), {})
+    await cache.store(query, {"text": "paris france", "finish_reason": "stop", "usage": {}})
+
+    hit = await cache.lookup(query)
+
+    async def regenerate():
+        return "completely different answer"
+
+    cache.maybe_verify(query, hit, regenerate)
+    await asyncio.gather(*cache._background)
+
+    assert cache.get_stats()["false_hits"] == 1
+    assert cache.get_stats()["entries"] == 0
+
+
+async def test_reworded_answer_is_not_a_false_hit(cache, monkeypatch):
+    """重新生成的回答措辞不同但仍一致时保留条目（与问题的命中阈值无关）"""
+    monkeypatch.setattr(config.server, "semantic_cache_verify_rate", 1.0)
+    monkeypatch.setattr(config.server, "semantic_cache_agreement_threshold", 0.5)
+    query = await cache.prepare(model_config(), chat("what is the capital"), {"temperature": 0.7})
+    await cache.store(query, {"text": "paris france", "finish_reason": "stop", "usage": {}})
+
+    async def regenerate():
+        return "the capital is paris france"
+
+    cache.maybe_verify(query, await cache.lookup(query), regenerate)
+    await asyncio.gather(*cache._background)
+
+    assert cache.get_stats()["false_hits"] == 0
+    assert cache.get_stats()["entries"] == 1
+
+
+async def test_multi_turn_requests_bypass_the_cache(cache):
+    """命名空间只含系统 prompt，带对话历史的请求不经过语义缓存"""
+    history = [
+        {"role": "system", "content": "be brief"},
+        {"role": "user", "content": "let's talk about python"},
+        {"role": "assistant", "content": "sure"},
+        {"role": "user", "content": "how do I reverse a list?"},
+    ]
+    assert await cache.prepare(model_config(), history, {}) is None
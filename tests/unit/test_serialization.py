@@ -0,0 +1,62 @@
+"""
+响应序列化测试
+"""
+import importlib
+import json
+import sys
+
+import pytest
+
+from vlinders_server.api import serialization
+
+
+TEXT = 'line "one"\n\ttab \\ 中文   end'
+
+
+def parse_event(event: bytes) -> dict:
+    assert event.startswith(b"data: ") and event.endswith(b"\n\n")
+    return json.loads(event[len(b"data: "):])
+
+
+@pytest.fixture(params=["orjson", "stdlib"])
+def module(request):
+    """分别使用 orjson 和标准库 json 后端"""
+    if request.param == "orjson":
+        pytest.importorskip("orjson")
+        yield serialization
+        return
+
+    saved = sys.modules.get("orjson")
+    sys.modules["orjson"] = None
+    try:
+        yield importlib.reload(serialization)
+    finally:
+        if saved is not None:
+            sys.modules["orjson"] = saved
+        else:
+            sys.modules.pop("orjson", None)
+        importlib.reload(serialization)
+
+
+def test_chunk_encoder_matches_chunk_schema(module):
+    """预编码外层 + delta 与完整构建的块等价"""
+    encoder = module.ChunkEncoder("model-\"x\"", response_id="chatcmpl_1")
+
+    first = parse_event(encoder.encode(TEXT))
+    last = parse_event(encoder.encode("", "tool_calls", [1, 2]))
+
+    assert first == {
+        "id": "chatcmpl_1",
+        "object": "chat.completion.chunk",
+        "created": first["created"],
+        "model": "model-\"x\"",
+        "choices": [{"index": 0, "delta": {"content": TEXT}, "finish_reason": None}],
+    }
+    assert last["created"] == first["created"]
+    assert last["choices"][0]["delta"] == {"content": "", "token_ids": [1, 2]}
+    assert last["choices"][0]["finish_reason"] == "tool_calls"
+
+
+def test_sse_event_and_dumps_are_compact_utf8(module):
+    assert parse_event(module.sse_event({"error": TEXT})) == {"error": TEXT}
+    assert module.dumps({"a": [1, "中"]}) == '{"a":[1,"中"]}'.encode("utf-8")
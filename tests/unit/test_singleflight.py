@@ -0,0 +1,109 @@
+"""
+在途请求合并测试
+"""
+import asyncio
+
+from vlinders_server.inference.singleflight import SingleFlight
+
+
+async def test_do_coalesces_concurrent_calls():
+    """相同 key 的并发调用只执行一次"""
+    flight = SingleFlight()
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "result"
+
+    results = await asyncio.gather(*[flight.do("k", work) for _ in range(5)])
+
+    assert results == ["result"] * 5
+    assert calls == 1
+    assert flight.stats["leaders"] == 1
+    assert flight.stats["hits"] == 4
+    assert flight.in_flight() == 0
+
+
+async def test_do_survives_single_waiter_cancellation():
+    """一个等待者被取消不影响其他等待者"""
+    flight = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.02)
+        return 42
+
+    first = asyncio.create_task(flight.do("k", work))
+    second = asyncio.create_task(flight.do("k", work))
+    await asyncio.sleep(0)
+    first.cancel()
+
+    assert await second == 42
+
+
+async def test_stream_replays_to_late_subscribers():
+    """后加入的订阅者收到完整的流"""
+    flight = SingleFlight()
+    started = asyncio.Event()
+
+    async def source():
+        for i in range(3):
+            yield i
+            started.set()
+            await asyncio.sleep(0.01)
+
+    async def collect():
+        return [chunk async for chunk in flight.stream("k", source)]
+
+    first = asyncio.create_task(collect())
+    await started.wait()
+    second = asyncio.create_task(collect())
+
+    assert await first == [0, 1, 2]
+    assert await second == [0, 1, 2]
+    assert flight.stats["stream_leaders"] == 1
+    assert flight.stats["stream_hits"] == 1
+
+
+async def test_new_call_does_not_join_a_cancelling_task():
+    """最后一个等待者取消后、任务结束前到达的相同请求重新执行，不会收到 CancelledError"""
+    flight = SingleFlight()
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        try:
+            await asyncio.sleep(0.05)
+        except asyncio.CancelledError:
+            await asyncio.sleep(0.02)  # 取消需要一段时间才完成
+            raise
+        return calls
+
+    first = asyncio.create_task(flight.do("k", work))
+    await asyncio.sleep(0)
+    first.cancel()
+    await asyncio.sleep(0)
+
+    assert await flight.do("k", work) == 2
+
+
+async def test_new_stream_does_not_join_a_closing_stream():
+    """最后一个订阅者离开后、流结束前到达的相同请求重新开始一个流"""
+    flight = SingleFlight()
+
+    async def source():
+        try:
+            for i in range(3):
+                yield i
+                await asyncio.sleep(0.01)
+        finally:
+            await asyncio.sleep(0.02)  # 中止引擎请求需要一段时间
+
+    chunks = flight.stream("k", source)
+    assert await chunks.__anext__() == 0
+    await chunks.aclose()
+
+    assert [chunk async for chunk in flight.stream("k", source)] == [0, 1, 2]
+    assert flight.stats["stream_leaders"] == 2
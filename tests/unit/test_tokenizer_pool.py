@@ -0,0 +1,52 @@
+"""
+分词线程池测试
+"""
+import asyncio
+import threading
+
+import pytest
+
+from vlinders_server.inference.backends.simulated import SimpleTokenizer
+from vlinders_server.inference.tokenizer_pool import TokenizerPool
+
+
+class RecordingTokenizer(SimpleTokenizer):
+    """记录调用线程的分词器"""
+
+    def __init__(self):
+        self.threads = set()
+
+    def encode(self, text, add_special_tokens=True):
+        self.threads.add(threading.get_ident())
+        return super().encode(text, add_special_tokens)
+
+
+async def test_concurrent_encodes_are_batched_off_the_event_loop():
+    """同时到达的 encode 合并为一批，并在模型自己的线程上执行"""
+    tokenizer = RecordingTokenizer()
+    pool = TokenizerPool(max_batch=8)
+    pool.register("m", tokenizer)
+
+    results = await asyncio.gather(*(pool.encode("m", f"word {i}") for i in range(20)))
+
+    assert [len(ids) for ids in results] == [2] * 20
+    assert len(tokenizer.threads) == 1
+    assert threading.get_ident() not in tokenizer.threads
+    assert results[3] == tokenizer.encode("word 3")
+    stats = pool.get_stats()["m"]
+    assert stats["encodes"] == 20
+    assert stats["batches"] == 3
+    assert stats["max_batch"] == 8
+
+    pool.remove("m")
+    with pytest.raises(ValueError):
+        await pool.encode("m", "hello")
+
+
+async def test_run_without_tokenizer_executes_inline():
+    """没有 tokenizer 的模型直接执行"""
+    pool = TokenizerPool()
+    pool.register("m", None)
+
+    assert not pool.has_tokenizer("m")
+    assert await pool.run("m", lambda: threading.get_ident()) == threading.get_ident()
@@ -0,0 +1,92 @@
+"""
+链路追踪测试（内存导出器）
+"""
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from vlinders_server.api.internal import router
+from vlinders_server.config import ModelConfig
+from vlinders_server.inference import vllm_service
+from vlinders_server.tracing import TracingMiddleware, tracing
+
+
+HEADERS = {"X-Internal-Auth": "test"}
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+TRACEPARENT = f"00-{TRACE_ID}-00f067aa0ba902b7-01"
+
+
+@pytest.fixture
+async def client():
+    """挂载带追踪中间件的内部路由并加载一个模拟模型"""
+    await vllm_service.load_model(
+        "sim-traced",
+        ModelConfig(
+            name="sim-traced",
+            path="simulated",
+            backend="simulated",
+            sim_prefill_latency=0.0,
+            sim_token_latency=0.0
+        )
+    )
+
+    app = FastAPI()
+    app.add_middleware(TracingMiddleware)
+    app.include_router(router, prefix="/internal")
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as http_client:
+        yield http_client
+
+    tracing.shutdown()
+    await vllm_service.unload_model("sim-traced")
+
+
+def chat_body(content: str = "hello") -> dict:
+    return {
+        "model": "sim-traced",
+        "messages": [{"role": "user", "content": content}],
+        "max_tokens": 4,
+        "temperature": 0.5
+    }
+
+
+async def test_stream_request_records_stage_spans(client):
+    """每个阶段一个子 span，trace id 沿用 traceparent 头"""
+    tracing.setup(exporter="memory", sample_rate=1.0)
+
+    response = await client.post(
+        "/internal/chat/stream",
+        json=chat_body(),
+        headers={**HEADERS, "traceparent": TRACEPARENT, "X-Request-ID": "api-123"}
+    )
+    assert response.status_code == 200
+
+    spans = {span.name: span for span in tracing.memory_exporter.get_finished_spans()}
+    root = spans["POST /internal/chat/stream"]
+    assert set(spans) == {
+        "POST /internal/chat/stream", "auth", "render_prompt", "queue", "prefill", "decode", "sse"
+    }
+    assert all(format(span.context.trace_id, "032x") == TRACE_ID for span in spans.values())
+    assert all(
+        span.parent.span_id == root.context.span_id
+        for name, span in spans.items() if name != root.name
+    )
+    assert root.attributes["vlinders.request_id"] == "api-123"
+    assert root.attributes["gen_ai.request.model"] == "sim-traced"
+    assert spans["decode"].attributes["gen_ai.usage.output_tokens"] == 4
+    assert spans["sse"].attributes["vlinders.sse.events"] >= 1
+    assert spans["prefill"].end_time <= spans["decode"].start_time
+
+
+async def test_unsampled_requests_record_nothing(client):
+    """采样比例为 0 时不导出任何 span；上游已采样的请求仍然记录"""
+    tracing.setup(exporter="memory", sample_rate=0.0)
+
+    await client.post("/internal/chat", json=chat_body(), headers=HEADERS)
+    assert tracing.memory_exporter.get_finished_spans() == ()
+
+    await client.post(
+        "/internal/chat", json=chat_body("again"), headers={**HEADERS, "traceparent": TRACEPARENT}
+    )
+    names = {span.name for span in tracing.memory_exporter.get_finished_spans()}
+    assert {"POST /internal/chat", "queue", "prefill", "decode"} <= names
@@ -1,13 +1,21 @@
 """
 健康检查端点
 """
-from fastapi import APIRouter
+from fastapi import APIRouter, Response
+from fastapi.responses import JSONResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from pydantic import BaseModel
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
-# TODO: 在 vLLM 和 torch 安装完成后启用
-# import torch
-# from ..inference import vllm_service
+from ..cache import cache
+from ..config import config
+from ..inference import vllm_service
+
+# torch 为可选依赖：使用模拟后端时可以不安装
+try:
+    import torch
+except ImportError:
+    torch = None
 
 
 router = APIRouter()
@@ -21,6 +29,9 @@ class HealthResponse(BaseModel):
     gpu_available: bool
     gpu_count: int
     gpu_info: List[Dict[str, Any]]
+    replicas: Dict[str, List[Dict[str, Any]]] = {}
+    # 依赖服务状态（redis: connected / degraded / disconnected），不影响就绪判断
+    dependencies: Dict[str, str] = {}
 
 
 @router.get("/health", response_model=HealthResponse)
@@ -31,13 +42,18 @@ async def health_check() -> HealthResponse:
     返回服务状态、已加载模型、GPU 信息等
     """
 
-    # TODO: 在 torch 安装完成后启用 GPU 检测
-    gpu_available = False
-    gpu_count = 0
-    gpu_info = []
+    gpu_available = torch is not None and torch.cuda.is_available()
+    gpu_count = torch.cuda.device_count() if gpu_available else 0
+    gpu_info = [
+        {
+            "id": i,
+            "name": torch.cuda.get_device_name(i),
+            "memory_total": torch.cuda.get_device_properties(i).total_memory
+        }
+        for i in range(gpu_count)
+    ]
 
-    # TODO: 在 vLLM 安装完成后启用模型检测
-    models_loaded = []
+    models_loaded = vllm_service.list_models()
 
     return HealthResponse(
         status="healthy",
@@ -45,7 +61,9 @@ async def health_check() -> HealthResponse:
         model_count=len(models_loaded),
         gpu_available=gpu_available,
         gpu_count=gpu_count,
-        gpu_info=gpu_info
+        gpu_info=gpu_info,
+        replicas=vllm_service.replica_stats(),
+        dependencies={"redis": cache.state}
     )
 
 
@@ -54,18 +72,37 @@ async def readiness_check():
     """
     就绪检查端点
 
-    用于 Kubernetes 就绪探针
+    用于 Kubernetes 就绪探针：未就绪时返回 503（探针只看状态码）
     """
 
-    # TODO: 在 vLLM 安装完成后启用模型检测
-    models = []
+    models = vllm_service.model_states()
 
     if not models:
-        return {"ready": False, "reason": "No models loaded (vLLM not installed)"}
+        return not_ready("No models configured")
+
+    # 必需模型（默认为全部 eager 模型）必须已加载；其余模型可以稍后加载或按需加载
+    required = config.server.required_model_names or [
+        name for name, model_config in vllm_service.catalog.items()
+        if model_config.load_policy == "eager"
+    ]
+    unknown = [name for name in required if name not in models]
+    if unknown:
+        return not_ready(f"Required models not configured: {unknown}")
+
+    pending = [name for name in required if models[name] != "loaded"]
+    if pending:
+        return not_ready(f"Models not loaded: {pending}", models)
 
     return {"ready": True, "models": models}
 
 
+def not_ready(reason: str, models: Optional[Dict[str, str]] = None) -> JSONResponse:
+    content: Dict[str, Any] = {"ready": False, "reason": reason}
+    if models is not None:
+        content["models"] = models
+    return JSONResponse(status_code=503, content=content)
+
+
 @router.get("/live")
 async def liveness_check():
     """
@@ -75,3 +112,14 @@ async def liveness_check():
     """
 
     return {"alive": True}
+
+
+@router.get("/metrics")
+async def metrics() -> Response:
+    """
+    Prometheus 指标端点
+
+    每个 worker 进程各自统计；多 worker 部署时需按进程分别采集
+    """
+
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
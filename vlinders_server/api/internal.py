@@ -1,19 +1,36 @@
 """
 内部 API 端点
 """
-import uuid
-from typing import List, Dict, Any, Optional
-from fastapi import APIRouter, Header, HTTPException, Depends
+import asyncio
+import math
+import time
+from contextlib import ExitStack
+from typing import List, Dict, Any, Awaitable, Callable, Literal, Optional, Tuple
+from fastapi import APIRouter, Header, HTTPException, Depends, Request
 from fastapi.responses import StreamingResponse
+from opentelemetry import trace
 from pydantic import BaseModel, Field
 
+from ..auth import auth_service
 from ..config import config
+from ..ratelimit import RateLimitExceeded, Reservation, rate_limiter
+from ..tracing import tracing
 from ..utils import logger
-from ..inference import vllm_service
+from ..inference import vllm_service, GenerationResult, SchedulerOverloaded
+from ..inference.prompt import RenderedPrompt
+from ..inference.completion_cache import completion_cache
+from ..inference.embeddings import embedding_service
+from ..inference.semantic_cache import semantic_cache
+from .serialization import (
+    SSE_DONE, ChunkEncoder, FastJSONResponse, chat_completion, dumps, sse_event
+)
 
 
 router = APIRouter()
 
+# 非流式请求检查客户端是否断开的间隔（秒）
+DISCONNECT_POLL_INTERVAL = 0.5
+
 
 # ==================== 请求/响应模型 ====================
 
@@ -31,8 +48,14 @@ class InternalChatRequest(BaseModel):
     temperature: float = Field(default=0.7, ge=0.0, le=2.0)
     top_p: float = Field(default=0.95, ge=0.0, le=1.0)
     stop: Optional[List[str]] = None
+    seed: Optional[int] = None
     stream: bool = False
+    priority: Literal["high", "normal", "low"] = "normal"
+    return_token_ids: bool = False
+    # 截止时间（秒，含排队），超时后中止生成；为空时使用 REQUEST_TIMEOUT
+    timeout: Optional[float] = Field(default=None, gt=0)
     user_id: Optional[str] = None
+    tenant_id: Optional[str] = None
 
 
 class ChatChoice(BaseModel):
@@ -59,6 +82,18 @@ class InternalChatResponse(BaseModel):
     usage: ChatUsage
 
 
+class InternalChatBatchRequest(BaseModel):
+    """批量聊天请求"""
+    requests: List[InternalChatRequest] = Field(min_length=1, max_length=1024)
+    stream: bool = False
+
+
+class InternalTokenizeRequest(BaseModel):
+    """分词计数请求"""
+    model: str
+    conversations: List[List[Message]] = Field(min_length=1, max_length=1024)
+
+
 class InternalEmbeddingRequest(BaseModel):
     """内部嵌入请求"""
     model: str = "default"
@@ -67,16 +102,288 @@ class InternalEmbeddingRequest(BaseModel):
 
 # ==================== 认证 ====================
 
-def verify_internal_auth(x_internal_auth: str = Header(...)) -> None:
-    """验证内部请求认证"""
+async def verify_internal_auth(x_internal_auth: str = Header(...)) -> dict:
+    """
+    验证内部请求认证（内部密钥或服务 token）
+
+    请求体中的 user_id / tenant_id 由调用方（Vlinders-API）代填并用于限流，
+    因此不接受用户 token；未设置 INTERNAL_SECRET 时跳过认证（开发环境）。
+    在事件循环中执行（不放到线程池），验证结果缓存不会被并发修改
+    """
+
+    with tracing.span("auth"):
+        return auth_service.authenticate(
+            x_internal_auth, failure_status=403, internal_only=True, allow_unconfigured=True
+        )
+
+
+def overloaded_exception(e: SchedulerOverloaded) -> HTTPException:
+    """调度器拒绝请求时返回 503，并告知 API 层多久后重试"""
+
+    logger.warning(f"Request rejected by scheduler: {e}")
+    return HTTPException(
+        status_code=503,
+        detail=str(e),
+        headers={
+            "Retry-After": str(vllm_service.scheduler.retry_after(e.model)),
+            "X-Queue-Depth": str(vllm_service.scheduler.queue_depth(e.model))
+        }
+    )
+
+
+def rate_limit_exception(e: RateLimitExceeded) -> HTTPException:
+    """超出请求数或 token 限额时返回 429（Reset 为可以重试的 Unix 时间戳）"""
+
+    retry_after = max(math.ceil(e.retry_after), 1)
+    return HTTPException(
+        status_code=429,
+        detail=str(e),
+        headers={
+            "Retry-After": str(retry_after),
+            "X-RateLimit-Scope": f"{e.scope}:{e.kind}:{e.window}",
+            "X-RateLimit-Limit": str(e.limit),
+            "X-RateLimit-Remaining": str(e.remaining),
+            "X-RateLimit-Reset": str(math.ceil(time.time()) + retry_after)
+        }
+    )
+
+
+async def admit_request(request: InternalChatRequest) -> None:
+    """
+    计入一次请求（在查缓存之前，缓存命中同样受请求数限额约束）
+
+    Raises:
+        RateLimitExceeded: 超出 user / tenant 的请求数限额
+    """
+
+    if config.server.rate_limit_enabled:
+        await rate_limiter.reserve(request.user_id or "anonymous", request.tenant_id, 0)
+
+
+async def reserve_tokens(
+    request: InternalChatRequest,
+    prompt: RenderedPrompt,
+    requests: int = 1
+) -> Optional[Reservation]:
+    """
+    计入 requests 个请求，并按 prompt + 生成长度预留 token（未开启限流时为 None）
+
+    Raises:
+        RateLimitExceeded: 超出 user / tenant 的请求数或 token 限额
+    """
+
+    if not config.server.rate_limit_enabled:
+        return None
+    return await rate_limiter.reserve(
+        request.user_id or "anonymous",
+        request.tenant_id,
+        prompt.num_tokens + (prompt.max_tokens or request.max_tokens),
+        requests=requests
+    )
+
+
+async def record_usage(request: InternalChatRequest, result: GenerationResult) -> None:
+    """计入缓存命中返回的 token 数（不检查限额，超出时影响之后的请求）"""
+
+    if config.server.rate_limit_enabled:
+        await rate_limiter.record(
+            request.user_id or "anonymous", request.tenant_id, result.usage["total_tokens"]
+        )
+
+
+async def render_prompt(request: InternalChatRequest) -> RenderedPrompt:
+    """
+    按模型的 chat template 渲染 prompt（按需模型会在此加载）
+
+    超出上下文窗口的消息会被裁剪，生成长度使用 RenderedPrompt.max_tokens
+    """
+
+    with tracing.span("render_prompt", {"gen_ai.request.model": request.model}) as span:
+        prompt = await vllm_service.render_prompt(
+            request.model,
+            [msg.model_dump() for msg in request.messages],
+            max_tokens=request.max_tokens
+        )
+        if prompt.token_ids is not None:
+            span.set_attribute("gen_ai.usage.input_tokens", len(prompt.token_ids))
+        span.set_attribute("vlinders.dropped_messages", prompt.dropped_messages)
+        return prompt
+
+
+def error_status(e: Exception) -> int:
+    """推理异常对应的 HTTP 状态码"""
+
+    if isinstance(e, SchedulerOverloaded):
+        return 503
+    if isinstance(e, RateLimitExceeded):
+        return 429
+    if isinstance(e, TimeoutError):
+        return 504
+    if isinstance(e, ValueError):
+        return 404
+    return 500
+
+
+async def generate_chat(
+    request: InternalChatRequest,
+    rate_limited: bool = True
+) -> GenerationResult:
+    """
+    渲染 prompt 并调用推理服务（不经过缓存）
+
+    请求数已由 complete_chat 在查缓存之前计入，这里只预留 token
+
+    Args:
+        rate_limited: 是否计入请求方的限额（后台校验等服务端发起的生成不计入）
+    """
+
+    # 从渲染 prompt 到生成结束，模型不会被卸载
+    with vllm_service.hold(request.model):
+        prompt = await render_prompt(request)
+        reservation = await reserve_tokens(request, prompt, requests=0) if rate_limited else None
+        try:
+            result = await vllm_service.generate(
+                model=request.model,
+                prompt=prompt.text,
+                prompt_token_ids=prompt.token_ids,
+                max_tokens=prompt.max_tokens or request.max_tokens,
+                temperature=request.temperature,
+                top_p=request.top_p,
+                stop=request.stop,
+                stream=False,
+                seed=request.seed,
+                priority=request.priority,
+                timeout=request.timeout
+            )
+        except BaseException:
+            if reservation is not None:
+                await asyncio.shield(reservation.release())
+            raise
+
+    if reservation is not None:
+        await reservation.reconcile(result.usage["total_tokens"])
+    return result
+
+
+async def complete_chat(request: InternalChatRequest) -> Tuple[GenerationResult, Optional[str]]:
+    """
+    执行一次非流式聊天
+
+    Returns:
+        (生成结果, 缓存状态 HIT / SEMANTIC / MISS，未经过任何缓存时为 None)
+    """
+
+    await admit_request(request)
+
+    messages = [msg.model_dump() for msg in request.messages]
+    params = {
+        "max_tokens": request.max_tokens,
+        "temperature": request.temperature,
+        "top_p": request.top_p,
+        "stop": request.stop,
+        "seed": request.seed
+    }
+
+    # 确定性请求先查补全缓存
+    cache_key = None
+    if (
+        config.server.completion_cache_enabled
+        and completion_cache.is_cacheable(request.temperature, request.seed)
+    ):
+        cache_key = completion_cache.make_key(request.model, messages, params)
+        cached = await completion_cache.get(request.model, cache_key)
+        if cached:
+            result = GenerationResult(**cached)
+            await record_usage(request, result)
+            return result, "HIT"
+
+    # 再查语义缓存（按模型开启）
+    semantic_query = await semantic_cache.prepare(
+        vllm_service.catalog.get(request.model), messages, params
+    )
+    if semantic_query is not None:
+        hit = await semantic_cache.lookup(semantic_query)
+        if hit is not None:
+            async def regenerate() -> str:
+                fresh = await generate_chat(
+                    request.model_copy(update={"priority": "low"}), rate_limited=False
+                )
+                return fresh.text
+
+            semantic_cache.maybe_verify(semantic_query, hit, regenerate)
+            result = GenerationResult(**hit.response)
+            await record_usage(request, result)
+            return result, "SEMANTIC"
+
+    # 调用推理服务
+    result = await generate_chat(request)
+    response = {
+        "text": result.text,
+        "finish_reason": result.finish_reason,
+        "usage": result.usage
+    }
+
+    if semantic_query is not None:
+        await semantic_cache.store(semantic_query, response)
+    if cache_key is not None:
+        await completion_cache.set(request.model, cache_key, response)
+
+    if cache_key is None and semantic_query is None:
+        return result, None
+    return result, "MISS"
+
+
+def batch_concurrency(model: str) -> int:
+    """
+    批量请求中同一模型同时送入调度器的条目数
+
+    并发槽位加一半排队容量：其余条目在本地等待，不会挤满调度队列被拒绝（503），
+    另一半队列留给其他请求
+    """
+
+    model_config = vllm_service.catalog.get(model)
+    if model_config is None:
+        return 1
+    return max(model_config.max_concurrency + model_config.max_queue_size // 2, 1)
+
+
+async def cancel_on_disconnect(http_request: Request, task: asyncio.Task) -> Any:
+    """
+    等待任务完成；客户端提前断开时取消任务（引擎中的请求随之中止）
+
+    Raises:
+        HTTPException(499): 客户端已断开
+    """
 
-    if not config.server.internal_secret:
-        logger.warning("INTERNAL_SECRET not set, skipping authentication")
-        return
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await http_request.is_disconnected():
+                logger.info("Client disconnected, cancelling generation")
+                raise HTTPException(status_code=499, detail="Client disconnected")
+    finally:
+        task.cancel()
+
+
+class CleanupStreamingResponse(StreamingResponse):
+    """
+    结束后总是执行 cleanup 的流式响应
 
-    if x_internal_auth != config.server.internal_secret:
-        logger.warning("Invalid internal authentication")
-        raise HTTPException(status_code=403, detail="Forbidden")
+    正文生成器没开始迭代就结束时（发送响应头失败、被取消）其 finally 不会执行，
+    引擎请求和预留的 token 由这里释放
+    """
+
+    def __init__(self, content: Any, cleanup: Callable[[], Awaitable[None]], **kwargs: Any):
+        super().__init__(content, **kwargs)
+        self.cleanup = cleanup
+
+    async def __call__(self, scope: Any, receive: Any, send: Any) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await asyncio.shield(self.cleanup())
 
 
 # ==================== API 端点 ====================
@@ -84,54 +391,52 @@ def verify_internal_auth(x_internal_auth: str = Header(...)) -> None:
 @router.post("/chat", response_model=InternalChatResponse)
 async def internal_chat(
     request: InternalChatRequest,
-    _: None = Depends(verify_internal_auth)
-) -> InternalChatResponse:
+    http_request: Request,
+    _: dict = Depends(verify_internal_auth)
+) -> FastJSONResponse:
     """
     内部聊天接口（非流式）
 
     接收来自 Vlinders-API 的聊天请求，返回模型生成的响应
+    （直接编码，不经过 InternalChatResponse 校验，response_model 仅用于文档）
     """
 
     logger.info(f"Received chat request: model={request.model}, user={request.user_id}")
-
-    # 构建 prompt（简化版，实际应该使用模型的 chat template）
-    prompt = "\n".join([f"{msg.role}: {msg.content}" for msg in request.messages])
-    prompt += "\nassistant:"
+    trace.get_current_span().set_attribute("gen_ai.request.model", request.model)
 
     try:
-        # 调用推理服务
-        result = await vllm_service.generate(
-            model=request.model,
-            prompt=prompt,
-            max_tokens=request.max_tokens,
-            temperature=request.temperature,
-            top_p=request.top_p,
-            stop=request.stop,
-            stream=False
+        result, cache_status = await cancel_on_disconnect(
+            http_request, asyncio.create_task(complete_chat(request))
         )
 
-        # 构建响应
-        import time
-        response = InternalChatResponse(
-            id=f"chatcmpl_{uuid.uuid4().hex[:8]}",
-            created=int(time.time()),
-            model=request.model,
-            choices=[
-                ChatChoice(
-                    message=Message(role="assistant", content=result.text),
-                    finish_reason=result.finish_reason
-                )
-            ],
-            usage=ChatUsage(**result.usage)
-        )
+        headers = {
+            "X-Queue-Wait-Ms": f"{result.queue_time * 1000:.1f}",
+            "X-Queue-Depth": str(vllm_service.scheduler.queue_depth(request.model))
+        }
+        if cache_status:
+            headers["X-Cache"] = cache_status
+        trace.get_current_span().set_attributes({
+            "gen_ai.usage.input_tokens": result.usage["prompt_tokens"],
+            "gen_ai.usage.output_tokens": result.usage["completion_tokens"],
+            "vlinders.cache": cache_status or "NONE",
+        })
 
         logger.info(
             f"Chat request completed: tokens={result.usage['total_tokens']}, "
             f"finish_reason={result.finish_reason}"
         )
 
-        return response
-
+        return FastJSONResponse(chat_completion(request.model, result), headers=headers)
+
+    except HTTPException:
+        raise
+    except SchedulerOverloaded as e:
+        raise overloaded_exception(e)
+    except RateLimitExceeded as e:
+        raise rate_limit_exception(e)
+    except TimeoutError as e:
+        logger.warning(f"Chat request timed out: {e}")
+        raise HTTPException(status_code=504, detail=str(e))
     except ValueError as e:
         logger.error(f"Model not found: {e}")
         raise HTTPException(status_code=404, detail=str(e))
@@ -140,10 +445,76 @@ async def internal_chat(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/chat/batch")
+async def internal_chat_batch(
+    request: InternalChatBatchRequest,
+    http_request: Request,
+    _: dict = Depends(verify_internal_auth)
+):
+    """
+    批量聊天接口
+
+    一次提交多个会话，并发送入引擎以充分利用连续批处理（每个模型同时在途的条目数
+    见 batch_concurrency）。客户端断开时取消尚未完成的会话。
+    - stream=false: 按输入顺序返回全部结果
+    - stream=true: 以 NDJSON 逐行返回，每个会话完成即输出一行
+    单个会话失败只影响该条结果（error 字段），不影响其他会话。
+    """
+
+    logger.info(f"Received batch chat request: items={len(request.requests)}")
+
+    # 模型 -> 本批次在途条目的信号量
+    in_flight: Dict[str, asyncio.Semaphore] = {}
+
+    async def run_item(index: int, item: InternalChatRequest) -> Dict[str, Any]:
+        semaphore = in_flight.get(item.model)
+        if semaphore is None:
+            semaphore = in_flight[item.model] = asyncio.Semaphore(batch_concurrency(item.model))
+        try:
+            async with semaphore:
+                result, _ = await complete_chat(item)
+            return {
+                "index": index,
+                "response": chat_completion(item.model, result)
+            }
+        except Exception as e:
+            logger.error(f"Batch item {index} failed: {e}")
+            return {
+                "index": index,
+                "error": {"status": error_status(e), "message": str(e)}
+            }
+
+    tasks = [
+        asyncio.create_task(run_item(index, item))
+        for index, item in enumerate(request.requests)
+    ]
+
+    if not request.stream:
+        try:
+            results = await cancel_on_disconnect(
+                http_request, asyncio.ensure_future(asyncio.gather(*tasks))
+            )
+        finally:
+            for task in tasks:
+                task.cancel()
+        return FastJSONResponse({"object": "list", "data": results})
+
+    async def generate():
+        """按完成顺序输出 NDJSON"""
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield dumps(await next_done) + b"\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
 @router.post("/chat/stream")
 async def internal_chat_stream(
     request: InternalChatRequest,
-    _: None = Depends(verify_internal_auth)
+    _: dict = Depends(verify_internal_auth)
 ):
     """
     内部聊天接口（流式）
@@ -152,81 +523,206 @@ async def internal_chat_stream(
     """
 
     logger.info(f"Received streaming chat request: model={request.model}")
+    trace.get_current_span().set_attribute("gen_ai.request.model", request.model)
 
-    # 构建 prompt
-    prompt = "\n".join([f"{msg.role}: {msg.content}" for msg in request.messages])
-    prompt += "\nassistant:"
+    # 从渲染 prompt 到流结束（finish），模型不会被卸载；响应开始前出错时随即释放
+    with ExitStack() as holding:
+        holding.enter_context(vllm_service.hold(request.model))
+        # 先取第一个块：模型不存在、超出限额或调度器拒绝时，在响应头发出之前返回 404 / 429 / 503
+        try:
+            prompt = await render_prompt(request)
+            reservation = await reserve_tokens(request, prompt)
+            try:
+                chunks = vllm_service.generate_stream(
+                    model=request.model,
+                    prompt=prompt.text,
+                    prompt_token_ids=prompt.token_ids,
+                    max_tokens=prompt.max_tokens or request.max_tokens,
+                    temperature=request.temperature,
+                    top_p=request.top_p,
+                    stop=request.stop,
+                    seed=request.seed,
+                    priority=request.priority,
+                    timeout=request.timeout
+                )
+                first_chunk = await chunks.__anext__()
+            except StopAsyncIteration:
+                first_chunk = None
+            except BaseException:
+                # 未开始生成，退还预留的 token
+                if reservation is not None:
+                    await asyncio.shield(reservation.release())
+                raise
+        except SchedulerOverloaded as e:
+            raise overloaded_exception(e)
+        except RateLimitExceeded as e:
+            raise rate_limit_exception(e)
+        except TimeoutError as e:
+            logger.warning(f"Streaming chat request timed out: {e}")
+            raise HTTPException(status_code=504, detail=str(e))
+        except ValueError as e:
+            logger.error(f"Model not found: {e}")
+            raise HTTPException(status_code=404, detail=str(e))
+        except Exception as e:
+            logger.error(f"Streaming chat request failed: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+        release = holding.pop_all()
+
+    completion_tokens = 0
+    finished = False
+
+    async def finish() -> None:
+        """关闭生成器（中止引擎请求），按实际生成的 token 数结算；只执行一次"""
+        nonlocal finished
+        if finished:
+            return
+        finished = True
+        try:
+            await chunks.aclose()
+            if reservation is not None:
+                # 客户端断开时只计已生成的部分
+                await reservation.reconcile(prompt.num_tokens + completion_tokens)
+        finally:
+            release.close()
 
     async def generate():
-        """生成流式响应"""
-        import json
-        import time
-
-        request_id = f"chatcmpl_{uuid.uuid4().hex[:8]}"
+        """生成流式响应（外层按请求预编码，每块只编码 delta）"""
+        nonlocal completion_tokens
+        encoder = ChunkEncoder(request.model)
+        # 不作为当前 span，引擎阶段的 span 仍挂在请求 span 下
+        sse_span = tracing.start_span("sse", {"vlinders.response_id": encoder.response_id})
+        events = 0
+        serialize_ns = 0
+
+        async def all_chunks():
+            if first_chunk is not None:
+                yield first_chunk
+            async for chunk in chunks:
+                yield chunk
 
         try:
-            async for chunk in vllm_service.generate_stream(
-                model=request.model,
-                prompt=prompt,
-                max_tokens=request.max_tokens,
-                temperature=request.temperature,
-                top_p=request.top_p,
-                stop=request.stop
-            ):
-                # 构建 SSE 格式的响应
-                data = {
-                    "id": request_id,
-                    "object": "chat.completion.chunk",
-                    "created": int(time.time()),
-                    "model": request.model,
-                    "choices": [{
-                        "index": 0,
-                        "delta": {"content": chunk["text"]},
-                        "finish_reason": chunk.get("finish_reason")
-                    }]
-                }
-
-                yield f"data: {json.dumps(data)}\n\n"
+            async for chunk in all_chunks():
+                # delta 只包含新增内容
+                started = time.perf_counter_ns()
+                event = encoder.encode(
+                    chunk["text"],
+                    chunk["finish_reason"],
+                    chunk["token_ids"] if request.return_token_ids else None
+                )
+                serialize_ns += time.perf_counter_ns() - started
+                events += 1
+                completion_tokens += len(chunk["token_ids"])
+                yield event
 
                 if chunk.get("done"):
                     break
 
             # 发送结束标记
-            yield "data: [DONE]\n\n"
+            yield SSE_DONE
 
         except Exception as e:
             logger.error(f"Streaming failed: {e}")
-            error_data = {"error": str(e)}
-            yield f"data: {json.dumps(error_data)}\n\n"
-
-    return StreamingResponse(
+            sse_span.set_status(trace.Status(trace.StatusCode.ERROR, str(e)))
+            yield sse_event({"error": str(e)})
+
+        finally:
+            # 客户端断开时本任务已被取消，中止引擎请求和结算不能再被打断
+            await asyncio.shield(finish())
+            sse_span.set_attributes({
+                "vlinders.sse.events": events,
+                "vlinders.sse.serialize_ms": serialize_ns / 1e6,
+            })
+            sse_span.end()
+
+    return CleanupStreamingResponse(
         generate(),
-        media_type="text/event-stream"
+        cleanup=finish,
+        media_type="text/event-stream",
+        headers={"X-Queue-Depth": str(vllm_service.scheduler.queue_depth(request.model))}
     )
 
 
+@router.post("/tokenize")
+async def internal_tokenize(
+    request: InternalTokenizeRequest,
+    _: dict = Depends(verify_internal_auth)
+):
+    """
+    分词计数接口
+
+    按模型的 chat template 和 tokenizer 计算每组消息的 prompt token 数，供 API 层做配额检查
+    """
+
+    try:
+        counts, exact = await vllm_service.count_tokens(
+            request.model,
+            [[msg.model_dump() for msg in messages] for messages in request.conversations]
+        )
+    except ValueError as e:
+        logger.error(f"Model not found: {e}")
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logger.error(f"Tokenize request failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return {
+        "model": request.model,
+        "counts": counts,
+        "total": sum(counts),
+        "exact": exact
+    }
+
+
 @router.post("/embeddings")
 async def internal_embeddings(
     request: InternalEmbeddingRequest,
-    _: None = Depends(verify_internal_auth)
+    _: dict = Depends(verify_internal_auth)
 ):
     """
     内部嵌入接口
 
-    生成文本嵌入向量（暂未实现）
+    生成文本嵌入向量。并发请求经微批处理合并，每批执行一次前向计算
     """
 
-    logger.warning("Embeddings endpoint not yet implemented")
-    raise HTTPException(status_code=501, detail="Not implemented")
+    if not embedding_service.enabled:
+        raise HTTPException(status_code=501, detail="Embeddings not enabled")
+    if request.model not in ("default", embedding_service.model_name):
+        raise HTTPException(status_code=404, detail=f"Embedding model {request.model} not found")
+
+    texts = [request.input] if isinstance(request.input, str) else request.input
+    if not texts:
+        raise HTTPException(status_code=400, detail="Input must not be empty")
+
+    try:
+        result = await embedding_service.embed(texts)
+    except RuntimeError as e:
+        logger.error(f"Embedding model unavailable: {e}")
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.error(f"Embedding request failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return {
+        "object": "list",
+        "model": embedding_service.model_name,
+        "data": [
+            {"object": "embedding", "index": index, "embedding": embedding}
+            for index, embedding in enumerate(result.embeddings)
+        ],
+        "usage": {
+            "prompt_tokens": result.prompt_tokens,
+            "total_tokens": result.prompt_tokens
+        }
+    }
 
 
 @router.get("/models")
-async def list_models(_: None = Depends(verify_internal_auth)):
+async def list_models(_: dict = Depends(verify_internal_auth)):
     """
-    列出已加载的模型
+    列出模型及其状态（loaded / loading / cold）
     """
 
-    models = vllm_service.list_models()
+    models = vllm_service.model_states()
 
     return {
         "object": "list",
@@ -234,8 +730,23 @@ async def list_models(_: None = Depends(verify_internal_auth)):
             {
                 "id": model_name,
                 "object": "model",
-                "owned_by": "vlinders"
+                "owned_by": "vlinders",
+                "status": state,
+                "scheduler": vllm_service.scheduler.get_stats(model_name),
+                "replicas": (
+                    vllm_service.get_engine(model_name).get_stats()
+                    if state == "loaded" else []
+                )
             }
-            for model_name in models
-        ]
+            for model_name, state in models.items()
+        ] + (
+            [{
+                "id": embedding_service.model_name,
+                "object": "model",
+                "owned_by": "vlinders",
+                "type": "embedding",
+                **embedding_service.get_stats()
+            }]
+            if embedding_service.enabled else []
+        )
     }
@@ -0,0 +1,115 @@
+"""
+响应序列化
+
+流式响应每个块中只有 delta 和 finish_reason 会变化：按请求预先编码不变的外层
+（id、created、model），每块只编码 delta 文本。非流式响应直接编码为字节，不经过
+pydantic 校验和 jsonable_encoder。安装了 orjson 时使用 orjson，否则使用标准库 json。
+"""
+import json
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from fastapi.responses import Response
+
+from ..inference import GenerationResult
+
+# orjson 为可选依赖
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+if orjson is not None:
+    def dumps(obj: Any) -> bytes:
+        """编码为紧凑的 UTF-8 JSON"""
+        return orjson.dumps(obj)
+
+    dumps_str = dumps
+else:
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+    _encode_str = json.encoder.encode_basestring
+
+    def dumps(obj: Any) -> bytes:
+        """编码为紧凑的 UTF-8 JSON"""
+        return _encoder.encode(obj).encode("utf-8")
+
+    def dumps_str(text: str) -> bytes:
+        """只编码一个字符串（跳过类型分派）"""
+        return _encode_str(text).encode("utf-8")
+
+
+SSE_DONE = b"data: [DONE]\n\n"
+
+_FINISH_REASONS: Dict[Optional[str], bytes] = {
+    None: b"null",
+    "stop": b'"stop"',
+    "length": b'"length"',
+    "abort": b'"abort"',
+}
+
+
+def sse_event(data: Dict[str, Any]) -> bytes:
+    """任意数据的 SSE 事件（用于错误等低频事件）"""
+    return b"data: " + dumps(data) + b"\n\n"
+
+
+class ChunkEncoder:
+    """一个流式请求的 chat.completion.chunk 编码器"""
+
+    def __init__(self, model: str, response_id: Optional[str] = None):
+        self.response_id = response_id or f"chatcmpl_{uuid.uuid4().hex[:8]}"
+        # 同一个流的所有块使用相同的 created
+        self._prefix = b"".join([
+            b'data: {"id":', dumps_str(self.response_id),
+            b',"object":"chat.completion.chunk","created":', str(int(time.time())).encode(),
+            b',"model":', dumps_str(model),
+            b',"choices":[{"index":0,"delta":{"content":',
+        ])
+
+    def encode(
+        self,
+        text: str,
+        finish_reason: Optional[str] = None,
+        token_ids: Optional[List[int]] = None
+    ) -> bytes:
+        """一个块的 SSE 事件"""
+        finish = _FINISH_REASONS.get(finish_reason) or dumps_str(finish_reason)
+        if token_ids is None:
+            return b"".join([
+                self._prefix, dumps_str(text), b'},"finish_reason":', finish, b"}]}\n\n"
+            ])
+        return b"".join([
+            self._prefix, dumps_str(text), b',"token_ids":', dumps(token_ids),
+            b'},"finish_reason":', finish, b"}]}\n\n"
+        ])
+
+
+def chat_completion(model: str, result: GenerationResult) -> Dict[str, Any]:
+    """非流式聊天响应（字段与 InternalChatResponse 一致）"""
+    return {
+        "id": f"chatcmpl_{uuid.uuid4().hex[:8]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": result.text},
+            "finish_reason": result.finish_reason,
+        }],
+        "usage": {
+            "prompt_tokens": result.usage["prompt_tokens"],
+            "completion_tokens": result.usage["completion_tokens"],
+            "total_tokens": result.usage["total_tokens"],
+        },
+    }
+
+
+class FastJSONResponse(Response):
+    """直接编码的 JSON 响应"""
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -1,10 +1,21 @@
 """
 认证和授权中间件
+
+内部接口（X-Internal-Auth 头）和 Bearer 认证共用 AuthService.authenticate:
+内部密钥用常量时间比较，JWT 验证通过后按 token 摘要缓存 claims 至其 exp。
+内部接口只接受内部密钥或 scope 为 internal 的服务 token，不接受用户 token
+
+INTERNAL_SECRET 只在启动时从环境变量读取。轮换密钥需要重启进程（或在进程内修改
+config.server.internal_secret），缓存在下一次验证时检测到密钥变化并清空
 """
+from collections import OrderedDict
 from fastapi import HTTPException, Security, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from typing import Optional
+from typing import Dict, Optional
+import hashlib
+import hmac
 import jwt
+import time
 from datetime import datetime, timedelta
 
 from .config import config
@@ -13,21 +24,37 @@ from .utils import logger
 
 security = HTTPBearer()
 
+# 服务 token 的 scope claim，内部接口只接受带此 scope 的 JWT
+INTERNAL_SCOPE = "internal"
+
 
 class AuthService:
     """认证服务"""
 
-    def __init__(self):
-        self.secret_key = config.server.internal_secret
+    def __init__(self, cache_size: int = 10000, cache_ttl: float = 300.0):
         self.algorithm = "HS256"
+        self.cache_size = cache_size
+        # 没有 exp 的 token 最多缓存的秒数
+        self.cache_ttl = cache_ttl
+        # token 的 SHA-256 摘要 -> (claims, 过期时间)
+        self._verified: "OrderedDict[bytes, tuple[dict, float]]" = OrderedDict()
+        # 缓存中的条目是用哪个密钥验证的
+        self._verified_secret: Optional[str] = None
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0}
+
+    @property
+    def secret_key(self) -> str:
+        """当前密钥（每次读取配置，轮换后立即生效）"""
+        return config.server.internal_secret
 
     def create_token(
         self,
         user_id: str,
         tenant_id: str,
-        expires_delta: Optional[timedelta] = None
+        expires_delta: Optional[timedelta] = None,
+        scope: Optional[str] = None
     ) -> str:
-        """创建 JWT token"""
+        """创建 JWT token（服务之间调用内部接口时 scope 为 INTERNAL_SCOPE）"""
         if expires_delta is None:
             expires_delta = timedelta(hours=24)
 
@@ -39,19 +66,42 @@ class AuthService:
             "exp": expire,
             "iat": datetime.utcnow()
         }
+        if scope is not None:
+            payload["scope"] = scope
 
         token = jwt.encode(payload, self.secret_key, algorithm=self.algorithm)
         return token
 
     def verify_token(self, token: str) -> dict:
-        """验证 JWT token"""
+        """验证 JWT token（命中缓存时不再验证签名）"""
+        secret = self.secret_key
+        if not secret:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Authentication is not configured"
+            )
+        if secret != self._verified_secret:
+            # 密钥已轮换，旧密钥签发的 token 不再有效
+            self._verified.clear()
+            self._verified_secret = secret
+
+        digest = hashlib.sha256(token.encode("utf-8")).digest()
+        now = time.time()
+        entry = self._verified.get(digest)
+        if entry is not None:
+            if entry[1] > now:
+                self._verified.move_to_end(digest)
+                self.stats["hits"] += 1
+                return dict(entry[0])
+            del self._verified[digest]
+
+        self.stats["misses"] += 1
         try:
             payload = jwt.decode(
                 token,
-                self.secret_key,
+                secret,
                 algorithms=[self.algorithm]
             )
-            return payload
         except jwt.ExpiredSignatureError:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -63,13 +113,79 @@ class AuthService:
                 detail="Invalid token"
             )
 
+        expires_at = now + self.cache_ttl
+        if isinstance(payload.get("exp"), (int, float)):
+            expires_at = min(expires_at, payload["exp"])
+        self._verified[digest] = (payload, expires_at)
+        if len(self._verified) > self.cache_size:
+            self._verified.popitem(last=False)
+        return dict(payload)
+
     def verify_internal_secret(self, secret: str) -> bool:
-        """验证内部密钥"""
-        return secret == self.secret_key
+        """验证内部密钥（常量时间比较）"""
+        return bool(self.secret_key) and hmac.compare_digest(
+            secret.encode("utf-8"), self.secret_key.encode("utf-8")
+        )
+
+    def authenticate(
+        self,
+        token: str,
+        failure_status: int = status.HTTP_401_UNAUTHORIZED,
+        internal_only: bool = False,
+        allow_unconfigured: bool = False
+    ) -> dict:
+        """
+        验证内部密钥或 JWT token
+
+        Args:
+            failure_status: 验证失败时返回的状态码
+            internal_only: 只接受内部密钥或 scope 为 INTERNAL_SCOPE 的服务 token
+            allow_unconfigured: 未设置 INTERNAL_SECRET 时跳过认证（开发环境），否则一律拒绝
+
+        Raises:
+            HTTPException: 验证失败
+        """
+        if not self.secret_key:
+            if allow_unconfigured:
+                logger.warning("INTERNAL_SECRET not set, skipping authentication")
+                return {"type": "internal", "authenticated": True}
+            logger.warning("INTERNAL_SECRET not set, rejecting authentication")
+            raise HTTPException(
+                status_code=failure_status, detail="Authentication is not configured"
+            )
+
+        # 检查是否是内部密钥
+        if self.verify_internal_secret(token):
+            return {"type": "internal", "authenticated": True}
+
+        # 否则验证 JWT token
+        try:
+            payload = self.verify_token(token)
+        except HTTPException as e:
+            logger.warning(f"Invalid internal authentication: {e.detail}")
+            raise HTTPException(status_code=failure_status, detail=e.detail)
+
+        if internal_only and payload.get("scope") != INTERNAL_SCOPE:
+            logger.warning("Rejected non-service token on internal endpoint")
+            raise HTTPException(status_code=failure_status, detail="Service token required")
+
+        return {
+            "type": "jwt",
+            "authenticated": True,
+            "user_id": payload.get("user_id"),
+            "tenant_id": payload.get("tenant_id")
+        }
+
+    def get_stats(self) -> Dict[str, int]:
+        """验证缓存统计"""
+        return {**self.stats, "entries": len(self._verified)}
 
 
 # 全局认证服务实例
-auth_service = AuthService()
+auth_service = AuthService(
+    cache_size=config.server.auth_token_cache_size,
+    cache_ttl=config.server.auth_token_cache_ttl
+)
 
 
 async def verify_internal_auth(
@@ -78,22 +194,9 @@ async def verify_internal_auth(
     """
     验证内部认证
 
-    用于内部服务之间的通信
+    用于内部服务之间的通信（未设置 INTERNAL_SECRET 时拒绝所有请求）
     """
-    token = credentials.credentials
-
-    # 检查是否是内部密钥
-    if auth_service.verify_internal_secret(token):
-        return {"type": "internal", "authenticated": True}
-
-    # 否则验证 JWT token
-    payload = auth_service.verify_token(token)
-    return {
-        "type": "jwt",
-        "authenticated": True,
-        "user_id": payload.get("user_id"),
-        "tenant_id": payload.get("tenant_id")
-    }
+    return auth_service.authenticate(credentials.credentials)
 
 
 async def verify_user_auth(
@@ -1,22 +1,89 @@
 """
 Redis 缓存服务模块
+
+Redis 不可用时快速失败: 连续 REDIS_BREAKER_THRESHOLD 次连接错误（或启动时连接失败）后熔断，
+此后的调用不再访问 Redis，由调用方使用进程内的限流计数和缓存；后台任务定期重连，
+恢复后关闭熔断
 """
+import asyncio
 import redis.asyncio as redis
-from typing import Optional, Any
+from redis.exceptions import ConnectionError as RedisConnectionError
+from redis.exceptions import TimeoutError as RedisTimeoutError
+from typing import Any, Awaitable, Callable, Dict, List, Optional
 import json
 
 from .config import config
 from .utils import logger
 
+# 视为 Redis 不可用的错误（命令错误、脚本错误等不计入熔断）
+_OUTAGE_ERRORS = (RedisConnectionError, RedisTimeoutError, OSError)
+
+# _execute 出错时重新抛出异常
+_RAISE = object()
+
+
+class CacheUnavailable(Exception):
+    """Redis 熔断中，调用未执行"""
+
+
+class CircuitBreaker:
+    """连续失败 failure_threshold 次后断开，由后台重连成功后恢复"""
+
+    def __init__(self, failure_threshold: int = 5):
+        self.failure_threshold = failure_threshold
+        self.failures = 0
+        self.open = False
+
+    def record_success(self) -> None:
+        self.failures = 0
+
+    def record_failure(self) -> bool:
+        """记录一次失败，返回本次是否触发熔断"""
+        self.failures += 1
+        if self.open or self.failures < self.failure_threshold:
+            return False
+        self.open = True
+        return True
+
+    def trip(self) -> None:
+        self.failures = self.failure_threshold
+        self.open = True
+
+    def reset(self) -> None:
+        self.failures = 0
+        self.open = False
+
 
 class CacheService:
     """Redis 缓存服务"""
 
     def __init__(self):
         self.client: Optional[redis.Redis] = None
+        # Lua 脚本 -> 已注册的脚本对象（按 SHA 调用）
+        self._scripts: Dict[str, Any] = {}
+        self.breaker = CircuitBreaker(config.server.redis_breaker_threshold)
+        self._reconnect_task: Optional[asyncio.Task] = None
+        self.stats: Dict[str, int] = {
+            "failures": 0,
+            "trips": 0,
+            "short_circuited": 0,
+            "reconnects": 0,
+        }
+
+    @property
+    def available(self) -> bool:
+        """已连接且未熔断"""
+        return self.client is not None and not self.breaker.open
+
+    @property
+    def state(self) -> str:
+        """connected / degraded（熔断中，使用进程内回退）/ disconnected"""
+        if self.client is None:
+            return "disconnected"
+        return "degraded" if self.breaker.open else "connected"
 
     async def connect(self) -> None:
-        """连接到 Redis"""
+        """连接到 Redis（失败时熔断并在后台重连）"""
         if self.client:
             logger.warning("Redis client already exists")
             return
@@ -24,11 +91,14 @@ class CacheService:
         try:
             logger.info(f"Connecting to Redis: {config.server.redis_url}")
 
+            # 超时较短：Redis 故障时请求不应长时间等待
             self.client = redis.from_url(
                 config.server.redis_url,
                 encoding="utf-8",
                 decode_responses=True,
-                max_connections=50
+                max_connections=50,
+                socket_timeout=config.server.redis_timeout,
+                socket_connect_timeout=config.server.redis_timeout
             )
 
             # 测试连接
@@ -38,30 +108,97 @@ class CacheService:
 
         except Exception as e:
             logger.error(f"Failed to connect to Redis: {e}")
+            if self.client is not None:
+                self.breaker.trip()
+                self.stats["trips"] += 1
+                self._start_reconnect()
             raise
 
     async def disconnect(self) -> None:
         """断开 Redis 连接"""
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+            self._reconnect_task = None
+
         if not self.client:
             return
 
         try:
-            await self.client.close()
+            await self.client.aclose()
             self.client = None
+            self._scripts.clear()
+            self.breaker.reset()
             logger.info("Redis connection closed")
         except Exception as e:
             logger.error(f"Error closing Redis connection: {e}")
 
-    async def get(self, key: str) -> Optional[str]:
-        """获取缓存值"""
+    async def _execute(
+        self,
+        description: str,
+        call: Callable[[], Awaitable[Any]],
+        default: Any = _RAISE
+    ) -> Any:
+        """
+        执行一个 Redis 调用
+
+        熔断中直接返回 default（未指定时抛出 CacheUnavailable），出错时返回 default
+        （未指定时重新抛出异常）
+        """
         if not self.client:
             raise RuntimeError("Redis client not initialized")
 
+        if self.breaker.open:
+            self.stats["short_circuited"] += 1
+            if default is _RAISE:
+                raise CacheUnavailable("Redis is unavailable (circuit open)")
+            return default
+
         try:
-            return await self.client.get(key)
+            result = await call()
         except Exception as e:
-            logger.error(f"Error getting key {key}: {e}")
-            return None
+            logger.error(f"Error {description}: {e}")
+            if isinstance(e, _OUTAGE_ERRORS):
+                self._record_failure()
+            if default is _RAISE:
+                raise
+            return default
+
+        self.breaker.record_success()
+        return result
+
+    def _record_failure(self) -> None:
+        self.stats["failures"] += 1
+        if self.breaker.record_failure():
+            self.stats["trips"] += 1
+            logger.warning(
+                f"Redis unavailable after {self.breaker.failures} consecutive failures, "
+                "falling back to in-process rate limits and caches"
+            )
+            self._start_reconnect()
+
+    def _start_reconnect(self) -> None:
+        if self._reconnect_task is None or self._reconnect_task.done():
+            self._reconnect_task = asyncio.create_task(self._reconnect())
+
+    async def _reconnect(self) -> None:
+        """熔断期间定期 ping，成功后恢复"""
+        while self.breaker.open and self.client is not None:
+            await asyncio.sleep(config.server.redis_reconnect_interval)
+            try:
+                await self.client.ping()
+            except Exception as e:
+                logger.debug(f"Redis still unavailable: {e}")
+                continue
+
+            self.breaker.reset()
+            self.stats["reconnects"] += 1
+            logger.info("Redis connection restored")
+
+    async def get(self, key: str) -> Optional[str]:
+        """获取缓存值"""
+        return await self._execute(
+            f"getting key {key}", lambda: self.client.get(key), default=None
+        )
 
     async def set(
         self,
@@ -70,63 +207,63 @@ class CacheService:
         expire: Optional[int] = None
     ) -> bool:
         """设置缓存值"""
-        if not self.client:
-            raise RuntimeError("Redis client not initialized")
-
-        try:
-            if isinstance(value, (dict, list)):
-                value = json.dumps(value)
+        if isinstance(value, (dict, list)):
+            value = json.dumps(value)
 
+        async def call() -> bool:
             await self.client.set(key, value, ex=expire)
             return True
-        except Exception as e:
-            logger.error(f"Error setting key {key}: {e}")
-            return False
+
+        return await self._execute(f"setting key {key}", call, default=False)
 
     async def delete(self, key: str) -> bool:
         """删除缓存值"""
-        if not self.client:
-            raise RuntimeError("Redis client not initialized")
 
-        try:
+        async def call() -> bool:
             await self.client.delete(key)
             return True
-        except Exception as e:
-            logger.error(f"Error deleting key {key}: {e}")
-            return False
+
+        return await self._execute(f"deleting key {key}", call, default=False)
 
     async def exists(self, key: str) -> bool:
         """检查键是否存在"""
-        if not self.client:
-            raise RuntimeError("Redis client not initialized")
 
-        try:
+        async def call() -> bool:
             return await self.client.exists(key) > 0
-        except Exception as e:
-            logger.error(f"Error checking key {key}: {e}")
-            return False
+
+        return await self._execute(f"checking key {key}", call, default=False)
 
     async def incr(self, key: str, amount: int = 1) -> int:
         """递增计数器"""
+        return await self._execute(
+            f"incrementing key {key}", lambda: self.client.incrby(key, amount)
+        )
+
+    async def eval_script(self, script: str, keys: List[str], args: List[Any]) -> Any:
+        """
+        执行 Lua 脚本（EVALSHA，服务端没有缓存该脚本时自动改用 EVAL）
+
+        脚本在 Redis 中原子执行
+        """
         if not self.client:
             raise RuntimeError("Redis client not initialized")
 
-        try:
-            return await self.client.incrby(key, amount)
-        except Exception as e:
-            logger.error(f"Error incrementing key {key}: {e}")
-            raise
+        registered = self._scripts.get(script)
+        if registered is None:
+            registered = self._scripts[script] = self.client.register_script(script)
+        return await self._execute(
+            f"running script on keys {keys}", lambda: registered(keys=keys, args=args)
+        )
 
     async def expire(self, key: str, seconds: int) -> bool:
         """设置过期时间"""
-        if not self.client:
-            raise RuntimeError("Redis client not initialized")
+        return await self._execute(
+            f"setting expiry for key {key}", lambda: self.client.expire(key, seconds), default=False
+        )
 
-        try:
-            return await self.client.expire(key, seconds)
-        except Exception as e:
-            logger.error(f"Error setting expiry for key {key}: {e}")
-            return False
+    def get_stats(self) -> Dict[str, Any]:
+        """熔断统计"""
+        return {**self.stats, "state": self.state}
 
 
 # 全局缓存服务实例
@@ -3,7 +3,7 @@
 """
 import os
 from typing import Dict, List, Optional
-from pydantic import Field
+from pydantic import BaseModel, Field
 from pydantic_settings import BaseSettings
 
 
@@ -19,6 +19,57 @@ class ModelConfig(BaseSettings):
     trust_remote_code: bool = True
     enabled: bool = True
 
+    # 引擎后端: vllm / simulated
+    backend: str = "vllm"
+
+    # 副本数及每个副本使用的 GPU（如 ["0", "1"] 或 ["0,1", "2,3"]）
+    replicas: int = 1
+    devices: Optional[List[str]] = None
+
+    # 多副本路由: prefix_affinity / least_loaded
+    routing: str = "prefix_affinity"
+    # 参与前缀哈希的 prompt 开头 token 数
+    prefix_block_tokens: int = 256
+    # 单个副本的负载上限（平均在途 token 的倍数），超过后退回其他副本
+    routing_load_factor: float = 1.25
+
+    # 模拟后端参数（秒）
+    sim_load_latency: float = 0.0
+    sim_prefill_latency: float = 0.05
+    sim_prefill_per_token: float = 0.0
+    sim_token_latency: float = 0.01
+    sim_concurrency_slowdown: float = 0.0
+    sim_output_tokens: Optional[int] = None
+
+    # 语义缓存（还需开启 SEMANTIC_CACHE_ENABLED 和嵌入模型）: 相似度阈值与条目有效期（秒）
+    semantic_cache: bool = False
+    semantic_cache_threshold: float = 0.95
+    semantic_cache_ttl: int = 3600
+
+    # 加载策略: eager（启动时加载）/ on_demand（首次请求时加载，空闲时可被卸载）
+    load_policy: str = "eager"
+    # 模型占用的显存估计（GB），用于显存预算
+    memory_gb: float = 0.0
+
+    # 调度配置
+    max_concurrency: int = 256
+    max_queue_size: int = 512
+    queue_timeout: float = 30.0
+
+
+class EmbeddingConfig(BaseModel):
+    """嵌入模型配置"""
+    name: str = "default"
+    # 后端: sentence_transformers / hash（特征哈希，无需权重，用于测试）
+    backend: str = "sentence_transformers"
+    path: str = "BAAI/bge-small-en-v1.5"
+    device: str = "cpu"
+    # hash 后端的向量维度
+    dimension: int = 384
+    # 微批处理: 凑满 max_batch_size 条或首条等待 max_wait_ms 后执行一次前向计算
+    max_batch_size: int = 64
+    max_wait_ms: float = 5.0
+
 
 class ServerConfig(BaseSettings):
     """服务器配置"""
@@ -31,18 +82,124 @@ class ServerConfig(BaseSettings):
 
     # 内部认证
     internal_secret: str = Field(default="", alias="INTERNAL_SECRET")
+    # 已验证 JWT 的缓存（按 token 的 exp 过期，没有 exp 时最多缓存 AUTH_TOKEN_CACHE_TTL 秒）
+    auth_token_cache_size: int = Field(default=10000, alias="AUTH_TOKEN_CACHE_SIZE")
+    auth_token_cache_ttl: float = Field(default=300.0, alias="AUTH_TOKEN_CACHE_TTL")
 
     # 数据库配置
     redis_url: str = Field(default="redis://localhost:6379", alias="REDIS_URL")
+    # Redis 调用的超时（秒）；连续失败 REDIS_BREAKER_THRESHOLD 次后熔断，每隔 REDIS_RECONNECT_INTERVAL 秒重连
+    redis_timeout: float = Field(default=0.5, alias="REDIS_TIMEOUT")
+    redis_breaker_threshold: int = Field(default=5, alias="REDIS_BREAKER_THRESHOLD")
+    redis_reconnect_interval: float = Field(default=5.0, alias="REDIS_RECONNECT_INTERVAL")
     postgres_url: str = Field(default="postgresql://localhost:5432/vlinders", alias="POSTGRES_URL")
     qdrant_url: str = Field(default="http://localhost:6333", alias="QDRANT_URL")
 
     # GPU 配置
     cuda_visible_devices: Optional[str] = Field(default=None, alias="CUDA_VISIBLE_DEVICES")
 
+    # 推理配置
+    models_config: str = Field(default="configs/models.yaml", alias="MODELS_CONFIG")
+    enable_request_coalescing: bool = Field(default=True, alias="ENABLE_REQUEST_COALESCING")
+    # 每个模型缓存的已分词对话前缀数
+    prompt_prefix_cache_size: int = Field(default=1024, alias="PROMPT_PREFIX_CACHE_SIZE")
+    # 超出 max_model_len 的请求按上下文预算裁剪消息，而不是由引擎报错
+    context_trimming_enabled: bool = Field(default=True, alias="CONTEXT_TRIMMING_ENABLED")
+    # 单次批量分词最多合并的 encode 请求数
+    tokenizer_max_batch: int = Field(default=64, alias="TOKENIZER_MAX_BATCH")
+    # 已加载模型的显存预算（GB），超出时按 LRU 卸载空闲模型；0 表示不限制
+    model_memory_budget_gb: float = Field(default=0.0, alias="MODEL_MEMORY_BUDGET_GB")
+    # 默认的单请求截止时间（秒，含排队），超时后中止生成；0 表示不限制
+    request_timeout: float = Field(default=0.0, alias="REQUEST_TIMEOUT")
+    # /ready 需要等待加载完成的模型（逗号分隔），为空时等待全部 eager 模型
+    required_models: str = Field(default="", alias="REQUIRED_MODELS")
+
+    # 嵌入模型
+    embedding_enabled: bool = Field(default=False, alias="EMBEDDING_ENABLED")
+    embedding_model: str = Field(default="default", alias="EMBEDDING_MODEL")
+    embedding_backend: str = Field(default="sentence_transformers", alias="EMBEDDING_BACKEND")
+    embedding_model_path: str = Field(
+        default="BAAI/bge-small-en-v1.5", alias="EMBEDDING_MODEL_PATH"
+    )
+    embedding_device: str = Field(default="cpu", alias="EMBEDDING_DEVICE")
+    embedding_dimension: int = Field(default=384, alias="EMBEDDING_DIMENSION")
+    embedding_max_batch_size: int = Field(default=64, alias="EMBEDDING_MAX_BATCH_SIZE")
+    embedding_max_wait_ms: float = Field(default=5.0, alias="EMBEDDING_MAX_WAIT_MS")
+
+    # 补全缓存（仅缓存确定性请求）
+    completion_cache_enabled: bool = Field(default=True, alias="COMPLETION_CACHE_ENABLED")
+    completion_cache_max_bytes: int = Field(
+        default=64 * 1024 * 1024, alias="COMPLETION_CACHE_MAX_BYTES"
+    )
+    completion_cache_l1_ttl: int = Field(default=600, alias="COMPLETION_CACHE_L1_TTL")
+    completion_cache_l2_ttl: int = Field(default=3600, alias="COMPLETION_CACHE_L2_TTL")
+    # 各 worker 重新读取模型缓存代数的间隔（秒），其他 worker 使缓存失效后最多这么久生效
+    completion_cache_epoch_ttl: float = Field(default=5.0, alias="COMPLETION_CACHE_EPOCH_TTL")
+
+    # 语义缓存（按模型开启，见 ModelConfig.semantic_cache）
+    semantic_cache_enabled: bool = Field(default=False, alias="SEMANTIC_CACHE_ENABLED")
+    semantic_cache_max_entries: int = Field(default=100000, alias="SEMANTIC_CACHE_MAX_ENTRIES")
+    # 单个命名空间的条目超过该数量后使用 IVF 索引
+    semantic_cache_ivf_threshold: int = Field(default=20000, alias="SEMANTIC_CACHE_IVF_THRESHOLD")
+    # 命中后在后台重新生成以检测误命中的抽样比例
+    semantic_cache_verify_rate: float = Field(default=0.01, alias="SEMANTIC_CACHE_VERIFY_RATE")
+    # 验证时两次回答的嵌入相似度低于该值记为误命中（回答可以措辞不同，低于问题的命中阈值）
+    semantic_cache_agreement_threshold: float = Field(
+        default=0.8, alias="SEMANTIC_CACHE_AGREEMENT_THRESHOLD"
+    )
+    # 镜像到 QDRANT_URL 的 Qdrant 集合
+    semantic_cache_qdrant: bool = Field(default=False, alias="SEMANTIC_CACHE_QDRANT")
+    semantic_cache_collection: str = Field(
+        default="semantic_cache", alias="SEMANTIC_CACHE_COLLECTION"
+    )
+
+    # 限流（按请求的 user_id / tenant_id，0 表示不限制）
+    rate_limit_enabled: bool = Field(default=False, alias="RATE_LIMIT_ENABLED")
+    rate_limit_rpm: int = Field(default=60, alias="RATE_LIMIT_RPM")
+    rate_limit_rph: int = Field(default=1000, alias="RATE_LIMIT_RPH")
+    # 按请求数限流的算法: sliding（滑动窗口）/ gcra
+    rate_limit_algorithm: str = Field(default="sliding", alias="RATE_LIMIT_ALGORITHM")
+    # 各 worker 从 Redis 租用额度、在本地消耗，允许的全局误差（占最小限额的比例，0 表示不租用）
+    rate_limit_lease_error: float = Field(default=0.0, alias="RATE_LIMIT_LEASE_ERROR")
+    # token 数按 prompt + max_tokens 预留，生成结束后按实际用量调整
+    rate_limit_tpm: int = Field(default=0, alias="RATE_LIMIT_TPM")
+    rate_limit_tpd: int = Field(default=0, alias="RATE_LIMIT_TPD")
+    tenant_rate_limit_rpm: int = Field(default=0, alias="TENANT_RATE_LIMIT_RPM")
+    tenant_rate_limit_tpm: int = Field(default=0, alias="TENANT_RATE_LIMIT_TPM")
+    tenant_rate_limit_tpd: int = Field(default=0, alias="TENANT_RATE_LIMIT_TPD")
+    # 超出限额时等待窗口切换的最长时间（秒），0 表示立即返回 429
+    rate_limit_queue_timeout: float = Field(default=0.0, alias="RATE_LIMIT_QUEUE_TIMEOUT")
+
+    # 链路追踪（OpenTelemetry）
+    tracing_enabled: bool = Field(default=False, alias="TRACING_ENABLED")
+    # 导出器: otlp / console / memory（仅用于测试）
+    tracing_exporter: str = Field(default="otlp", alias="TRACING_EXPORTER")
+    tracing_endpoint: str = Field(
+        default="http://localhost:4318/v1/traces", alias="TRACING_ENDPOINT"
+    )
+    # 根 span 的采样比例；上游已做出采样决定的请求沿用上游的结果
+    tracing_sample_rate: float = Field(default=0.1, alias="TRACING_SAMPLE_RATE")
+    tracing_service_name: str = Field(default="vlinders-server", alias="TRACING_SERVICE_NAME")
+
     # 日志配置
     log_level: str = Field(default="INFO", alias="LOG_LEVEL")
 
+    @property
+    def required_model_names(self) -> List[str]:
+        return [name.strip() for name in self.required_models.split(",") if name.strip()]
+
+    @property
+    def embedding_config(self) -> EmbeddingConfig:
+        return EmbeddingConfig(
+            name=self.embedding_model,
+            backend=self.embedding_backend,
+            path=self.embedding_model_path,
+            device=self.embedding_device,
+            dimension=self.embedding_dimension,
+            max_batch_size=self.embedding_max_batch_size,
+            max_wait_ms=self.embedding_max_wait_ms
+        )
+
 
 class Config:
     """全局配置"""
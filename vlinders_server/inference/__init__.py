@@ -1,16 +1,34 @@
 """
-vLLM 推理服务核心模块
+推理服务核心模块
+
+模型通过可插拔的引擎后端运行（vLLM 或 CPU 模拟引擎），见 backends 子包
 """
 import uuid
+import time
 import asyncio
-from typing import Dict, Optional, List, AsyncGenerator, Any
+from contextlib import aclosing, contextmanager
+from typing import Dict, Optional, List, AsyncGenerator, AsyncIterator, Any, Iterator, Tuple
 from dataclasses import dataclass
 
-from vllm import AsyncLLMEngine, SamplingParams
-from vllm.engine.arg_utils import AsyncEngineArgs
+from prometheus_client import REGISTRY
+from prometheus_client.core import GaugeMetricFamily, Metric
 
 from ..utils import logger
-from ..config import ModelConfig
+from ..config import ModelConfig, config
+from ..metrics import (
+    COMPLETION_TOKENS, INTER_TOKEN_LATENCY, PROMPT_TOKENS, QUEUE_WAIT, REQUESTS, RESPONSE_TIME,
+    TIME_TO_FIRST_TOKEN, TOKENS, CallbackCollector
+)
+from ..tracing import tracing
+from .singleflight import SingleFlight
+from .completion_cache import completion_cache
+from .semantic_cache import semantic_cache
+from .scheduler import RequestScheduler, SchedulerOverloaded
+from .backends import EngineOutput, SamplingConfig
+from .pool import EnginePool
+from .prompt import PromptRenderer, RenderedPrompt
+from .context import ContextWindow
+from .tokenizer_pool import TokenizerPool
 
 
 @dataclass
@@ -19,76 +37,298 @@ class GenerationResult:
     text: str
     finish_reason: str
     usage: Dict[str, int]
+    queue_time: float = 0.0
+
+
+def incremental_text(text: str, offset: int, finished: bool) -> Tuple[str, int]:
+    """
+    计算累计文本相对已发送部分的增量
+
+    增量解码时多字节字符可能被拆开，引擎会在末尾输出 U+FFFD 占位；
+    未结束时保留这些字符，等完整字符解码出来后再发送。
+
+    Returns:
+        (增量文本, 新的偏移量)
+    """
+    end = len(text)
+    if not finished:
+        while end > offset and text[end - 1] == "\ufffd":
+            end -= 1
+
+    if end <= offset:
+        return "", offset
+    return text[offset:end], end
 
 
 class VLLMInferenceService:
-    """基于 vLLM 的推理服务"""
+    """推理服务（默认使用 vLLM 后端）"""
 
     def __init__(self):
-        self.engines: Dict[str, AsyncLLMEngine] = {}
+        self.engines: Dict[str, EnginePool] = {}
         self.model_configs: Dict[str, ModelConfig] = {}
-        self._lock = asyncio.Lock()
+        self.renderers: Dict[str, PromptRenderer] = {}
+        self.context_windows: Dict[str, ContextWindow] = {}
+        # 可服务的全部模型（含未加载的按需模型）
+        self.catalog: Dict[str, ModelConfig] = {}
+        # 每个模型独立加锁，不同模型可以并行加载/卸载
+        self._model_locks: Dict[str, asyncio.Lock] = {}
+        # 显存预算的检查与预留需要全局串行
+        self._budget_lock = asyncio.Lock()
+        self._reserved_memory: Dict[str, float] = {}
+        self._singleflight = SingleFlight()
+        self.scheduler = RequestScheduler()
+        # 分词在每个模型独立的线程上执行，不占用事件循环
+        self.tokenizers = TokenizerPool(max_batch=config.server.tokenizer_max_batch)
+        self._loading: Dict[str, asyncio.Task] = {}
+        self._load_errors: Dict[str, str] = {}
+        self._last_used: Dict[str, float] = {}
+        # 每个模型从渲染 prompt 到生成结束的请求数（见 hold），不为 0 时不会被 LRU 卸载
+        self._holds: Dict[str, int] = {}
+        # 提前结束（客户端断开、取消、超过截止时间）而在引擎中中止的请求
+        self.abort_stats: Dict[str, int] = {
+            "aborted_requests": 0,
+            "deadline_exceeded": 0,
+            # 中止前已生成但没有送达的 token
+            "wasted_tokens": 0,
+            # 因中止而不再生成的 token（max_tokens 的剩余部分）
+            "aborted_tokens": 0,
+        }
+
+    def register_model(self, model_name: str, model_config: ModelConfig) -> None:
+        """登记模型，按需模型在首次请求时加载"""
+
+        self.catalog[model_name] = model_config
 
     async def load_model(
         self,
         model_name: str,
         model_config: ModelConfig
     ) -> None:
-        """加载模型到 vLLM"""
+        """加载模型到推理引擎"""
 
-        async with self._lock:
+        self.register_model(model_name, model_config)
+
+        async with self._model_lock(model_name):
             if model_name in self.engines:
                 logger.warning(f"Model {model_name} already loaded")
                 return
 
-            logger.info(f"Loading model {model_name} from {model_config.path}")
+            # 超出显存预算时先卸载最久未使用的空闲模型，然后预留本模型的显存
+            async with self._budget_lock:
+                await self._make_room(model_name, model_config)
+                self._reserved_memory[model_name] = model_config.memory_gb
 
-            try:
-                # 配置引擎参数
-                engine_args = AsyncEngineArgs(
-                    model=model_config.path,
-                    tensor_parallel_size=model_config.tensor_parallel_size,
-                    dtype=model_config.dtype,
-                    max_model_len=model_config.max_model_len,
-                    gpu_memory_utilization=model_config.gpu_memory_utilization,
-                    trust_remote_code=model_config.trust_remote_code,
-                    enable_prefix_caching=model_config.enable_prefix_caching,
-                    disable_log_stats=False
-                )
+            logger.info(
+                f"Loading model {model_name} from {model_config.path} "
+                f"(backend={model_config.backend})"
+            )
 
-                # 创建引擎
-                engine = AsyncLLMEngine.from_engine_args(engine_args)
+            try:
+                # 创建并启动引擎副本
+                engine = await EnginePool.start(model_config)
 
                 self.engines[model_name] = engine
                 self.model_configs[model_name] = model_config
+                tokenizer = await engine.get_tokenizer()
+                self.renderers[model_name] = PromptRenderer(
+                    tokenizer,
+                    max_prefixes=config.server.prompt_prefix_cache_size
+                )
+                self.tokenizers.register(model_name, tokenizer)
+                self.context_windows[model_name] = ContextWindow(
+                    model_config.max_model_len, tokenizer
+                )
+                self.scheduler.configure(
+                    model_name,
+                    max_concurrency=model_config.max_concurrency,
+                    max_queue_size=model_config.max_queue_size,
+                    queue_timeout=model_config.queue_timeout
+                )
+                self._last_used[model_name] = time.monotonic()
+                self._load_errors.pop(model_name, None)
+
+                await completion_cache.sync_epoch(model_name)
 
                 logger.info(
                     f"✅ Model {model_name} loaded successfully "
                     f"(TP={model_config.tensor_parallel_size}, "
+                    f"replicas={model_config.replicas}, "
                     f"max_len={model_config.max_model_len})"
                 )
 
             except Exception as e:
+                self._load_errors[model_name] = str(e)
                 logger.error(f"Failed to load model {model_name}: {e}")
                 raise
 
-    async def unload_model(self, model_name: str) -> None:
-        """卸载模型"""
+            finally:
+                self._reserved_memory.pop(model_name, None)
 
-        async with self._lock:
-            if model_name not in self.engines:
-                logger.warning(f"Model {model_name} not loaded")
-                return
+    async def load_models(self, model_names: List[str]) -> Dict[str, Optional[str]]:
+        """
+        并行加载多个模型，单个模型失败不影响其他模型
+
+        Returns:
+            模型名 -> 错误信息（成功为 None）
+        """
+
+        results = await asyncio.gather(
+            *(self.ensure_loaded(name) for name in model_names),
+            return_exceptions=True
+        )
+        return {
+            name: str(result) if isinstance(result, BaseException) else None
+            for name, result in zip(model_names, results)
+        }
+
+    async def unload_model(self, model_name: str, invalidate_cache: bool = True) -> None:
+        """
+        卸载模型
+
+        Args:
+            invalidate_cache: 是否使该模型的补全缓存失效（权重将要变化时使用；
+                按需卸载和关闭时权重不变，无需失效）
+        """
+
+        async with self._model_lock(model_name):
+            await self._unload_locked(model_name, invalidate_cache)
+
+    async def shutdown(self) -> None:
+        """取消进行中的加载并卸载全部模型"""
+
+        for task in list(self._loading.values()):
+            task.cancel()
+        await asyncio.gather(*self._loading.values(), return_exceptions=True)
+
+        # 权重没有变化，不能使共享的补全缓存失效（滚动重启时其他 worker 仍在使用）
+        for model_name in self.list_models():
+            await self.unload_model(model_name, invalidate_cache=False)
+
+    def _model_lock(self, model_name: str) -> asyncio.Lock:
+        return self._model_locks.setdefault(model_name, asyncio.Lock())
+
+    async def _unload_locked(self, model_name: str, invalidate_cache: bool) -> None:
+        if model_name not in self.engines:
+            logger.warning(f"Model {model_name} not loaded")
+            return
+
+        logger.info(f"Unloading model {model_name}")
+
+        engine = self.engines.pop(model_name)
+        await engine.shutdown()
+        del self.model_configs[model_name]
+        del self.renderers[model_name]
+        del self.context_windows[model_name]
+        self.tokenizers.remove(model_name)
+        self.scheduler.remove(model_name)
+        self._last_used.pop(model_name, None)
+
+        # 重新加载的模型可能权重已变化，旧的补全缓存不能再复用
+        if invalidate_cache:
+            await completion_cache.invalidate_model(model_name)
+
+        logger.info(f"✅ Model {model_name} unloaded")
+
+    async def _make_room(self, model_name: str, model_config: ModelConfig) -> None:
+        """按 LRU 卸载空闲模型，直到新模型能放进显存预算"""
+
+        budget = config.server.model_memory_budget_gb
+        if budget <= 0:
+            return
+
+        used = sum(cfg.memory_gb for cfg in self.model_configs.values())
+        used += sum(self._reserved_memory.values())
+        while used + model_config.memory_gb > budget:
+            idle = [
+                name for name in self.engines
+                if not self._in_use(name) and not self._model_lock(name).locked()
+            ]
+            if not idle:
+                raise SchedulerOverloaded(
+                    model_name,
+                    f"model memory budget exhausted ({used:.1f}/{budget:.1f} GB in use)",
+                    retry_after=self.scheduler.retry_after(model_name)
+                )
+
+            victim = min(idle, key=lambda name: self._last_used.get(name, 0.0))
+            used -= self.model_configs[victim].memory_gb
+            logger.info(f"Evicting idle model {victim} to load {model_name}")
+            async with self._model_lock(victim):
+                await self._unload_locked(victim, invalidate_cache=False)
+
+    @contextmanager
+    def hold(self, model_name: str) -> Iterator[None]:
+        """
+        在此期间模型计为使用中，不会为了加载其他模型而被卸载
+
+        请求从渲染 prompt、分词开始就要持有，直到生成结束：调度器只统计已提交生成的请求，
+        卸载时分词线程中尚未完成的任务会被取消
+        """
+
+        self._holds[model_name] = self._holds.get(model_name, 0) + 1
+        try:
+            yield
+        finally:
+            self._holds[model_name] -= 1
+            if not self._holds[model_name]:
+                del self._holds[model_name]
+
+    def _in_use(self, model_name: str) -> bool:
+        """模型是否有正在执行、排队或准备中（渲染 prompt、分词）的请求"""
+
+        if self._holds.get(model_name):
+            return True
+        stats = self.scheduler.get_stats(model_name)
+        if stats and (stats["active"] or stats["queue_depth"]):
+            return True
+        return any(replica.in_flight_requests for replica in self.engines[model_name].replicas)
+
+    async def ensure_loaded(self, model_name: str) -> EnginePool:
+        """返回模型引擎，未加载的按需模型在此加载（并发请求共享同一次加载）"""
 
-            logger.info(f"Unloading model {model_name}")
+        engine = self.engines.get(model_name)
+        if engine is not None:
+            self._last_used[model_name] = time.monotonic()
+            return engine
+
+        model_config = self.catalog.get(model_name)
+        if model_config is None:
+            raise ValueError(f"Model {model_name} not loaded")
+
+        task = self._loading.get(model_name)
+        if task is None:
+            task = asyncio.create_task(self.load_model(model_name, model_config))
+            self._loading[model_name] = task
+            task.add_done_callback(lambda t: self._load_finished(model_name, t))
+
+        await asyncio.shield(task)
+        return self.get_engine(model_name)
+
+    def _load_finished(self, model_name: str, task: asyncio.Task) -> None:
+        if self._loading.get(model_name) is task:
+            del self._loading[model_name]
+        # 所有等待者都已取消时也要取出异常，避免未处理异常的警告
+        if not task.cancelled():
+            task.exception()
+
+    def model_state(self, model_name: str) -> str:
+        """模型状态: loaded / loading / failed / cold"""
 
-            # vLLM 会自动清理资源
-            del self.engines[model_name]
-            del self.model_configs[model_name]
+        if model_name in self.engines:
+            return "loaded"
+        if model_name in self._loading or self._model_lock(model_name).locked():
+            return "loading"
+        if model_name in self._load_errors:
+            return "failed"
+        return "cold"
 
-            logger.info(f"✅ Model {model_name} unloaded")
+    def model_states(self) -> Dict[str, str]:
+        """全部已登记模型的状态"""
 
-    def get_engine(self, model_name: str) -> AsyncLLMEngine:
+        names = list(self.catalog) + [name for name in self.engines if name not in self.catalog]
+        return {name: self.model_state(name) for name in names}
+
+    def get_engine(self, model_name: str) -> EnginePool:
         """获取模型引擎"""
 
         engine = self.engines.get(model_name)
@@ -100,6 +340,113 @@ class VLLMInferenceService:
         """列出已加载的模型"""
         return list(self.engines.keys())
 
+    def replica_stats(self) -> Dict[str, List[Dict[str, Any]]]:
+        """每个模型各副本的负载"""
+        return {name: pool.get_stats() for name, pool in self.engines.items()}
+
+    async def render_prompt(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        max_tokens: Optional[int] = None
+    ) -> RenderedPrompt:
+        """
+        按模型的 chat template 渲染消息（复用缓存的前缀 token）
+
+        Args:
+            max_tokens: 请求的生成长度；提供且开启上下文裁剪时，先把消息裁剪到上下文窗口内，
+                调整后的生成长度见 RenderedPrompt.max_tokens
+        """
+
+        with self.hold(model):
+            await self.ensure_loaded(model)
+            if max_tokens is None or not config.server.context_trimming_enabled:
+                return await self.tokenizers.run(model, self.renderers[model].render, messages)
+            return await self.tokenizers.run(
+                model, self._fit_and_render, model, messages, max_tokens
+            )
+
+    def _fit_and_render(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        max_tokens: int
+    ) -> RenderedPrompt:
+        """裁剪到上下文窗口内再渲染（在模型的分词线程上执行）"""
+
+        window = self.context_windows[model]
+        renderer = self.renderers[model]
+
+        fitted = window.fit(messages, max_tokens)
+        prompt = renderer.render(fitted.messages)
+        prompt_tokens = fitted.prompt_tokens
+        if prompt.token_ids is not None:
+            prompt_tokens = len(prompt.token_ids)
+            # 模板开销的估计偏小时，按实际误差再裁剪一次
+            if prompt_tokens + fitted.max_tokens > window.max_model_len:
+                slack = prompt_tokens - fitted.prompt_tokens
+                fitted = window.fit(messages, max_tokens, slack=slack)
+                prompt = renderer.render(fitted.messages)
+                prompt_tokens = len(prompt.token_ids)
+
+        prompt.max_tokens = max(min(fitted.max_tokens, window.max_model_len - prompt_tokens), 1)
+        prompt.dropped_messages = fitted.dropped_messages
+        prompt.truncated_messages = fitted.truncated_messages
+        return prompt
+
+    async def count_tokens(
+        self,
+        model: str,
+        conversations: List[List[Dict[str, str]]]
+    ) -> Tuple[List[int], bool]:
+        """
+        计算每组消息渲染后的 prompt token 数
+
+        Returns:
+            (每组的 token 数, 是否为精确值；模型没有 tokenizer 时按 4 字符 / token 估算)
+        """
+
+        with self.hold(model):
+            await self.ensure_loaded(model)
+            renderer = self.renderers[model]
+            texts = await self.tokenizers.run(
+                model, lambda: [renderer.render_text(messages) for messages in conversations]
+            )
+
+            if not self.tokenizers.has_tokenizer(model):
+                return [len(text) // 4 for text in texts], False
+
+            token_ids = await self.tokenizers.encode_batch(model, texts)
+            return [len(ids) for ids in token_ids], True
+
+    @staticmethod
+    def _request_cost(
+        prompt: str,
+        prompt_token_ids: Optional[List[int]],
+        sampling: SamplingConfig
+    ) -> int:
+        """请求占用的 token 数估计，用于副本负载均衡"""
+
+        prompt_tokens = len(prompt_token_ids) if prompt_token_ids is not None else len(prompt) // 4
+        return prompt_tokens + sampling.max_tokens
+
+    def _coalesce_key(self, model: str, prompt: str, sampling: SamplingConfig) -> Optional[tuple]:
+        """确定性请求的合并 key，非确定性请求返回 None"""
+
+        if not config.server.enable_request_coalescing:
+            return None
+        if sampling.temperature != 0 and sampling.seed is None:
+            return None
+        return (
+            model,
+            prompt,
+            sampling.max_tokens,
+            sampling.temperature,
+            sampling.top_p,
+            tuple(sampling.stop),
+            sampling.seed
+        )
+
     async def generate(
         self,
         model: str,
@@ -108,43 +455,91 @@ class VLLMInferenceService:
         temperature: float = 0.7,
         top_p: float = 0.95,
         stop: Optional[List[str]] = None,
-        stream: bool = False
+        stream: bool = False,
+        seed: Optional[int] = None,
+        priority: str = "normal",
+        prompt_token_ids: Optional[List[int]] = None,
+        timeout: Optional[float] = None
     ) -> GenerationResult:
-        """生成文本（非流式）"""
+        """
+        生成文本（非流式）
 
-        engine = self.get_engine(model)
+        Args:
+            timeout: 截止时间（秒，含排队），为空时使用 REQUEST_TIMEOUT；超时抛出 TimeoutError
+        """
 
-        # 配置采样参数
-        sampling_params = SamplingParams(
+        sampling = SamplingConfig(
+            max_tokens=max_tokens,
             temperature=temperature,
             top_p=top_p,
-            max_tokens=max_tokens,
-            stop=stop or []
+            stop=stop or [],
+            seed=seed
         )
 
+        key = self._coalesce_key(model, prompt, sampling)
+        if key is None:
+            run = self._generate(model, prompt, prompt_token_ids, sampling, priority)
+        else:
+            # 相同的确定性请求共享同一次生成（只有首个请求占用调度槽位）
+            run = self._singleflight.do(
+                key,
+                lambda: self._generate(model, prompt, prompt_token_ids, sampling, priority)
+            )
+
+        # 超时会取消生成，引擎中的请求随之中止
+        timeout = self._request_timeout(timeout)
+        try:
+            async with asyncio.timeout(timeout):
+                return await run
+        except TimeoutError:
+            self.abort_stats["deadline_exceeded"] += 1
+            raise TimeoutError(f"Request exceeded its deadline of {timeout}s") from None
+
+    async def _generate(
+        self,
+        model: str,
+        prompt: str,
+        prompt_token_ids: Optional[List[int]],
+        sampling: SamplingConfig,
+        priority: str
+    ) -> GenerationResult:
+        """执行一次非流式生成"""
+
+        started = time.monotonic()
+        engine = await self.ensure_loaded(model)
+
         # 生成请求 ID
         request_id = f"req_{uuid.uuid4().hex[:8]}"
 
         logger.debug(f"Generating text for request {request_id}")
 
-        # 异步生成
+        # 异步生成（先经过调度器准入，再分发到负载最低的副本）
         final_output = None
-        async for output in engine.generate(prompt, sampling_params, request_id):
-            final_output = output
+        cost = self._request_cost(prompt, prompt_token_ids, sampling)
+        queued_at = time.time_ns()
+        async with self.scheduler.slot(model, priority) as queue_wait:
+            QUEUE_WAIT.labels(model=model).observe(queue_wait)
+            tracing.record("queue", queued_at, attributes={"gen_ai.request.model": model})
+            async with engine.lease(cost, prompt, prompt_token_ids) as replica:
+                async for output in self._engine_outputs(
+                    replica, model, prompt, sampling, request_id, prompt_token_ids, started
+                ):
+                    final_output = output
 
         # 返回结果
-        if final_output and final_output.outputs:
+        if final_output:
             result = GenerationResult(
-                text=final_output.outputs[0].text,
-                finish_reason=final_output.outputs[0].finish_reason,
+                text=final_output.text,
+                finish_reason=final_output.finish_reason,
                 usage={
                     "prompt_tokens": len(final_output.prompt_token_ids),
-                    "completion_tokens": len(final_output.outputs[0].token_ids),
+                    "completion_tokens": len(final_output.token_ids),
                     "total_tokens": (
                         len(final_output.prompt_token_ids) +
-                        len(final_output.outputs[0].token_ids)
+                        len(final_output.token_ids)
                     )
-                }
+                },
+                queue_time=queue_wait
             )
 
             logger.debug(
@@ -163,45 +558,291 @@ class VLLMInferenceService:
         max_tokens: int = 2048,
         temperature: float = 0.7,
         top_p: float = 0.95,
-        stop: Optional[List[str]] = None
+        stop: Optional[List[str]] = None,
+        seed: Optional[int] = None,
+        priority: str = "normal",
+        prompt_token_ids: Optional[List[int]] = None,
+        timeout: Optional[float] = None
     ) -> AsyncGenerator[Dict[str, Any], None]:
-        """生成文本（流式）"""
+        """
+        生成文本（流式）
+
+        调用方提前关闭生成器（客户端断开）时，引擎中的请求会被中止
 
-        engine = self.get_engine(model)
+        Args:
+            timeout: 整个流的截止时间（秒，含排队），为空时使用 REQUEST_TIMEOUT
+        """
 
-        # 配置采样参数
-        sampling_params = SamplingParams(
+        sampling = SamplingConfig(
+            max_tokens=max_tokens,
             temperature=temperature,
             top_p=top_p,
-            max_tokens=max_tokens,
-            stop=stop or []
+            stop=stop or [],
+            seed=seed
         )
 
+        key = self._coalesce_key(model, prompt, sampling)
+        if key is None:
+            stream = self._generate_stream(model, prompt, prompt_token_ids, sampling, priority)
+        else:
+            # 相同的确定性请求订阅同一条流
+            stream = self._singleflight.stream(
+                key,
+                lambda: self._generate_stream(
+                    model, prompt, prompt_token_ids, sampling, priority
+                )
+            )
+
+        timeout = self._request_timeout(timeout)
+        if timeout is None:
+            async with aclosing(stream):
+                async for chunk in stream:
+                    yield chunk
+            return
+
+        deadline = asyncio.get_running_loop().time() + timeout
+        async with aclosing(stream):
+            while True:
+                try:
+                    # 只在等待下一块时计时，超时取消的是生成本身而不是消费方
+                    async with asyncio.timeout_at(deadline):
+                        chunk = await anext(stream)
+                except StopAsyncIteration:
+                    return
+                except TimeoutError:
+                    self.abort_stats["deadline_exceeded"] += 1
+                    raise TimeoutError(
+                        f"Request exceeded its deadline of {timeout}s"
+                    ) from None
+                yield chunk
+
+    async def _generate_stream(
+        self,
+        model: str,
+        prompt: str,
+        prompt_token_ids: Optional[List[int]],
+        sampling: SamplingConfig,
+        priority: str
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """执行一次流式生成"""
+
+        started = time.monotonic()
+        engine = await self.ensure_loaded(model)
+
         # 生成请求 ID
         request_id = f"req_{uuid.uuid4().hex[:8]}"
 
         logger.debug(f"Streaming generation for request {request_id}")
 
-        # 流式生成
-        async for output in engine.generate(prompt, sampling_params, request_id):
-            if output.outputs:
-                yield {
-                    "text": output.outputs[0].text,
-                    "finish_reason": output.outputs[0].finish_reason,
-                    "done": output.finished
-                }
+        # 流式生成（整个流期间占用调度槽位），只发送新增的文本和 token
+        text_offset = 0
+        token_offset = 0
+        cost = self._request_cost(prompt, prompt_token_ids, sampling)
+        queued_at = time.time_ns()
+        async with self.scheduler.slot(model, priority) as queue_wait:
+            QUEUE_WAIT.labels(model=model).observe(queue_wait)
+            tracing.record("queue", queued_at, attributes={"gen_ai.request.model": model})
+            async with (
+                engine.lease(cost, prompt, prompt_token_ids) as replica,
+                aclosing(self._engine_outputs(
+                    replica, model, prompt, sampling, request_id, prompt_token_ids, started
+                )) as outputs
+            ):
+                async for output in outputs:
+                    delta, text_offset = incremental_text(
+                        output.text, text_offset, output.finished
+                    )
+                    token_ids = output.token_ids[token_offset:]
+                    token_offset = len(output.token_ids)
+
+                    if not delta and not token_ids and not output.finished:
+                        continue
+
+                    yield {
+                        "text": delta,
+                        "token_ids": token_ids,
+                        "finish_reason": output.finish_reason,
+                        "done": output.finished
+                    }
 
         logger.debug(f"Request {request_id} stream completed")
 
+    async def _engine_outputs(
+        self,
+        replica: Any,
+        model: str,
+        prompt: str,
+        sampling: SamplingConfig,
+        request_id: str,
+        prompt_token_ids: Optional[List[int]],
+        started: float
+    ) -> AsyncIterator[EngineOutput]:
+        """
+        逐步返回引擎输出，并记录首 token 延迟和 token 间延迟
+
+        未生成完就退出（取消、超时或调用方关闭生成器）时，立即在引擎中中止该请求，
+        释放其 KV cache 和批处理位置
+
+        Args:
+            started: 请求开始时间（time.monotonic()，含加载和排队）
+        """
+
+        generated = 0
+        prompt_tokens = 0
+        finished = False
+        status = "error"
+        last_token_at: Optional[float] = None
+        submitted_ns = time.time_ns()
+        first_token_ns: Optional[int] = None
+        try:
+            async with aclosing(
+                replica.backend.generate(prompt, sampling, request_id, prompt_token_ids)
+            ) as outputs:
+                async for output in outputs:
+                    new_tokens = len(output.token_ids) - generated
+                    if new_tokens > 0:
+                        now = time.monotonic()
+                        if last_token_at is None:
+                            TIME_TO_FIRST_TOKEN.labels(model=model).observe(now - started)
+                            first_token_ns = time.time_ns()
+                        else:
+                            # 一次输出包含多个 token 时按平均间隔记录
+                            INTER_TOKEN_LATENCY.observe(
+                                model, (now - last_token_at) / new_tokens, new_tokens
+                            )
+                        last_token_at = now
+                    generated = len(output.token_ids)
+                    prompt_tokens = len(output.prompt_token_ids)
+                    finished = output.finished
+                    yield output
+            if finished:
+                status = "success"
+        except (GeneratorExit, asyncio.CancelledError):
+            status = "aborted"
+            raise
+        finally:
+            if not finished:
+                await replica.backend.abort(request_id)
+                self.abort_stats["aborted_requests"] += 1
+                self.abort_stats["wasted_tokens"] += generated
+                self.abort_stats["aborted_tokens"] += max(sampling.max_tokens - generated, 0)
+                logger.info(f"Request {request_id} aborted after {generated} tokens")
+            self._record_request(model, status, started, prompt_tokens, generated)
+            self._record_spans(
+                model, request_id, status, submitted_ns, first_token_ns, prompt_tokens, generated
+            )
+
+    @staticmethod
+    def _record_spans(
+        model: str,
+        request_id: str,
+        status: str,
+        submitted_ns: int,
+        first_token_ns: Optional[int],
+        prompt_tokens: int,
+        completion_tokens: int
+    ) -> None:
+        """补记 prefill（提交至首个 token）和 decode（首个 token 至结束）两个阶段的 span"""
+
+        attributes = {"gen_ai.request.model": model, "vlinders.request_id": request_id}
+        tracing.record(
+            "prefill", submitted_ns, first_token_ns,
+            attributes={**attributes, "gen_ai.usage.input_tokens": prompt_tokens}
+        )
+        if first_token_ns is not None:
+            tracing.record(
+                "decode", first_token_ns,
+                attributes={
+                    **attributes,
+                    "gen_ai.usage.output_tokens": completion_tokens,
+                    "vlinders.status": status
+                }
+            )
+
+    @staticmethod
+    def _record_request(
+        model: str,
+        status: str,
+        started: float,
+        prompt_tokens: int,
+        completion_tokens: int
+    ) -> None:
+        """记录请求结果、端到端延迟和 token 数"""
+
+        REQUESTS.labels(model=model, status=status).inc()
+        TOKENS.labels(model=model, kind="prompt").inc(prompt_tokens)
+        TOKENS.labels(model=model, kind="completion").inc(completion_tokens)
+        if status == "success":
+            RESPONSE_TIME.labels(model=model).observe(time.monotonic() - started)
+            PROMPT_TOKENS.labels(model=model).observe(prompt_tokens)
+            COMPLETION_TOKENS.labels(model=model).observe(completion_tokens)
+
+    @staticmethod
+    def _request_timeout(timeout: Optional[float]) -> Optional[float]:
+        """请求的截止时间，未指定时使用 REQUEST_TIMEOUT（0 表示不限制）"""
+
+        if timeout is None:
+            timeout = config.server.request_timeout
+        return timeout or None
+
     async def health_check(self) -> Dict[str, Any]:
         """健康检查"""
 
         return {
             "status": "healthy",
             "models_loaded": self.list_models(),
-            "model_count": len(self.engines)
+            "model_states": self.model_states(),
+            "load_errors": dict(self._load_errors),
+            "model_count": len(self.engines),
+            "replicas": self.replica_stats(),
+            "coalescing": self.coalescing_stats(),
+            "aborts": dict(self.abort_stats),
+            "completion_cache": completion_cache.get_stats(),
+            "semantic_cache": semantic_cache.get_stats(),
+            "scheduler": self.scheduler.get_stats(),
+            "prompt_cache": {
+                name: renderer.get_stats() for name, renderer in self.renderers.items()
+            },
+            "tokenizers": self.tokenizers.get_stats(),
+            "context": {
+                name: window.get_stats() for name, window in self.context_windows.items()
+            }
+        }
+
+    def coalescing_stats(self) -> Dict[str, int]:
+        """在途请求合并统计"""
+
+        return {
+            **self._singleflight.stats,
+            "in_flight": self._singleflight.in_flight()
         }
 
+    def collect_metrics(self) -> List[Metric]:
+        """采集时读取的瞬时指标：运行中 / 排队的请求数和各副本的在途 token"""
+
+        running = GaugeMetricFamily(
+            "vlinders_requests_running", "Requests holding a scheduler slot", labels=["model"]
+        )
+        queued = GaugeMetricFamily(
+            "vlinders_requests_queued", "Requests waiting for a scheduler slot", labels=["model"]
+        )
+        for model, stats in self.scheduler.get_stats().items():
+            running.add_metric([model], stats["active"])
+            queued.add_metric([model], stats["queue_depth"])
+
+        in_flight_tokens = GaugeMetricFamily(
+            "vlinders_replica_in_flight_tokens",
+            "Estimated tokens in flight on each engine replica",
+            labels=["model", "replica"]
+        )
+        for model, replicas in self.replica_stats().items():
+            for replica in replicas:
+                in_flight_tokens.add_metric(
+                    [model, str(replica["index"])], replica["in_flight_tokens"]
+                )
+        return [running, queued, in_flight_tokens]
+
 
 # 全局推理服务实例
 vllm_service = VLLMInferenceService()
+REGISTRY.register(CallbackCollector(vllm_service.collect_metrics))
@@ -0,0 +1,40 @@
+"""
+推理引擎后端
+
+每个模型按 ModelConfig.backend 选择后端:
+- vllm: vLLM AsyncLLMEngine（需要 GPU）
+- simulated: CPU 模拟引擎（用于压测和 CI）
+"""
+from typing import Dict, Optional, Type
+
+from ...config import ModelConfig
+from .base import EngineBackend, EngineOutput, SamplingConfig
+from .simulated import SimulatedBackend
+from .vllm_backend import VLLMBackend
+
+
+BACKENDS: Dict[str, Type[EngineBackend]] = {
+    VLLMBackend.name: VLLMBackend,
+    SimulatedBackend.name: SimulatedBackend,
+}
+
+
+def create_backend(model_config: ModelConfig, devices: Optional[str] = None) -> EngineBackend:
+    """根据模型配置创建引擎后端"""
+    backend_cls = BACKENDS.get(model_config.backend)
+    if backend_cls is None:
+        raise ValueError(
+            f"Unknown engine backend '{model_config.backend}' for model {model_config.name}"
+        )
+    return backend_cls(model_config, devices)
+
+
+__all__ = [
+    "BACKENDS",
+    "EngineBackend",
+    "EngineOutput",
+    "SamplingConfig",
+    "SimulatedBackend",
+    "VLLMBackend",
+    "create_backend",
+]
@@ -0,0 +1,67 @@
+"""
+推理引擎后端接口
+"""
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, List, Optional
+
+from ...config import ModelConfig
+
+
+@dataclass
+class SamplingConfig:
+    """与具体引擎无关的采样参数"""
+    max_tokens: int = 2048
+    temperature: float = 0.7
+    top_p: float = 0.95
+    stop: List[str] = field(default_factory=list)
+    seed: Optional[int] = None
+
+
+@dataclass
+class EngineOutput:
+    """
+    引擎的一次增量输出（text / token_ids 为截至目前的累计值）
+
+    token_ids 是各次输出间不断追加的同一个列表，使用方按长度取新增部分，不要保留引用
+    """
+    text: str
+    token_ids: List[int]
+    prompt_token_ids: List[int]
+    finish_reason: Optional[str] = None
+    finished: bool = False
+
+
+class EngineBackend(ABC):
+    """推理引擎后端"""
+
+    name: str = "base"
+
+    def __init__(self, model_config: ModelConfig, devices: Optional[str] = None):
+        self.model_config = model_config
+        # 该副本使用的 GPU（CUDA_VISIBLE_DEVICES 格式），None 表示沿用进程设置
+        self.devices = devices
+
+    @abstractmethod
+    async def start(self) -> None:
+        """初始化引擎（加载权重等）"""
+
+    @abstractmethod
+    def generate(
+        self,
+        prompt: str,
+        sampling: SamplingConfig,
+        request_id: str,
+        prompt_token_ids: Optional[List[int]] = None
+    ) -> AsyncIterator[EngineOutput]:
+        """提交请求并逐步返回输出（提供 prompt_token_ids 时引擎不再分词）"""
+
+    async def get_tokenizer(self) -> Any:
+        """返回模型的 tokenizer，默认没有"""
+        return None
+
+    async def abort(self, request_id: str) -> None:
+        """中止请求，默认无操作"""
+
+    async def shutdown(self) -> None:
+        """释放引擎资源，默认无操作"""
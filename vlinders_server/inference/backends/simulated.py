@@ -0,0 +1,130 @@
+"""
+CPU 模拟引擎后端
+
+不加载任何权重，按配置的延迟模型逐个输出 token，用于在没有 GPU 的机器上
+对 HTTP、调度、缓存和流式层做压测：
+- 启动耗时 = sim_load_latency
+- 预填充耗时 = sim_prefill_latency + prompt_tokens * sim_prefill_per_token
+- 每个 token 耗时 = sim_token_latency
+- 并发放大: 以上耗时乘以 1 + sim_concurrency_slowdown * (并发数 - 1)
+"""
+import asyncio
+import random
+import zlib
+from typing import AsyncIterator, List, Optional, Set
+
+from ...config import ModelConfig
+from .base import EngineBackend, EngineOutput, SamplingConfig
+
+
+_WORDS = (
+    "the model answers with a short synthetic sentence about code tests data "
+    "latency tokens cache queue stream batch server request response engine"
+).split()
+
+
+class SimpleTokenizer:
+    """按空白切分并哈希到固定词表的简易分词器（没有 chat template）"""
+
+    VOCAB_SIZE = 32000
+
+    chat_template = None
+
+    def encode(self, text: str, add_special_tokens: bool = True) -> List[int]:
+        return [self.token_id(word) for word in text.split()]
+
+    def token_id(self, word: str) -> int:
+        return zlib.crc32(word.encode("utf-8")) % self.VOCAB_SIZE
+
+
+class SimulatedBackend(EngineBackend):
+    """按延迟模型生成伪文本的模拟后端"""
+
+    name = "simulated"
+
+    def __init__(self, model_config: ModelConfig, devices: Optional[str] = None):
+        super().__init__(model_config, devices)
+        self.tokenizer = SimpleTokenizer()
+        self.active = 0
+        self._running: Set[str] = set()
+        self._aborted: Set[str] = set()
+
+    async def start(self) -> None:
+        await asyncio.sleep(self.model_config.sim_load_latency)
+
+    async def get_tokenizer(self) -> SimpleTokenizer:
+        return self.tokenizer
+
+    def _slowdown(self) -> float:
+        return 1.0 + self.model_config.sim_concurrency_slowdown * max(self.active - 1, 0)
+
+    async def generate(
+        self,
+        prompt: str,
+        sampling: SamplingConfig,
+        request_id: str,
+        prompt_token_ids: Optional[List[int]] = None
+    ) -> AsyncIterator[EngineOutput]:
+        model_config = self.model_config
+        if prompt_token_ids is None:
+            prompt_token_ids = self.tokenizer.encode(prompt)
+
+        # 确定性请求输出固定，其余请求每次不同
+        if sampling.temperature == 0 or sampling.seed is not None:
+            rng = random.Random(zlib.crc32(prompt.encode("utf-8")) ^ (sampling.seed or 0))
+        else:
+            rng = random.Random()
+
+        max_tokens = sampling.max_tokens
+        if model_config.sim_output_tokens is not None:
+            max_tokens = min(max_tokens, model_config.sim_output_tokens)
+
+        self.active += 1
+        self._running.add(request_id)
+        try:
+            await asyncio.sleep(
+                (
+                    model_config.sim_prefill_latency
+                    + len(prompt_token_ids) * model_config.sim_prefill_per_token
+                ) * self._slowdown()
+            )
+
+            text = ""
+            token_ids: List[int] = []
+            for i in range(max_tokens):
+                if request_id in self._aborted:
+                    return
+
+                word = rng.choice(_WORDS)
+                text += word if i == 0 else f" {word}"
+                token_ids.append(self.tokenizer.token_id(word))
+
+                finish_reason = None
+                for stop in sampling.stop:
+                    if stop and stop in text:
+                        text = text[:text.index(stop)]
+                        finish_reason = "stop"
+                        break
+                if finish_reason is None and len(token_ids) == max_tokens:
+                    finish_reason = "length" if max_tokens == sampling.max_tokens else "stop"
+
+                yield EngineOutput(
+                    text=text,
+                    token_ids=token_ids,
+                    prompt_token_ids=prompt_token_ids,
+                    finish_reason=finish_reason,
+                    finished=finish_reason is not None
+                )
+
+                if finish_reason is not None:
+                    return
+
+                await asyncio.sleep(model_config.sim_token_latency * self._slowdown())
+        finally:
+            self.active -= 1
+            self._running.discard(request_id)
+            self._aborted.discard(request_id)
+
+    async def abort(self, request_id: str) -> None:
+        if request_id in self._running:
+            self._aborted.add(request_id)
@@ -0,0 +1,171 @@
+"""
+vLLM 引擎后端
+"""
+import asyncio
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from ...config import ModelConfig
+from .base import EngineBackend, EngineOutput, SamplingConfig
+
+
+class _DevicesLock:
+    """
+    CUDA_VISIBLE_DEVICES 的读写锁
+
+    环境变量是进程级的：固定 GPU 的副本临时修改它时独占（逐个创建），
+    其余引擎的创建共享（可以并行），但不会在修改期间读到别的副本的设置
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writing = False
+
+    @contextmanager
+    def shared(self) -> Iterator[None]:
+        with self._condition:
+            self._condition.wait_for(lambda: not self._writing)
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                self._condition.notify_all()
+
+    @contextmanager
+    def exclusive(self) -> Iterator[None]:
+        with self._condition:
+            self._condition.wait_for(lambda: not self._writing and self._readers == 0)
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+
+_devices_lock = _DevicesLock()
+
+
+class VLLMBackend(EngineBackend):
+    """基于 vLLM AsyncLLMEngine 的后端"""
+
+    name = "vllm"
+
+    def __init__(self, model_config: ModelConfig, devices: Optional[str] = None):
+        super().__init__(model_config, devices)
+        self.engine = None
+
+    async def start(self) -> None:
+        # 延迟导入：未安装 vLLM 时其他后端仍可使用
+        from vllm import AsyncLLMEngine
+        from vllm.engine.arg_utils import AsyncEngineArgs
+
+        engine_args = AsyncEngineArgs(**self._engine_kwargs())
+
+        # 创建引擎会阻塞（加载权重），放到线程中执行，多个模型可以并行加载。
+        # 线程无法中断：加载被取消（如启动超时）时线程仍会把引擎创建完，
+        # 结果随后被丢弃，引擎对象回收时 vLLM 释放显存
+        self.engine = await asyncio.to_thread(self._create_engine, AsyncLLMEngine, engine_args)
+
+    def _engine_kwargs(self) -> Dict[str, Any]:
+        """AsyncEngineArgs 的参数"""
+        model_config = self.model_config
+        kwargs: Dict[str, Any] = {
+            "model": model_config.path,
+            "tensor_parallel_size": model_config.tensor_parallel_size,
+            "dtype": model_config.dtype,
+            "max_model_len": model_config.max_model_len,
+            "gpu_memory_utilization": model_config.gpu_memory_utilization,
+            "trust_remote_code": model_config.trust_remote_code,
+            "enable_prefix_caching": model_config.enable_prefix_caching,
+            "disable_log_stats": False,
+        }
+        return kwargs
+
+    def _engine_env(self) -> Dict[str, str]:
+        """创建固定 GPU 的副本时临时设置的环境变量"""
+        return {
+            "CUDA_VISIBLE_DEVICES": self.devices,
+            # 本进程初始化过 CUDA 后修改 CUDA_VISIBLE_DEVICES 不再生效，模型（包括 TP=1 时）
+            # 必须在新进程中执行：vLLM V1 的 EngineCore 在单独的进程中运行（这里强制开启），
+            # spawn 启动的进程不继承本进程的 CUDA 状态，只按环境变量选择 GPU
+            "VLLM_ENABLE_V1_MULTIPROCESSING": "1",
+            "VLLM_WORKER_MULTIPROC_METHOD": "spawn",
+        }
+
+    def _create_engine(self, engine_cls: Any, engine_args: Any) -> Any:
+        if self.devices is None:
+            # 同样要等固定 GPU 的副本恢复环境变量，否则会继承它临时设置的 GPU
+            with _devices_lock.shared():
+                return engine_cls.from_engine_args(engine_args)
+
+        # 引擎的 worker 进程在创建时继承环境变量，临时设置即可把副本固定到指定 GPU
+        with _devices_lock.exclusive():
+            overrides = self._engine_env()
+            previous = {name: os.environ.get(name) for name in overrides}
+            os.environ.update(overrides)
+            try:
+                return engine_cls.from_engine_args(engine_args)
+            finally:
+                for name, value in previous.items():
+                    if value is None:
+                        os.environ.pop(name, None)
+                    else:
+                        os.environ[name] = value
+
+    async def generate(
+        self,
+        prompt: str,
+        sampling: SamplingConfig,
+        request_id: str,
+        prompt_token_ids: Optional[List[int]] = None
+    ) -> AsyncIterator[EngineOutput]:
+        from vllm import SamplingParams
+
+        sampling_params = SamplingParams(
+            temperature=sampling.temperature,
+            top_p=sampling.top_p,
+            max_tokens=sampling.max_tokens,
+            stop=sampling.stop,
+            seed=sampling.seed
+        )
+
+        # 已分词的 prompt 直接以 token ids 提交，跳过引擎内的分词
+        inputs = prompt if prompt_token_ids is None else {"prompt_token_ids": prompt_token_ids}
+
+        # 每步只追加新生成的 token，prompt 的 token ids 只转换一次
+        # （每步复制完整的累计列表，长输出的开销随长度平方增长）
+        token_ids: List[int] = []
+        prompt_ids = prompt_token_ids
+        async for output in self.engine.generate(inputs, sampling_params, request_id):
+            if not output.outputs:
+                continue
+
+            completion = output.outputs[0]
+            if prompt_ids is None:
+                prompt_ids = list(output.prompt_token_ids or [])
+            token_ids.extend(completion.token_ids[len(token_ids):])
+            yield EngineOutput(
+                text=completion.text,
+                token_ids=token_ids,
+                prompt_token_ids=prompt_ids,
+                finish_reason=completion.finish_reason,
+                finished=output.finished
+            )
+
+    async def get_tokenizer(self) -> Any:
+        return await self.engine.get_tokenizer()
+
+    async def abort(self, request_id: str) -> None:
+        if self.engine is not None:
+            await self.engine.abort(request_id)
+
+    async def shutdown(self) -> None:
+        # vLLM 会在引擎对象被回收时清理资源
+        self.engine = None
@@ -0,0 +1,118 @@
+"""
+动态微批处理
+
+逐条到达的请求先排队，凑满 max_batch_size 条或首条等待超过 max_wait 秒后合并为一批，
+在专用线程上执行一次前向计算。执行期间到达的请求进入下一批。
+"""
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+
+class MicroBatcher:
+    """把单条输入合并成批量调用"""
+
+    def __init__(
+        self,
+        fn: Callable[[List[Any]], List[Any]],
+        max_batch_size: int = 64,
+        max_wait: float = 0.005,
+        name: str = "batcher",
+        batch_size_histogram: Any = None,
+        queue_wait_histogram: Any = None
+    ):
+        """
+        Args:
+            fn: 同步的批量函数，输入与输出一一对应（在专用线程上执行）
+            batch_size_histogram / queue_wait_histogram: 可选的 Prometheus 直方图
+        """
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batch_size_histogram = batch_size_histogram
+        self.queue_wait_histogram = queue_wait_histogram
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self._pending: Deque[Tuple[Any, asyncio.Future, float]] = deque()
+        self._changed = asyncio.Event()
+        self._worker: Optional[asyncio.Task] = None
+        self.stats: Dict[str, int] = {"batches": 0, "items": 0, "max_batch": 0}
+
+    async def submit(self, items: List[Any]) -> List[Any]:
+        """提交一组输入，返回对应的输出（可能被拆到多个批次中）"""
+        loop = asyncio.get_running_loop()
+        now = time.monotonic()
+        futures = [loop.create_future() for _ in items]
+        self._pending.extend(
+            (item, future, now) for item, future in zip(items, futures)
+        )
+        self._changed.set()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+        try:
+            return list(await asyncio.gather(*futures))
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while self._pending:
+            # 等待凑满一批，或首条输入等待到 max_wait
+            deadline = self._pending[0][2] + self.max_wait
+            while len(self._pending) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._changed.clear()
+                try:
+                    await asyncio.wait_for(self._changed.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+
+            batch = []
+            while self._pending and len(batch) < self.max_batch_size:
+                item, future, enqueued = self._pending.popleft()
+                if not future.cancelled():
+                    batch.append((item, future, enqueued))
+            if not batch:
+                continue
+
+            started = time.monotonic()
+            self._record(batch, started)
+            try:
+                results = await loop.run_in_executor(
+                    self._executor, self.fn, [item for item, _, _ in batch]
+                )
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future, _), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def _record(self, batch: List[Tuple[Any, asyncio.Future, float]], started: float) -> None:
+        self.stats["batches"] += 1
+        self.stats["items"] += len(batch)
+        self.stats["max_batch"] = max(self.stats["max_batch"], len(batch))
+        if self.batch_size_histogram is not None:
+            self.batch_size_histogram.observe(len(batch))
+        if self.queue_wait_histogram is not None:
+            for _, _, enqueued in batch:
+                self.queue_wait_histogram.observe(started - enqueued)
+
+    async def close(self) -> None:
+        """停止处理并释放线程"""
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+        for _, future, _ in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
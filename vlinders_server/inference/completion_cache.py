@@ -0,0 +1,193 @@
+"""
+确定性请求的补全缓存
+
+L1: 进程内 LRU（按字节数限制大小）
+L2: Redis（多 worker 共享）
+
+条目按模型的缓存代数分组：权重变化时递增 Redis 中的代数，各 worker 查询时
+每隔 COMPLETION_CACHE_EPOCH_TTL 秒重新读取，旧代的条目随之失效
+"""
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from ..cache import cache
+from ..config import config
+from ..utils import logger
+
+
+@dataclass
+class _CacheEntry:
+    """L1 缓存条目"""
+    model: str
+    value: Dict[str, Any]
+    size: int
+    expires_at: float
+
+
+class CompletionCache:
+    """两级精确匹配补全缓存"""
+
+    KEY_PREFIX = "completion"
+
+    def __init__(
+        self,
+        max_bytes: int = 64 * 1024 * 1024,
+        l1_ttl: int = 600,
+        l2_ttl: int = 3600,
+        epoch_ttl: float = 5.0
+    ):
+        self.max_bytes = max_bytes
+        self.l1_ttl = l1_ttl
+        self.l2_ttl = l2_ttl
+        self.epoch_ttl = epoch_ttl
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._bytes = 0
+        # 每个模型的缓存代数，权重变化后递增，旧代的条目自然失效
+        self._epochs: Dict[str, int] = {}
+        # 每个模型上次从 Redis 读取代数的时间
+        self._epoch_checked: Dict[str, float] = {}
+        self.stats: Dict[str, int] = {
+            "l1_hits": 0,
+            "l2_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+        }
+
+    @staticmethod
+    def is_cacheable(temperature: float, seed: Optional[int] = None) -> bool:
+        """只有确定性请求（temperature=0 或指定 seed）可以缓存"""
+        return temperature == 0 or seed is not None
+
+    def make_key(
+        self,
+        model: str,
+        messages: List[Dict[str, Any]],
+        sampling: Dict[str, Any]
+    ) -> str:
+        """根据模型、消息和采样参数计算缓存 key（不含代数，读写时按当前代数区分）"""
+        payload = json.dumps(
+            {"messages": messages, "sampling": sampling},
+            sort_keys=True,
+            ensure_ascii=False,
+            separators=(",", ":")
+        )
+        digest = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+        return f"{self.KEY_PREFIX}:{model}:{digest}"
+
+    async def _versioned(self, model: str, key: str) -> str:
+        """加上模型当前的缓存代数"""
+        return f"{key}:{await self._epoch(model)}"
+
+    async def get(self, model: str, key: str) -> Optional[Dict[str, Any]]:
+        """依次查询 L1 和 L2"""
+        key = await self._versioned(model, key)
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry.expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.stats["l1_hits"] += 1
+                return entry.value
+            self._remove(key)
+
+        if cache.available:
+            raw = await cache.get(key)
+            if raw:
+                try:
+                    value = json.loads(raw)
+                except ValueError:
+                    logger.warning(f"Discarding malformed completion cache entry {key}")
+                else:
+                    self._store_local(model, key, value, len(raw))
+                    self.stats["l2_hits"] += 1
+                    return value
+
+        self.stats["misses"] += 1
+        return None
+
+    async def set(self, model: str, key: str, value: Dict[str, Any]) -> None:
+        """写入 L1 和 L2"""
+        key = await self._versioned(model, key)
+        raw = json.dumps(value, ensure_ascii=False)
+        self._store_local(model, key, value, len(raw))
+        self.stats["stores"] += 1
+
+        if cache.available:
+            await cache.set(key, raw, expire=self.l2_ttl)
+
+    async def sync_epoch(self, model: str) -> None:
+        """从 Redis 读取模型当前的缓存代数，使多个 worker 共享同一命名空间"""
+        await self._epoch(model, refresh=True)
+
+    async def _epoch(self, model: str, refresh: bool = False) -> int:
+        """模型当前的缓存代数（距上次读取超过 epoch_ttl 时从 Redis 重新读取）"""
+        now = time.monotonic()
+        checked = self._epoch_checked.get(model)
+        if cache.available and (refresh or checked is None or now - checked >= self.epoch_ttl):
+            self._epoch_checked[model] = now
+            epoch = await cache.get(self._epoch_key(model))
+            # 代数只增不减：Redis 不可用期间本地递增过的代数不会被旧值覆盖
+            self._epochs[model] = max(self._epochs.get(model, 0), int(epoch or 0))
+        return self._epochs.get(model, 0)
+
+    async def invalidate_model(self, model: str) -> None:
+        """使某个模型的全部缓存失效"""
+        for key in [k for k, e in self._entries.items() if e.model == model]:
+            self._remove(key)
+
+        if cache.available:
+            try:
+                self._epochs[model] = await cache.incr(self._epoch_key(model))
+                return
+            except Exception as e:
+                logger.warning(f"Failed to bump completion cache epoch for {model}: {e}")
+
+        self._epochs[model] = self._epochs.get(model, 0) + 1
+
+    def get_stats(self) -> Dict[str, int]:
+        """缓存统计"""
+        return {
+            **self.stats,
+            "l1_entries": len(self._entries),
+            "l1_bytes": self._bytes,
+        }
+
+    def _epoch_key(self, model: str) -> str:
+        return f"{self.KEY_PREFIX}:epoch:{model}"
+
+    def _store_local(self, model: str, key: str, value: Dict[str, Any], size: int) -> None:
+        if size > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self._remove(key)
+
+        self._entries[key] = _CacheEntry(
+            model=model,
+            value=value,
+            size=size,
+            expires_at=time.monotonic() + self.l1_ttl
+        )
+        self._bytes += size
+
+        while self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.stats["evictions"] += 1
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+
+# 全局补全缓存实例
+completion_cache = CompletionCache(
+    max_bytes=config.server.completion_cache_max_bytes,
+    l1_ttl=config.server.completion_cache_l1_ttl,
+    l2_ttl=config.server.completion_cache_l2_ttl,
+    epoch_ttl=config.server.completion_cache_epoch_ttl
+)
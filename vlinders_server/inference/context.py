@@ -0,0 +1,245 @@
+"""
+上下文窗口预算
+
+请求超出 max_model_len 时，在渲染 prompt 之前按 Spec（04-Agent编排系统）的 token
+预算分配裁剪消息，而不是让引擎在预填充前报错：
+- 生成预留 48%: max_tokens 超出时先压缩到此预留
+- 工具输出 20%: 从最新的工具输出开始分配，超出部分截断（保留首尾）
+- 系统 prompt 2%: 仅当挤占了对话历史的 30% 时才截断
+- 对话历史 30%: 与其他部分未用完的预算一起，从最早的轮次开始丢弃
+
+各部分的比例是保底值，未用完的预算留给对话历史。每条消息的 token 数按内容哈希缓存，
+多轮对话每一轮只需对新消息分词。
+"""
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+
+# chat template 为每条消息增加的 token（角色标记、分隔符）的估计值
+MESSAGE_OVERHEAD_TOKENS = 8
+# 截断后工具输出至少保留的 token 数
+MIN_TOOL_TOKENS = 64
+
+TRUNCATED_MARKER = "\n[... {count} tokens truncated ...]\n"
+OMITTED_MARKER = "[{count} earlier messages omitted to fit the context window]"
+
+
+@dataclass
+class ContextBudget:
+    """上下文窗口各部分的比例"""
+    system: float = 0.02
+    history: float = 0.30
+    tools: float = 0.20
+    output: float = 0.48
+
+
+@dataclass
+class FittedContext:
+    """裁剪后的消息"""
+    messages: List[Dict[str, str]]
+    max_tokens: int
+    # 估算的 prompt token 数
+    prompt_tokens: int
+    dropped_messages: int = 0
+    truncated_messages: int = 0
+
+
+@dataclass
+class ContextWindow:
+    """单个模型的上下文窗口（非线程安全，须在该模型的分词线程上使用）"""
+
+    max_model_len: int
+    tokenizer: Any = None
+    budget: ContextBudget = field(default_factory=ContextBudget)
+    cache_size: int = 8192
+
+    def __post_init__(self):
+        self._counts: "OrderedDict[bytes, int]" = OrderedDict()
+        self.stats: Dict[str, int] = {
+            "requests": 0,
+            "trimmed": 0,
+            "dropped_messages": 0,
+            "truncated_messages": 0,
+            "clamped_max_tokens": 0,
+            "count_cache_hits": 0,
+            "count_cache_misses": 0,
+        }
+
+    def count(self, message: Dict[str, str]) -> int:
+        """单条消息的 token 数（含模板开销估计）"""
+        digest = hashlib.blake2b(
+            f"{message['role']}\0{message['content']}".encode("utf-8"), digest_size=16
+        ).digest()
+
+        tokens = self._counts.get(digest)
+        if tokens is not None:
+            self._counts.move_to_end(digest)
+            self.stats["count_cache_hits"] += 1
+            return tokens
+
+        self.stats["count_cache_misses"] += 1
+        tokens = self._count_text(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+        self._counts[digest] = tokens
+        if len(self._counts) > self.cache_size:
+            self._counts.popitem(last=False)
+        return tokens
+
+    def fit(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int,
+        slack: int = 0
+    ) -> FittedContext:
+        """
+        使 prompt + max_tokens 不超过 max_model_len
+
+        Args:
+            slack: 额外预留的 token 数（用于修正模板开销的估计误差）
+        """
+        self.stats["requests"] += 1
+        window = self.max_model_len - slack
+        counts = [self.count(message) for message in messages]
+        if sum(counts) + max_tokens <= window:
+            return FittedContext(list(messages), max_tokens, sum(counts))
+
+        self.stats["trimmed"] += 1
+        messages = list(messages)
+        truncated = set()
+        reserve = min(max_tokens, int(window * self.budget.output))
+        limit = window - reserve
+
+        # 1. 工具输出: 越新的越优先保留
+        tool_budget = int(window * self.budget.tools)
+        for i in reversed(range(len(messages))):
+            if messages[i]["role"] != "tool":
+                continue
+            if counts[i] > tool_budget:
+                self._truncate(messages, counts, i, max(tool_budget, MIN_TOOL_TOKENS))
+                truncated.add(i)
+            tool_budget = max(tool_budget - counts[i], 0)
+
+        # 2. 系统 prompt: 不挤占对话历史的保底预算
+        system = [i for i, message in enumerate(messages) if message["role"] == "system"]
+        if sum(counts) > limit and system:
+            tools = sum(c for c, m in zip(counts, messages) if m["role"] == "tool")
+            allowance = max(
+                int(window * self.budget.system),
+                limit - int(window * self.budget.history) - tools
+            )
+            excess = sum(counts[i] for i in system) - allowance
+            if excess > 0:
+                largest = max(system, key=lambda i: counts[i])
+                self._truncate(messages, counts, largest, max(counts[largest] - excess, 1))
+                truncated.add(largest)
+
+        # 3. 对话历史: 从最早的轮次开始丢弃，保留最后一条消息（本轮输入）
+        dropped = 0
+        if sum(counts) > limit:
+            keep = [True] * len(messages)
+            total = sum(counts)
+            candidates = [
+                i for i in range(len(messages) - 1) if messages[i]["role"] != "system"
+            ]
+            for position, i in enumerate(candidates):
+                if total <= limit:
+                    # 保留的历史从 user 消息开始，避免严格交替的模板报错
+                    rest = candidates[position:] + [len(messages) - 1]
+                    if messages[i]["role"] == "user" or not any(
+                        messages[j]["role"] == "user" for j in rest
+                    ):
+                        break
+                keep[i] = False
+                total -= counts[i]
+                dropped += 1
+
+            messages = [m for i, m in enumerate(messages) if keep[i]]
+            counts = [c for i, c in enumerate(counts) if keep[i]]
+            truncated = {
+                sum(keep[:i]) for i in truncated if keep[i]
+            }
+
+            if dropped:
+                self._mark_omitted(messages, counts, dropped)
+
+        # 4. 仍然超出（单条消息过长）: 截断最长的消息
+        for _ in range(8):
+            excess = sum(counts) - limit
+            if excess <= 0:
+                break
+            largest = max(range(len(messages)), key=lambda i: counts[i])
+            if not self._truncate(messages, counts, largest, max(counts[largest] - excess, 1)):
+                break
+            truncated.add(largest)
+
+        prompt_tokens = sum(counts)
+        fitted_max_tokens = max(min(max_tokens, window - prompt_tokens), 1)
+        if fitted_max_tokens < max_tokens:
+            self.stats["clamped_max_tokens"] += 1
+        self.stats["dropped_messages"] += dropped
+        self.stats["truncated_messages"] += len(truncated)
+
+        return FittedContext(
+            messages=messages,
+            max_tokens=fitted_max_tokens,
+            prompt_tokens=prompt_tokens,
+            dropped_messages=dropped,
+            truncated_messages=len(truncated)
+        )
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "max_model_len": self.max_model_len,
+            "cached_counts": len(self._counts),
+        }
+
+    def _count_text(self, text: str) -> int:
+        if self.tokenizer is None:
+            # 没有 tokenizer 时按约 4 字符 / token 估算
+            return len(text) // 4
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+    def _truncate(
+        self,
+        messages: List[Dict[str, str]],
+        counts: List[int],
+        index: int,
+        target: int
+    ) -> bool:
+        """把消息截断到约 target 个 token（保留开头 2/3 与结尾 1/3），返回是否有变化"""
+        message = messages[index]
+        content = message["content"]
+        tokens = counts[index] - MESSAGE_OVERHEAD_TOKENS
+        if tokens <= 0 or not content or target >= counts[index]:
+            return False
+
+        marker = TRUNCATED_MARKER.format(count=max(tokens - target, 1))
+        keep_tokens = max(target - MESSAGE_OVERHEAD_TOKENS - self._count_text(marker), 0)
+        keep_chars = min(len(content) * keep_tokens // tokens, len(content) - 1)
+        head = keep_chars * 2 // 3
+        tail = keep_chars - head
+        new_content = content[:head] + marker + (content[-tail:] if tail else "")
+        if len(new_content) >= len(content):
+            new_content = content[:keep_chars]
+
+        messages[index] = {**message, "content": new_content}
+        counts[index] = self.count(messages[index])
+        return True
+
+    def _mark_omitted(
+        self,
+        messages: List[Dict[str, str]],
+        counts: List[int],
+        dropped: int
+    ) -> None:
+        """标记被丢弃的轮次：附加到系统 prompt，没有系统 prompt 时放在首条消息开头"""
+        marker = OMITTED_MARKER.format(count=dropped)
+        first = messages[0]
+        if first["role"] == "system":
+            content = f"{first['content']}\n\n{marker}"
+        else:
+            content = f"{marker}\n\n{first['content']}"
+        messages[0] = {**first, "content": content}
+        counts[0] = self.count(messages[0])
+
@@ -0,0 +1,231 @@
+"""
+嵌入服务
+
+单个嵌入模型，权重只加载一次；请求经微批处理合并后每批执行一次前向计算。
+后端:
+- sentence_transformers: SentenceTransformer 模型（默认 CPU）
+- hash: 特征哈希，无需权重，用于测试和压测
+"""
+import asyncio
+import re
+import zlib
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from ..config import EmbeddingConfig
+from ..metrics import EMBEDDING_BATCH_SIZE, EMBEDDING_QUEUE_WAIT, histogram_snapshot
+from ..utils import logger
+from .batching import MicroBatcher
+
+
+class EmbeddingBackend(ABC):
+    """嵌入模型后端（方法均在批处理线程上同步调用）"""
+
+    name: str = "base"
+
+    def __init__(self, embedding_config: EmbeddingConfig):
+        self.embedding_config = embedding_config
+        self.dimension = embedding_config.dimension
+
+    @abstractmethod
+    def load(self) -> None:
+        """加载权重"""
+
+    @abstractmethod
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """一次前向计算，返回 (len(texts), dimension) 的归一化向量"""
+
+    def count_tokens(self, texts: List[str]) -> List[int]:
+        """每条输入的 token 数，默认按约 4 字符 / token 估算"""
+        return [max(len(text) // 4, 1) for text in texts]
+
+
+class HashEmbeddingBackend(EmbeddingBackend):
+    """把单词哈希到固定维度的带符号计数向量"""
+
+    name = "hash"
+
+    _WORD = re.compile(r"\w+")
+
+    def load(self) -> None:
+        pass
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in self._WORD.findall(text.lower()):
+                digest = zlib.crc32(word.encode("utf-8"))
+                vectors[row, digest % self.dimension] += 1.0 if digest & 0x80000000 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def count_tokens(self, texts: List[str]) -> List[int]:
+        return [len(self._WORD.findall(text)) for text in texts]
+
+
+class SentenceTransformerBackend(EmbeddingBackend):
+    """sentence-transformers 模型"""
+
+    name = "sentence_transformers"
+
+    def __init__(self, embedding_config: EmbeddingConfig):
+        super().__init__(embedding_config)
+        self.model = None
+
+    def load(self) -> None:
+        # 延迟导入：只有使用该后端时才需要安装 sentence-transformers
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(
+            self.embedding_config.path,
+            device=self.embedding_config.device
+        )
+        self.dimension = self.model.get_sentence_embedding_dimension()
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        return self.model.encode(
+            texts,
+            batch_size=len(texts),
+            convert_to_numpy=True,
+            normalize_embeddings=True
+        )
+
+    def count_tokens(self, texts: List[str]) -> List[int]:
+        return [len(ids) for ids in self.model.tokenizer(texts)["input_ids"]]
+
+
+EMBEDDING_BACKENDS = {
+    HashEmbeddingBackend.name: HashEmbeddingBackend,
+    SentenceTransformerBackend.name: SentenceTransformerBackend,
+}
+
+
+@dataclass
+class EmbeddingResult:
+    """嵌入结果"""
+    embeddings: List[List[float]]
+    prompt_tokens: int
+
+
+class EmbeddingService:
+    """嵌入服务"""
+
+    def __init__(self):
+        self.embedding_config: Optional[EmbeddingConfig] = None
+        self.backend: Optional[EmbeddingBackend] = None
+        self.batcher: Optional[MicroBatcher] = None
+        self.load_error: Optional[str] = None
+        self._loading: Optional[asyncio.Task] = None
+
+    @property
+    def model_name(self) -> Optional[str]:
+        return self.embedding_config.name if self.embedding_config else None
+
+    @property
+    def enabled(self) -> bool:
+        return self.embedding_config is not None
+
+    def start_loading(self, embedding_config: EmbeddingConfig) -> asyncio.Task:
+        """在后台加载模型（只加载一次）"""
+        if self._loading is None:
+            self.embedding_config = embedding_config
+            self._loading = asyncio.create_task(self._load(embedding_config))
+        return self._loading
+
+    async def _load(self, embedding_config: EmbeddingConfig) -> None:
+        backend_cls = EMBEDDING_BACKENDS.get(embedding_config.backend)
+        if backend_cls is None:
+            self.load_error = f"Unknown embedding backend '{embedding_config.backend}'"
+            logger.error(self.load_error)
+            raise ValueError(self.load_error)
+
+        logger.info(
+            f"Loading embedding model {embedding_config.name} from {embedding_config.path} "
+            f"(backend={embedding_config.backend}, device={embedding_config.device})"
+        )
+        backend = backend_cls(embedding_config)
+        try:
+            await asyncio.to_thread(backend.load)
+        except Exception as e:
+            self.load_error = str(e)
+            logger.error(f"Failed to load embedding model {embedding_config.name}: {e}")
+            raise
+
+        self.backend = backend
+        self.batcher = MicroBatcher(
+            self._forward,
+            max_batch_size=embedding_config.max_batch_size,
+            max_wait=embedding_config.max_wait_ms / 1000,
+            name=f"embedding-{embedding_config.name}",
+            batch_size_histogram=EMBEDDING_BATCH_SIZE.labels(model=embedding_config.name),
+            queue_wait_histogram=EMBEDDING_QUEUE_WAIT.labels(model=embedding_config.name)
+        )
+        logger.info(
+            f"✅ Embedding model {embedding_config.name} loaded (dimension={backend.dimension})"
+        )
+
+    def _forward(self, texts: List[str]) -> List[Tuple[List[float], int]]:
+        """一批输入的向量和 token 数（在批处理线程上执行）"""
+        vectors = self.backend.embed(texts)
+        return list(zip(np.asarray(vectors).tolist(), self.backend.count_tokens(texts)))
+
+    async def embed(self, texts: List[str]) -> EmbeddingResult:
+        """
+        计算嵌入
+
+        Raises:
+            RuntimeError: 未启用嵌入模型或模型加载失败
+        """
+        if self._loading is None:
+            raise RuntimeError("Embedding model not configured")
+        try:
+            await asyncio.shield(self._loading)
+        except Exception:
+            # 错误已记录在 load_error
+            pass
+        if self.batcher is None:
+            raise RuntimeError(f"Embedding model failed to load: {self.load_error}")
+
+        results = await self.batcher.submit(texts)
+        return EmbeddingResult(
+            embeddings=[vector for vector, _ in results],
+            prompt_tokens=sum(tokens for _, tokens in results)
+        )
+
+    async def shutdown(self) -> None:
+        """停止批处理并释放模型"""
+        if self._loading is not None and not self._loading.done():
+            self._loading.cancel()
+            await asyncio.gather(self._loading, return_exceptions=True)
+        if self.batcher is not None:
+            await self.batcher.close()
+        self.backend = None
+        self.batcher = None
+        self._loading = None
+        self.load_error = None
+        self.embedding_config = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        if not self.enabled:
+            return {"enabled": False}
+
+        name = self.embedding_config.name
+        return {
+            "enabled": True,
+            "model": name,
+            "status": (
+                "loaded" if self.batcher is not None
+                else "failed" if self.load_error else "loading"
+            ),
+            "dimension": self.backend.dimension if self.backend else None,
+            "batches": dict(self.batcher.stats) if self.batcher else {},
+            "batch_size": histogram_snapshot(EMBEDDING_BATCH_SIZE, model=name),
+            "queue_wait_seconds": histogram_snapshot(EMBEDDING_QUEUE_WAIT, model=name),
+        }
+
+
+# 全局嵌入服务实例
+embedding_service = EmbeddingService()
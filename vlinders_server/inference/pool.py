@@ -0,0 +1,157 @@
+"""
+模型副本池
+
+同一模型可以在多组 GPU 上各运行一个引擎副本。请求按 ModelConfig.routing 分发:
+- least_loaded: 在途 token 最少的副本
+- prefix_affinity: 相同 prompt 前缀优先落在同一副本（过载时退回 least_loaded）
+"""
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
+
+from ..config import ModelConfig
+from .backends import EngineBackend, create_backend
+from .routing import PrefixAffinityRouter
+
+
+class EngineReplica:
+    """单个引擎副本及其负载"""
+
+    def __init__(self, index: int, backend: EngineBackend, devices: Optional[str] = None):
+        self.index = index
+        self.backend = backend
+        self.devices = devices
+        self.in_flight_requests = 0
+        self.in_flight_tokens = 0
+        self.total_requests = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "index": self.index,
+            "devices": self.devices,
+            "in_flight_requests": self.in_flight_requests,
+            "in_flight_tokens": self.in_flight_tokens,
+            "total_requests": self.total_requests,
+        }
+
+
+def assign_devices(model_config: ModelConfig) -> List[Optional[str]]:
+    """
+    为每个副本分配 GPU
+
+    显式配置 devices 时逐项对应副本；否则多副本按 tensor_parallel_size 依次分组
+    （副本 i 使用 GPU i*TP ... (i+1)*TP-1），单副本沿用进程的 CUDA_VISIBLE_DEVICES。
+    """
+    if model_config.devices is not None:
+        if len(model_config.devices) != model_config.replicas:
+            raise ValueError(
+                f"Model {model_config.name}: {len(model_config.devices)} device groups "
+                f"configured for {model_config.replicas} replicas"
+            )
+        return list(model_config.devices)
+
+    if model_config.replicas == 1:
+        return [None]
+
+    tp = model_config.tensor_parallel_size
+    return [
+        ",".join(str(gpu) for gpu in range(i * tp, (i + 1) * tp))
+        for i in range(model_config.replicas)
+    ]
+
+
+class EnginePool:
+    """一个模型的全部引擎副本"""
+
+    def __init__(
+        self,
+        model_name: str,
+        replicas: List[EngineReplica],
+        router: Optional[PrefixAffinityRouter] = None
+    ):
+        self.model_name = model_name
+        self.replicas = replicas
+        self.router = router
+
+    @classmethod
+    async def start(cls, model_config: ModelConfig) -> "EnginePool":
+        """按配置创建并启动全部副本"""
+        replicas = []
+        try:
+            for index, devices in enumerate(assign_devices(model_config)):
+                backend = create_backend(model_config, devices=devices)
+                await backend.start()
+                replicas.append(EngineReplica(index, backend, devices))
+        except BaseException:
+            for replica in replicas:
+                await replica.backend.shutdown()
+            raise
+
+        router = None
+        if model_config.routing == "prefix_affinity":
+            router = PrefixAffinityRouter(
+                len(replicas),
+                block_tokens=model_config.prefix_block_tokens,
+                load_factor=model_config.routing_load_factor
+            )
+
+        return cls(model_config.name, replicas, router)
+
+    async def shutdown(self) -> None:
+        """关闭全部副本"""
+        for replica in self.replicas:
+            await replica.backend.shutdown()
+
+    async def get_tokenizer(self) -> Any:
+        """所有副本加载的是同一模型，使用第一个副本的 tokenizer"""
+        return await self.replicas[0].backend.get_tokenizer()
+
+    def select(
+        self,
+        cost_tokens: int = 0,
+        prompt: str = "",
+        prompt_token_ids: Optional[Sequence[int]] = None
+    ) -> EngineReplica:
+        """选择副本：有前缀路由时按前缀亲和，否则取在途 token 最少的副本"""
+        if self.router is None or len(self.replicas) == 1:
+            return min(self.replicas, key=lambda r: (r.in_flight_tokens, r.in_flight_requests))
+
+        key = self.router.prefix_key(prompt, prompt_token_ids)
+        index = self.router.choose(
+            key,
+            [replica.in_flight_tokens for replica in self.replicas],
+            cost_tokens
+        )
+        self.router.record(index, key)
+        return self.replicas[index]
+
+    @asynccontextmanager
+    async def lease(
+        self,
+        cost_tokens: int,
+        prompt: str = "",
+        prompt_token_ids: Optional[Sequence[int]] = None
+    ) -> AsyncIterator[EngineReplica]:
+        """
+        为一个请求选择副本并在请求期间计入其负载
+
+        Args:
+            cost_tokens: 请求预计占用的 token 数（prompt + max_tokens）
+            prompt / prompt_token_ids: 用于前缀亲和路由
+        """
+        replica = self.select(cost_tokens, prompt, prompt_token_ids)
+        replica.in_flight_requests += 1
+        replica.in_flight_tokens += cost_tokens
+        replica.total_requests += 1
+        try:
+            yield replica
+        finally:
+            replica.in_flight_requests -= 1
+            replica.in_flight_tokens -= cost_tokens
+
+    def get_stats(self) -> List[Dict[str, Any]]:
+        """每个副本的负载（以及前缀路由的命中率估计）"""
+        stats = [replica.get_stats() for replica in self.replicas]
+        if self.router is not None:
+            for replica_stats in stats:
+                replica_stats["routing"] = self.router.get_stats(replica_stats["index"])
+        return stats
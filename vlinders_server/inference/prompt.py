@@ -0,0 +1,148 @@
+"""
+Prompt 渲染
+
+按模型 tokenizer 的 chat template 渲染消息，并缓存已渲染、已分词的前缀
+（system prompt、之前的对话轮次）。多轮对话每一轮只需对新增消息分词，
+且相同的历史总是得到相同的 token 序列，便于命中 vLLM 的 prefix cache。
+"""
+import hashlib
+import json
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+
+@dataclass
+class RenderedPrompt:
+    """渲染后的 prompt"""
+    text: str
+    token_ids: Optional[List[int]] = None
+    # 按上下文窗口调整后的生成长度（未经上下文裁剪时为 None）
+    max_tokens: Optional[int] = None
+    dropped_messages: int = 0
+    truncated_messages: int = 0
+
+    @property
+    def num_tokens(self) -> int:
+        """prompt 的 token 数（未分词时按约 4 字符 / token 估算）"""
+        return len(self.token_ids) if self.token_ids is not None else len(self.text) // 4
+
+
+def legacy_template(messages: List[Dict[str, str]], add_generation_prompt: bool = True) -> str:
+    """没有 chat template 时使用的简单格式: `role: content` 逐行拼接"""
+    text = "\n".join(f"{msg['role']}: {msg['content']}" for msg in messages)
+    if add_generation_prompt:
+        text += "\nassistant:"
+    return text
+
+
+class PromptRenderer:
+    """单个模型的 prompt 渲染器"""
+
+    def __init__(self, tokenizer: Any = None, max_prefixes: int = 1024):
+        self.tokenizer = tokenizer
+        self.max_prefixes = max_prefixes
+        # 消息前缀哈希 -> (渲染文本, token ids)
+        self._prefixes: "OrderedDict[str, tuple[str, List[int]]]" = OrderedDict()
+        self.stats: Dict[str, int] = {
+            "renders": 0,
+            "prefix_hits": 0,
+            "prefix_misses": 0,
+            "tokens_encoded": 0,
+            "tokens_reused": 0,
+        }
+
+    @property
+    def uses_chat_template(self) -> bool:
+        return getattr(self.tokenizer, "chat_template", None) is not None
+
+    def render_text(
+        self,
+        messages: List[Dict[str, str]],
+        add_generation_prompt: bool = True
+    ) -> str:
+        """只渲染文本，不分词"""
+        if not self.uses_chat_template:
+            return legacy_template(messages, add_generation_prompt)
+        return self.tokenizer.apply_chat_template(
+            messages,
+            tokenize=False,
+            add_generation_prompt=add_generation_prompt
+        )
+
+    def render(self, messages: List[Dict[str, str]]) -> RenderedPrompt:
+        """渲染消息并返回 token ids（复用缓存的前缀）"""
+        self.stats["renders"] += 1
+        text = self.render_text(messages)
+
+        if self.tokenizer is None:
+            return RenderedPrompt(text=text)
+
+        hashes = self._prefix_hashes(messages)
+        if not hashes:
+            return RenderedPrompt(text=text, token_ids=self._encode(text))
+
+        # system prompt 单独缓存，使共享同一 system prompt 的会话得到相同的前缀 token
+        is_system = messages[0]["role"] == "system"
+        if len(messages) > 1 and is_system and hashes[0] not in self._prefixes:
+            system_text = self.render_text(messages[:1], add_generation_prompt=False)
+            if text.startswith(system_text):
+                self._remember(hashes[0], system_text, self._encode(system_text))
+
+        # 从最长的历史前缀开始查找缓存
+        prefix_text, prefix_ids = "", []
+        for digest in reversed(hashes[:-1]):
+            cached = self._prefixes.get(digest)
+            if cached is not None and text.startswith(cached[0]):
+                self._prefixes.move_to_end(digest)
+                prefix_text, prefix_ids = cached
+                self.stats["prefix_hits"] += 1
+                self.stats["tokens_reused"] += len(prefix_ids)
+                break
+        else:
+            self.stats["prefix_misses"] += 1
+
+        # 本轮完整对话（不含生成提示）作为下一轮的前缀
+        history_text = self.render_text(messages, add_generation_prompt=False)
+        if history_text.startswith(prefix_text) and text.startswith(history_text):
+            history_ids = prefix_ids + self._encode(history_text[len(prefix_text):])
+            self._remember(hashes[-1], history_text, history_ids)
+            token_ids = history_ids + self._encode(text[len(history_text):])
+        else:
+            token_ids = prefix_ids + self._encode(text[len(prefix_text):])
+
+        return RenderedPrompt(text=text, token_ids=token_ids)
+
+    def clear(self) -> None:
+        """清空前缀缓存"""
+        self._prefixes.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "chat_template": self.uses_chat_template,
+            "cached_prefixes": len(self._prefixes),
+        }
+
+    def _encode(self, text: str) -> List[int]:
+        if not text:
+            return []
+        token_ids = list(self.tokenizer.encode(text, add_special_tokens=False))
+        self.stats["tokens_encoded"] += len(token_ids)
+        return token_ids
+
+    def _remember(self, digest: str, text: str, token_ids: List[int]) -> None:
+        self._prefixes[digest] = (text, token_ids)
+        self._prefixes.move_to_end(digest)
+        while len(self._prefixes) > self.max_prefixes:
+            self._prefixes.popitem(last=False)
+
+    @staticmethod
+    def _prefix_hashes(messages: List[Dict[str, str]]) -> List[str]:
+        """messages[:1], messages[:2], ... 的累积哈希"""
+        hasher = hashlib.blake2b(digest_size=16)
+        hashes = []
+        for msg in messages:
+            hasher.update(json.dumps([msg["role"], msg["content"]], ensure_ascii=False).encode())
+            hashes.append(hasher.copy().hexdigest())
+        return hashes
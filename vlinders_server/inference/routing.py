@@ -0,0 +1,109 @@
+"""
+前缀亲和路由
+
+共享同一长前缀（system prompt、对话历史）的请求只有落在同一副本上才能命中
+该副本的 prefix cache。按 prompt 开头一段 token 的哈希在一致性哈希环上选择副本，
+并限制单个副本的负载（consistent hashing with bounded loads）：目标副本的在途
+token 超过平均值的 load_factor 倍时沿环顺延，全部过载时退回最低负载副本。
+"""
+import bisect
+import hashlib
+import math
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence
+
+
+class PrefixAffinityRouter:
+    """基于一致性哈希（有界负载）的副本选择"""
+
+    def __init__(
+        self,
+        replica_count: int,
+        block_tokens: int = 256,
+        load_factor: float = 1.25,
+        virtual_nodes: int = 64,
+        memory_size: int = 4096
+    ):
+        self.replica_count = replica_count
+        self.block_tokens = block_tokens
+        self.load_factor = load_factor
+        self.memory_size = memory_size
+
+        ring = sorted(
+            (self._hash(f"replica-{index}-{vnode}".encode()), index)
+            for index in range(replica_count)
+            for vnode in range(virtual_nodes)
+        )
+        self._ring_hashes = [h for h, _ in ring]
+        self._ring_replicas = [index for _, index in ring]
+
+        # 每个副本最近接收过的前缀，用于估算 prefix cache 命中率
+        self._seen: List["OrderedDict[int, None]"] = [OrderedDict() for _ in range(replica_count)]
+        self.stats: List[Dict[str, int]] = [
+            {"lookups": 0, "hits": 0, "affinity": 0, "fallback": 0}
+            for _ in range(replica_count)
+        ]
+
+    def prefix_key(self, prompt: str, prompt_token_ids: Optional[Sequence[int]]) -> int:
+        """prompt 开头一段（block_tokens 个 token）的哈希"""
+        if prompt_token_ids is not None:
+            block = ",".join(map(str, prompt_token_ids[:self.block_tokens])).encode()
+        else:
+            # 没有 token ids 时按约 4 字符 / token 截取文本
+            block = prompt[:self.block_tokens * 4].encode("utf-8")
+        return self._hash(block)
+
+    def choose(self, key: int, loads: Sequence[int], cost: int) -> int:
+        """
+        选择副本
+
+        Args:
+            key: 前缀哈希
+            loads: 各副本当前的在途 token 数
+            cost: 本请求的 token 数
+        """
+        capacity = math.ceil(self.load_factor * (sum(loads) + cost) / self.replica_count)
+
+        start = bisect.bisect(self._ring_hashes, key) % len(self._ring_hashes)
+        tried = set()
+        for offset in range(len(self._ring_hashes)):
+            index = self._ring_replicas[(start + offset) % len(self._ring_hashes)]
+            if index in tried:
+                continue
+            if loads[index] + cost <= capacity:
+                self.stats[index]["affinity"] += 1
+                return index
+            tried.add(index)
+            if len(tried) == self.replica_count:
+                break
+
+        index = min(range(self.replica_count), key=lambda i: loads[i])
+        self.stats[index]["fallback"] += 1
+        return index
+
+    def record(self, index: int, key: int) -> bool:
+        """记录副本收到的前缀，返回该副本近期是否见过（即可能命中 prefix cache）"""
+        seen = self._seen[index]
+        hit = key in seen
+        if hit:
+            seen.move_to_end(key)
+        else:
+            seen[key] = None
+            if len(seen) > self.memory_size:
+                seen.popitem(last=False)
+
+        self.stats[index]["lookups"] += 1
+        self.stats[index]["hits"] += int(hit)
+        return hit
+
+    def get_stats(self, index: int) -> Dict[str, Any]:
+        stats = self.stats[index]
+        lookups = stats["lookups"]
+        return {
+            **stats,
+            "prefix_hit_rate": round(stats["hits"] / lookups, 4) if lookups else 0.0,
+        }
+
+    @staticmethod
+    def _hash(data: bytes) -> int:
+        return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big")
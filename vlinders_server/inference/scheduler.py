@@ -0,0 +1,232 @@
+"""
+按模型的请求调度器
+
+在请求进入引擎之前做准入控制：
+- 每个模型限制并发数
+- 有界的等待队列，支持排队超时
+- 优先级（high / normal / low），队列满时优先淘汰低优先级请求
+- 无法排队时立即拒绝，由 API 层返回 503 + Retry-After
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+
+PRIORITY_CLASSES: Dict[str, int] = {
+    "high": 0,
+    "normal": 1,
+    "low": 2,
+}
+
+
+class SchedulerOverloaded(Exception):
+    """请求无法被调度（队列已满或排队超时）"""
+
+    def __init__(self, model: str, reason: str, retry_after: float):
+        super().__init__(f"Model {model} overloaded: {reason}")
+        self.model = model
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+@dataclass(order=True)
+class _Waiter:
+    """排队中的请求"""
+    priority: int
+    seq: int
+    future: asyncio.Future = field(compare=False)
+
+
+class _ModelQueue:
+    """单个模型的并发槽位和等待队列"""
+
+    def __init__(
+        self,
+        model: str,
+        max_concurrency: int,
+        max_queue_size: int,
+        queue_timeout: float
+    ):
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.max_queue_size = max_queue_size
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._waiters: List[_Waiter] = []
+        self._seq = itertools.count()
+        # 槽位平均占用时长（EWMA），用于估算 Retry-After
+        self._service_time = 1.0
+        self.stats: Dict[str, float] = {
+            "admitted": 0,
+            "rejected": 0,
+            "timed_out": 0,
+            "preempted": 0,
+            "total_wait": 0.0,
+            "max_wait": 0.0,
+        }
+
+    @property
+    def depth(self) -> int:
+        return len(self._waiters)
+
+    def retry_after(self) -> float:
+        """按当前队列长度和平均占用时长估算需要等待的秒数"""
+        backlog = (self.depth + 1) / max(self.max_concurrency, 1)
+        return max(1.0, backlog * self._service_time)
+
+    async def acquire(self, priority: int) -> float:
+        """获取一个槽位，返回排队等待的秒数"""
+        if self.active < self.max_concurrency and not self._waiters:
+            self.active += 1
+            self.stats["admitted"] += 1
+            return 0.0
+
+        if self.depth >= self.max_queue_size:
+            self._make_room(priority)
+
+        waiter = _Waiter(priority, next(self._seq), asyncio.get_running_loop().create_future())
+        heapq.heappush(self._waiters, waiter)
+        start = time.monotonic()
+
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._abandon(waiter)
+            self.stats["timed_out"] += 1
+            raise SchedulerOverloaded(self.model, "queue timeout", self.retry_after())
+        except BaseException:
+            self._abandon(waiter)
+            raise
+
+        wait = time.monotonic() - start
+        self.stats["admitted"] += 1
+        self.stats["total_wait"] += wait
+        self.stats["max_wait"] = max(self.stats["max_wait"], wait)
+        return wait
+
+    def release(self, held: float) -> None:
+        """释放槽位，直接交给优先级最高的等待者"""
+        self._service_time = 0.9 * self._service_time + 0.1 * held
+
+        while self._waiters:
+            waiter = heapq.heappop(self._waiters)
+            if not waiter.future.done():
+                waiter.future.set_result(None)
+                return
+
+        self.active -= 1
+
+    def _make_room(self, priority: int) -> None:
+        """队列已满：若新请求优先级更高则淘汰最低优先级的等待者，否则拒绝"""
+        worst = max(self._waiters)
+        if priority >= worst.priority:
+            self.stats["rejected"] += 1
+            raise SchedulerOverloaded(self.model, "queue full", self.retry_after())
+
+        self._waiters.remove(worst)
+        heapq.heapify(self._waiters)
+        worst.future.set_exception(
+            SchedulerOverloaded(self.model, "preempted by higher priority", self.retry_after())
+        )
+        self.stats["preempted"] += 1
+
+    def _abandon(self, waiter: _Waiter) -> None:
+        """等待者离开队列；若槽位恰好已交给它，则转交给下一个"""
+        if waiter.future.done() and not waiter.future.cancelled():
+            if waiter.future.exception() is None:
+                self.release(self._service_time)
+            return
+
+        waiter.future.cancel()
+        if waiter in self._waiters:
+            self._waiters.remove(waiter)
+            heapq.heapify(self._waiters)
+
+    def get_stats(self) -> Dict[str, Any]:
+        admitted = self.stats["admitted"]
+        avg_wait = self.stats["total_wait"] / admitted if admitted else 0.0
+        return {
+            "active": self.active,
+            "queue_depth": self.depth,
+            "max_concurrency": self.max_concurrency,
+            "max_queue_size": self.max_queue_size,
+            "admitted": int(admitted),
+            "rejected": int(self.stats["rejected"]),
+            "timed_out": int(self.stats["timed_out"]),
+            "preempted": int(self.stats["preempted"]),
+            "avg_wait_ms": round(1000 * avg_wait, 2),
+            "max_wait_ms": round(1000 * self.stats["max_wait"], 2),
+            "retry_after": self.retry_after(),
+        }
+
+
+class RequestScheduler:
+    """按模型管理准入控制"""
+
+    def __init__(self):
+        self._queues: Dict[str, _ModelQueue] = {}
+
+    def configure(
+        self,
+        model: str,
+        max_concurrency: int,
+        max_queue_size: int,
+        queue_timeout: float
+    ) -> None:
+        """设置（或更新）模型的调度参数"""
+        queue = self._queues.get(model)
+        if queue is None:
+            self._queues[model] = _ModelQueue(
+                model, max_concurrency, max_queue_size, queue_timeout
+            )
+            return
+
+        queue.max_concurrency = max_concurrency
+        queue.max_queue_size = max_queue_size
+        queue.queue_timeout = queue_timeout
+
+    def remove(self, model: str) -> None:
+        """移除模型的调度状态"""
+        self._queues.pop(model, None)
+
+    @asynccontextmanager
+    async def slot(self, model: str, priority: str = "normal") -> AsyncIterator[float]:
+        """
+        占用模型的一个并发槽位
+
+        Yields:
+            排队等待的秒数
+        """
+        queue = self._queues.get(model)
+        if queue is None:
+            yield 0.0
+            return
+
+        wait = await queue.acquire(PRIORITY_CLASSES.get(priority, PRIORITY_CLASSES["normal"]))
+        start = time.monotonic()
+        try:
+            yield wait
+        finally:
+            queue.release(time.monotonic() - start)
+
+    def queue_depth(self, model: str) -> int:
+        """当前排队的请求数"""
+        queue = self._queues.get(model)
+        return queue.depth if queue else 0
+
+    def retry_after(self, model: str) -> int:
+        """建议的重试间隔（秒）"""
+        queue = self._queues.get(model)
+        return math.ceil(queue.retry_after()) if queue else 1
+
+    def get_stats(self, model: Optional[str] = None) -> Dict[str, Any]:
+        """调度统计"""
+        if model is not None:
+            queue = self._queues.get(model)
+            return queue.get_stats() if queue else {}
+        return {name: queue.get_stats() for name, queue in self._queues.items()}
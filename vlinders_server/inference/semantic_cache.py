@@ -0,0 +1,371 @@
+"""
+语义缓存
+
+对措辞不同但语义相同的请求复用之前的回答。按模型开启（ModelConfig.semantic_cache）：
+- 命名空间: 模型 + 系统 prompt + 采样参数的哈希，只有命名空间完全相同的请求才会互相命中。
+  只缓存单轮请求（系统 prompt 之外只有一条 user 消息），带对话历史的请求不经过语义缓存
+- 相似度: 最后一条 user 消息的嵌入向量，在进程内向量索引中查找，超过阈值即命中
+- 可选地镜像到 Qdrant（SEMANTIC_CACHE_QDRANT），进程内未命中时再查询 Qdrant
+- 误命中: 按 SEMANTIC_CACHE_VERIFY_RATE 抽样，在后台重新生成并比较两次回答的嵌入，
+  相似度低于 SEMANTIC_CACHE_AGREEMENT_THRESHOLD 记为误命中并删除该条目
+"""
+import asyncio
+import hashlib
+import itertools
+import json
+import random
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+import numpy as np
+
+from ..config import ModelConfig, config
+from ..metrics import SEMANTIC_CACHE_REQUESTS
+from ..utils import logger
+from .embeddings import embedding_service
+from .vector_index import VectorIndex
+
+
+@dataclass
+class SemanticQuery:
+    """一次查询（命中失败后用于写入）"""
+    model_config: ModelConfig
+    namespace: str
+    vector: np.ndarray
+
+
+@dataclass
+class SemanticHit:
+    """命中结果"""
+    entry_id: int
+    similarity: float
+    response: Dict[str, Any]
+
+
+@dataclass
+class _Entry:
+    namespace: str
+    model: str
+    response: Dict[str, Any]
+    expires_at: float
+
+
+class _QdrantMirror:
+    """Qdrant 镜像（失败只记录，不影响请求）"""
+
+    def __init__(self, url: str, collection: str):
+        self.url = url
+        self.collection = collection
+        self._client = None
+        self._ready: Optional[asyncio.Task] = None
+
+    async def _ensure(self, dimension: int) -> Any:
+        if self._ready is None:
+            self._ready = asyncio.create_task(self._connect(dimension))
+        await asyncio.shield(self._ready)
+        return self._client
+
+    async def _connect(self, dimension: int) -> None:
+        # 延迟导入：只有开启镜像时才需要 qdrant-client
+        from qdrant_client import AsyncQdrantClient, models
+
+        client = AsyncQdrantClient(url=self.url)
+        if not await client.collection_exists(self.collection):
+            await client.create_collection(
+                self.collection,
+                vectors_config=models.VectorParams(size=dimension, distance=models.Distance.COSINE)
+            )
+        self._client = client
+
+    async def upsert(self, vector: np.ndarray, entry: _Entry) -> None:
+        from qdrant_client import models
+
+        client = await self._ensure(len(vector))
+        await client.upsert(
+            self.collection,
+            points=[models.PointStruct(
+                id=str(uuid.uuid4()),
+                vector=vector.tolist(),
+                payload={
+                    "namespace": entry.namespace,
+                    "model": entry.model,
+                    "response": entry.response,
+                    "expires_at": entry.expires_at,
+                }
+            )]
+        )
+
+    async def search(
+        self,
+        vector: np.ndarray,
+        namespace: str,
+        threshold: float
+    ) -> Optional[Dict[str, Any]]:
+        from qdrant_client import models
+
+        client = await self._ensure(len(vector))
+        result = await client.query_points(
+            self.collection,
+            query=vector.tolist(),
+            query_filter=models.Filter(must=[
+                models.FieldCondition(key="namespace", match=models.MatchValue(value=namespace)),
+                models.FieldCondition(key="expires_at", range=models.Range(gt=time.time())),
+            ]),
+            score_threshold=threshold,
+            limit=1,
+            with_payload=True
+        )
+        if not result.points:
+            return None
+        point = result.points[0]
+        return {"similarity": point.score, **point.payload}
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.close()
+
+
+class SemanticCache:
+    """语义缓存"""
+
+    def __init__(self):
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._indexes: Dict[str, VectorIndex] = {}
+        self._entry_ids = itertools.count()
+        self._background: Set[asyncio.Task] = set()
+        self._mirror: Optional[_QdrantMirror] = None
+        self.stats: Dict[str, int] = {
+            "lookups": 0,
+            "hits": 0,
+            "misses": 0,
+            "false_hits": 0,
+            "verifications": 0,
+            "stores": 0,
+            "evictions": 0,
+            "qdrant_hits": 0,
+            "qdrant_errors": 0,
+        }
+
+    def enabled_for(self, model_config: Optional[ModelConfig]) -> bool:
+        """全局开关、模型开关均开启且嵌入模型可用"""
+        return (
+            config.server.semantic_cache_enabled
+            and model_config is not None
+            and model_config.semantic_cache
+            and embedding_service.enabled
+        )
+
+    async def prepare(
+        self,
+        model_config: Optional[ModelConfig],
+        messages: List[Dict[str, str]],
+        params: Dict[str, Any]
+    ) -> Optional[SemanticQuery]:
+        """
+        计算命名空间和最后一条 user 消息的嵌入
+
+        Returns:
+            未开启语义缓存、不是单轮请求（最后一条不是 user，或之前有 system 以外的消息）
+            或嵌入失败时为 None
+        """
+        if not self.enabled_for(model_config) or not messages:
+            return None
+        if messages[-1]["role"] != "user":
+            return None
+        if any(message["role"] != "system" for message in messages[:-1]):
+            return None
+
+        system_prompt = [message["content"] for message in messages[:-1]]
+        namespace = hashlib.sha256(
+            json.dumps(
+                [model_config.name, system_prompt, params], sort_keys=True, ensure_ascii=False
+            ).encode("utf-8")
+        ).hexdigest()
+        try:
+            result = await embedding_service.embed([messages[-1]["content"]])
+        except Exception as e:
+            logger.warning(f"Semantic cache embedding failed: {e}")
+            return None
+
+        return SemanticQuery(model_config, namespace, np.asarray(result.embeddings[0], np.float32))
+
+    async def lookup(self, query: SemanticQuery) -> Optional[SemanticHit]:
+        """查找相似度超过模型阈值的回答"""
+        self.stats["lookups"] += 1
+        model = query.model_config.name
+        threshold = query.model_config.semantic_cache_threshold
+
+        hit = self._lookup_local(query, threshold)
+        if hit is None and self._get_mirror() is not None:
+            hit = await self._lookup_mirror(query, threshold)
+
+        if hit is None:
+            self.stats["misses"] += 1
+            SEMANTIC_CACHE_REQUESTS.labels(model=model, result="miss").inc()
+            return None
+
+        self.stats["hits"] += 1
+        SEMANTIC_CACHE_REQUESTS.labels(model=model, result="hit").inc()
+        return hit
+
+    def _lookup_local(self, query: SemanticQuery, threshold: float) -> Optional[SemanticHit]:
+        index = self._indexes.get(query.namespace)
+        if index is None:
+            return None
+
+        now = time.time()
+        for entry_id, similarity in index.search(query.vector, k=4):
+            entry = self._entries.get(entry_id)
+            if entry is None:
+                continue
+            if entry.expires_at <= now:
+                self._remove(entry_id)
+                continue
+            if similarity >= threshold:
+                return SemanticHit(entry_id, similarity, entry.response)
+        return None
+
+    async def _lookup_mirror(self, query: SemanticQuery, threshold: float) -> Optional[SemanticHit]:
+        try:
+            found = await self._mirror.search(query.vector, query.namespace, threshold)
+        except Exception as e:
+            self.stats["qdrant_errors"] += 1
+            logger.warning(f"Semantic cache Qdrant lookup failed: {e}")
+            return None
+        if found is None:
+            return None
+
+        # 写回进程内索引，后续请求不再访问 Qdrant
+        self.stats["qdrant_hits"] += 1
+        entry_id = self._add(
+            query.namespace, query.vector,
+            _Entry(query.namespace, found["model"], found["response"], found["expires_at"])
+        )
+        return SemanticHit(entry_id, found["similarity"], found["response"])
+
+    async def store(self, query: SemanticQuery, response: Dict[str, Any]) -> None:
+        """写入回答（TTL 按模型配置）"""
+        entry = _Entry(
+            namespace=query.namespace,
+            model=query.model_config.name,
+            response=response,
+            expires_at=time.time() + query.model_config.semantic_cache_ttl
+        )
+        self._add(query.namespace, query.vector, entry)
+        self.stats["stores"] += 1
+
+        if self._get_mirror() is not None:
+            try:
+                await self._mirror.upsert(query.vector, entry)
+            except Exception as e:
+                self.stats["qdrant_errors"] += 1
+                logger.warning(f"Semantic cache Qdrant upsert failed: {e}")
+
+    def maybe_verify(
+        self,
+        query: SemanticQuery,
+        hit: SemanticHit,
+        regenerate: Callable[[], Awaitable[str]]
+    ) -> None:
+        """按抽样率在后台重新生成，检查命中是否为误命中"""
+        if random.random() >= config.server.semantic_cache_verify_rate:
+            return
+        task = asyncio.create_task(self._verify(query, hit, regenerate))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _verify(
+        self,
+        query: SemanticQuery,
+        hit: SemanticHit,
+        regenerate: Callable[[], Awaitable[str]]
+    ) -> None:
+        try:
+            fresh = await regenerate()
+            result = await embedding_service.embed([hit.response["text"], fresh])
+        except Exception as e:
+            logger.warning(f"Semantic cache verification failed: {e}")
+            return
+
+        self.stats["verifications"] += 1
+        cached_vector, fresh_vector = np.asarray(result.embeddings, np.float32)
+        # 与问题的命中阈值分开：temperature > 0 时两次回答措辞不同，相似度本就较低
+        agreement = float(cached_vector @ fresh_vector)
+        if agreement < config.server.semantic_cache_agreement_threshold:
+            self.stats["false_hits"] += 1
+            SEMANTIC_CACHE_REQUESTS.labels(
+                model=query.model_config.name, result="false_hit"
+            ).inc()
+            self._remove(hit.entry_id)
+
+    def _add(self, namespace: str, vector: np.ndarray, entry: _Entry) -> int:
+        entry_id = next(self._entry_ids)
+        index = self._indexes.get(namespace)
+        if index is None:
+            index = self._indexes[namespace] = VectorIndex(
+                len(vector), ivf_threshold=config.server.semantic_cache_ivf_threshold
+            )
+        index.add(entry_id, vector)
+        self._entries[entry_id] = entry
+        self._evict()
+        return entry_id
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        index = self._indexes.get(entry.namespace)
+        if index is not None:
+            index.remove(entry_id)
+            if not len(index):
+                del self._indexes[entry.namespace]
+
+    def _evict(self) -> None:
+        """超出容量时先清理过期条目，再按写入顺序淘汰最旧的条目"""
+        max_entries = config.server.semantic_cache_max_entries
+        if len(self._entries) <= max_entries:
+            return
+
+        now = time.time()
+        for entry_id in [i for i, entry in self._entries.items() if entry.expires_at <= now]:
+            self._remove(entry_id)
+            self.stats["evictions"] += 1
+        while len(self._entries) > max_entries:
+            self._remove(next(iter(self._entries)))
+            self.stats["evictions"] += 1
+
+    def _get_mirror(self) -> Optional[_QdrantMirror]:
+        if config.server.semantic_cache_qdrant and self._mirror is None:
+            self._mirror = _QdrantMirror(
+                config.server.qdrant_url, config.server.semantic_cache_collection
+            )
+        return self._mirror
+
+    async def close(self) -> None:
+        for task in list(self._background):
+            task.cancel()
+        await asyncio.gather(*self._background, return_exceptions=True)
+        if self._mirror is not None:
+            await self._mirror.close()
+            self._mirror = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.stats["lookups"]
+        verifications = self.stats["verifications"]
+        return {
+            **self.stats,
+            "enabled": config.server.semantic_cache_enabled,
+            "entries": len(self._entries),
+            "namespaces": len(self._indexes),
+            "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+            "false_hit_rate": (
+                round(self.stats["false_hits"] / verifications, 4) if verifications else 0.0
+            ),
+        }
+
+
+# 全局语义缓存实例
+semantic_cache = SemanticCache()
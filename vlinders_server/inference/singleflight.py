@@ -0,0 +1,157 @@
+"""
+在途请求合并（single-flight）
+
+相同 key 的并发请求只执行一次，其余请求挂到正在执行的任务上共享结果
+"""
+import asyncio
+from contextlib import aclosing
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Dict, Hashable, List
+
+
+class _InFlightCall:
+    """一次在途的非流式调用"""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class _SharedStream:
+    """一次在途的流式调用，可被多个订阅者重放"""
+
+    def __init__(self, source: AsyncIterator[Any]):
+        self.chunks: List[Any] = []
+        self.done = False
+        # 最后一个订阅者已离开、任务正在取消，不再接受新订阅者
+        self.closing = False
+        self.error: BaseException | None = None
+        self.subscribers = 0
+        self._changed = asyncio.Event()
+        self.task = asyncio.create_task(self._pump(source))
+
+    async def _pump(self, source: AsyncIterator[Any]) -> None:
+        try:
+            async for chunk in source:
+                self.chunks.append(chunk)
+                self._notify()
+        except asyncio.CancelledError:
+            self.error = asyncio.CancelledError()
+            raise
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+            aclose = getattr(source, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    def _notify(self) -> None:
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def subscribe(self) -> AsyncGenerator[Any, None]:
+        """从头订阅，先重放已有的块，再等待新块"""
+        self.subscribers += 1
+        index = 0
+        try:
+            while True:
+                while index < len(self.chunks):
+                    yield self.chunks[index]
+                    index += 1
+
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+
+                await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+            # 最后一个订阅者离开时停止生成，不再为无人接收的输出消耗算力
+            if self.subscribers == 0 and not self.done:
+                self.closing = True
+                self.task.cancel()
+
+
+class SingleFlight:
+    """按 key 合并在途的相同请求"""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _InFlightCall] = {}
+        self._streams: Dict[Hashable, _SharedStream] = {}
+        self.stats: Dict[str, int] = {
+            "leaders": 0,
+            "hits": 0,
+            "stream_leaders": 0,
+            "stream_hits": 0,
+        }
+
+    def in_flight(self) -> int:
+        """当前在途的合并组数量"""
+        return len(self._calls) + len(self._streams)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        执行或加入一次非流式调用
+
+        第一个请求创建任务，后续相同 key 的请求等待同一个任务。
+        单个等待者被取消不会影响其他等待者；全部取消时任务也会被取消。
+        """
+        call = self._calls.get(key)
+        if call is None:
+            self.stats["leaders"] += 1
+            call = _InFlightCall(asyncio.create_task(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget_call(key, call))
+        else:
+            self.stats["hits"] += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if call.waiters == 1 and not call.task.done():
+                # 任务结束前就移除，之后的相同请求重新执行，不会加入正在取消的任务
+                self._forget_call(key, call)
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+    async def stream(
+        self,
+        key: Hashable,
+        fn: Callable[[], AsyncIterator[Any]]
+    ) -> AsyncGenerator[Any, None]:
+        """
+        执行或加入一次流式调用
+
+        后加入的订阅者会先收到已生成的全部块，因此每个订阅者看到的流完全一致。
+        所有订阅者离开后流被取消，之后的相同请求重新执行。
+        """
+        shared = self._streams.get(key)
+        if shared is None or shared.done or shared.closing:
+            self.stats["stream_leaders"] += 1
+            shared = _SharedStream(fn())
+            self._streams[key] = shared
+            shared.task.add_done_callback(lambda _: self._forget_stream(key, shared))
+        else:
+            self.stats["stream_hits"] += 1
+
+        try:
+            # 本生成器被关闭时立即关闭订阅（更新订阅者计数），不等垃圾回收
+            async with aclosing(shared.subscribe()) as chunks:
+                async for chunk in chunks:
+                    yield chunk
+        finally:
+            if shared.closing:
+                self._forget_stream(key, shared)
+
+    def _forget_call(self, key: Hashable, call: _InFlightCall) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def _forget_stream(self, key: Hashable, shared: _SharedStream) -> None:
+        if self._streams.get(key) is shared:
+            del self._streams[key]
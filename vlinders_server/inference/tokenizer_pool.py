@@ -0,0 +1,141 @@
+"""
+分词线程池
+
+分词（chat template 渲染、encode）是 CPU 密集操作，放在事件循环上会拖慢所有 SSE 流。
+每个模型有一条独立的工作线程（lane），该模型的 tokenizer 实例只在这条线程上使用，
+因此无需考虑 tokenizer 的线程安全，不同模型之间则可以并行分词。
+
+零散的 encode 调用会先排队：lane 空闲时立即执行，忙碌期间到达的请求在下一次
+合并成一个批量 encode（HF fast tokenizer 的批量接口在 Rust 中并行且释放 GIL）。
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+def batch_encode(tokenizer: Any, texts: List[str]) -> List[List[int]]:
+    """批量分词（不添加特殊 token，chat template 已包含）"""
+    if callable(tokenizer):
+        # HF tokenizer: 一次调用完成整批
+        return [list(ids) for ids in tokenizer(texts, add_special_tokens=False)["input_ids"]]
+    return [list(tokenizer.encode(text, add_special_tokens=False)) for text in texts]
+
+
+class _TokenizerLane:
+    """单个模型的分词线程及待合并的 encode 请求"""
+
+    def __init__(self, model: str, tokenizer: Any, max_batch: int):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch = max_batch
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"tokenizer-{model}")
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._drain_task: Optional[asyncio.Task] = None
+        self.stats: Dict[str, int] = {
+            "encodes": 0,
+            "batches": 0,
+            "max_batch": 0,
+            "calls": 0,
+        }
+
+    async def run(self, fn: Callable[..., T], *args: Any) -> T:
+        """在 lane 线程上执行任意分词相关的函数"""
+        self.stats["calls"] += 1
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def encode(self, text: str) -> List[int]:
+        """提交一次 encode，与同时到达的请求合并执行"""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((text, future))
+        if self._drain_task is None:
+            self._drain_task = asyncio.create_task(self._drain())
+        return await future
+
+    async def _drain(self) -> None:
+        # 让同一轮事件循环中提交的请求都进入第一批
+        await asyncio.sleep(0)
+        loop = asyncio.get_running_loop()
+        try:
+            while self._pending:
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+                batch = [(text, future) for text, future in batch if not future.done()]
+                if not batch:
+                    continue
+
+                self.stats["batches"] += 1
+                self.stats["encodes"] += len(batch)
+                self.stats["max_batch"] = max(self.stats["max_batch"], len(batch))
+                try:
+                    results = await loop.run_in_executor(
+                        self.executor, batch_encode, self.tokenizer, [text for text, _ in batch]
+                    )
+                except Exception as e:
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+
+                for (_, future), token_ids in zip(batch, results):
+                    if not future.done():
+                        future.set_result(token_ids)
+        finally:
+            self._drain_task = None
+
+    def close(self) -> None:
+        for _, future in self._pending:
+            if not future.done():
+                future.set_exception(RuntimeError(f"Tokenizer for {self.model} removed"))
+        self._pending.clear()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class TokenizerPool:
+    """全部模型的分词 lane"""
+
+    def __init__(self, max_batch: int = 64):
+        self.max_batch = max_batch
+        self._lanes: Dict[str, _TokenizerLane] = {}
+
+    def register(self, model: str, tokenizer: Any) -> None:
+        """为模型创建分词 lane（没有 tokenizer 的模型不创建）"""
+        self.remove(model)
+        if tokenizer is not None:
+            self._lanes[model] = _TokenizerLane(model, tokenizer, self.max_batch)
+
+    def remove(self, model: str) -> None:
+        lane = self._lanes.pop(model, None)
+        if lane is not None:
+            lane.close()
+
+    def has_tokenizer(self, model: str) -> bool:
+        return model in self._lanes
+
+    async def run(self, model: str, fn: Callable[..., T], *args: Any) -> T:
+        """
+        在模型的分词线程上执行 fn（使用该模型 tokenizer 的操作必须经由此处）
+
+        模型没有 tokenizer 时直接在当前线程执行
+        """
+        lane = self._lanes.get(model)
+        if lane is None:
+            return fn(*args)
+        return await lane.run(fn, *args)
+
+    async def encode(self, model: str, text: str) -> List[int]:
+        return await self._lane(model).encode(text)
+
+    async def encode_batch(self, model: str, texts: List[str]) -> List[List[int]]:
+        lane = self._lane(model)
+        return list(await asyncio.gather(*(lane.encode(text) for text in texts)))
+
+    def get_stats(self) -> Dict[str, Dict[str, int]]:
+        return {model: dict(lane.stats) for model, lane in self._lanes.items()}
+
+    def _lane(self, model: str) -> _TokenizerLane:
+        lane = self._lanes.get(model)
+        if lane is None:
+            raise ValueError(f"Model {model} has no tokenizer")
+        return lane
@@ -0,0 +1,115 @@
+"""
+进程内向量索引
+
+向量已归一化，内积即余弦相似度。条目较少时暴力计算；超过 ivf_threshold 后用
+k-means 把向量分成 sqrt(n) 个簇（IVF），查询时只计算最近 nprobe 个簇内的向量。
+"""
+import math
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class VectorIndex:
+    """支持增删的内积索引"""
+
+    def __init__(self, dimension: int, ivf_threshold: int = 20000, nprobe: int = 8):
+        self.dimension = dimension
+        self.ivf_threshold = ivf_threshold
+        self.nprobe = nprobe
+        self._matrix = np.zeros((16, dimension), dtype=np.float32)
+        self._ids: List[int] = []
+        self._positions: Dict[int, int] = {}
+        # IVF: 簇中心及每个向量所属的簇
+        self._centroids: Optional[np.ndarray] = None
+        self._assignments = np.zeros(16, dtype=np.int32)
+        self._trained_size = 0
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    @property
+    def uses_ivf(self) -> bool:
+        return self._centroids is not None
+
+    def add(self, entry_id: int, vector: np.ndarray) -> None:
+        if entry_id in self._positions:
+            self.remove(entry_id)
+
+        size = len(self._ids)
+        if size == len(self._matrix):
+            matrix = np.zeros((size * 2, self.dimension), dtype=np.float32)
+            matrix[:size] = self._matrix
+            assignments = np.zeros(size * 2, dtype=np.int32)
+            assignments[:size] = self._assignments
+            self._matrix, self._assignments = matrix, assignments
+
+        self._matrix[size] = vector
+        if self._centroids is not None:
+            self._assignments[size] = int(np.argmax(self._centroids @ vector))
+        self._ids.append(entry_id)
+        self._positions[entry_id] = size
+
+        # 规模翻倍后重新训练簇中心
+        if size + 1 >= self.ivf_threshold and size + 1 >= 2 * self._trained_size:
+            self._train()
+
+    def remove(self, entry_id: int) -> None:
+        """删除条目（与最后一个条目交换位置，O(1)）"""
+        position = self._positions.pop(entry_id, None)
+        if position is None:
+            return
+
+        last = len(self._ids) - 1
+        if position != last:
+            moved = self._ids[last]
+            self._matrix[position] = self._matrix[last]
+            self._assignments[position] = self._assignments[last]
+            self._ids[position] = moved
+            self._positions[moved] = position
+        self._ids.pop()
+
+    def search(self, vector: np.ndarray, k: int = 1) -> List[Tuple[int, float]]:
+        """返回相似度最高的 k 个 (entry_id, 相似度)"""
+        size = len(self._ids)
+        if size == 0:
+            return []
+
+        matrix = self._matrix[:size]
+        rows = None
+        if self._centroids is not None:
+            probe = np.argsort(self._centroids @ vector)[-self.nprobe:]
+            rows = np.flatnonzero(np.isin(self._assignments[:size], probe))
+            if rows.size == 0:
+                return []
+            matrix = matrix[rows]
+
+        scores = matrix @ vector
+        k = min(k, len(scores))
+        top = np.argpartition(scores, -k)[-k:]
+        top = top[np.argsort(scores[top])[::-1]]
+        return [
+            (self._ids[int(rows[i]) if rows is not None else int(i)], float(scores[i]))
+            for i in top
+        ]
+
+    def _train(self, iterations: int = 5) -> None:
+        """在样本上运行 k-means，并重新分配全部向量"""
+        size = len(self._ids)
+        vectors = self._matrix[:size]
+        nlist = max(int(math.sqrt(size)), 1)
+        rng = np.random.default_rng(0)
+        sample = vectors[rng.choice(size, size=min(size, nlist * 64), replace=False)]
+
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            for cluster in range(nlist):
+                members = sample[assignments == cluster]
+                if len(members):
+                    centroid = members.mean(axis=0)
+                    centroids[cluster] = centroid / max(np.linalg.norm(centroid), 1e-12)
+
+        self._centroids = centroids
+        self._assignments[:size] = np.argmax(vectors @ centroids.T, axis=1)
+        self._trained_size = size
@@ -1,6 +1,7 @@
 """
 FastAPI 应用主入口
 """
+import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
@@ -9,11 +10,25 @@ from .config import config
 from .utils import logger
 from .database import db
 from .cache import cache
+from .ratelimit import rate_limiter
 from .api.health import router as health_router
+from .api.internal import router as internal_router
+from .inference import vllm_service
+from .inference.embeddings import embedding_service
+from .inference.semantic_cache import semantic_cache
+from .tracing import TracingMiddleware, tracing
 
-# 注意: vLLM 推理服务需要在安装完依赖后启用
-# from .inference import vllm_service
-# from .api.internal import router as internal_router
+
+def _log_startup_loading(task: asyncio.Task) -> None:
+    """记录启动时并行加载的结果"""
+
+    if task.cancelled():
+        return
+    failed = {name: error for name, error in task.result().items() if error is not None}
+    if failed:
+        logger.error(f"Models failed to load at startup: {failed}")
+    else:
+        logger.info("All eager models loaded")
 
 
 @asynccontextmanager
@@ -23,12 +38,19 @@ async def lifespan(app: FastAPI):
     # 启动时
     logger.info("Starting Vlinders-Server...")
 
+    if config.server.tracing_enabled:
+        try:
+            tracing.setup()
+        except Exception as e:
+            logger.warning(f"Failed to set up tracing: {e}")
+
     # 连接数据库和缓存
     try:
         await cache.connect()
         logger.info("Cache service connected")
     except Exception as e:
-        logger.warning(f"Failed to connect to cache: {e}")
+        # 不影响推理：限流和补全缓存改用进程内实现，后台继续重连
+        logger.warning(f"Failed to connect to cache, running degraded: {e}")
 
     try:
         await db.connect()
@@ -37,22 +59,40 @@ async def lifespan(app: FastAPI):
         logger.warning(f"Failed to connect to database: {e}")
 
     # 加载模型配置
-    config.load_models_config()
+    config.load_models_config(config.server.models_config)
+
+    # 登记全部模型，on_demand 模型在首次请求时加载
+    for model_name, model_config in config.models.items():
+        vllm_service.register_model(model_name, model_config)
 
-    # TODO: 在 vLLM 安装完成后启用模型加载
-    # for model_name, model_config in config.models.items():
-    #     try:
-    #         await vllm_service.load_model(model_name, model_config)
-    #     except Exception as e:
-    #         logger.error(f"Failed to load model {model_name}: {e}")
+    # eager 模型在后台并行加载，每个模型加载完成即可接收请求，/ready 按 REQUIRED_MODELS 判断
+    eager_models = [
+        name for name, model_config in config.models.items()
+        if model_config.load_policy == "eager"
+    ]
+    startup_loading = asyncio.create_task(vllm_service.load_models(eager_models))
+    startup_loading.add_done_callback(_log_startup_loading)
 
-    logger.info("Vlinders-Server started successfully (vLLM disabled)")
+    # 嵌入模型同样在后台加载
+    if config.server.embedding_enabled:
+        embedding_service.start_loading(config.server.embedding_config)
+
+    logger.info("Vlinders-Server started successfully")
 
     yield
 
     # 关闭时
     logger.info("Shutting down Vlinders-Server...")
 
+    # 取消未完成的加载并卸载模型
+    await vllm_service.shutdown()
+    await semantic_cache.close()
+    await embedding_service.shutdown()
+    tracing.shutdown()
+
+    # 退还限流租约中未用完的额度
+    await rate_limiter.release_leases()
+
     # 断开数据库和缓存连接
     await cache.disconnect()
     await db.disconnect()
@@ -75,9 +115,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 追踪中间件（/internal 请求，未开启追踪时直接透传）
+app.add_middleware(TracingMiddleware)
+
 # 注册路由
-# TODO: 在 vLLM 安装完成后启用内部 API
-# app.include_router(internal_router, prefix="/internal", tags=["Internal"])
+app.include_router(internal_router, prefix="/internal", tags=["Internal"])
 app.include_router(health_router, tags=["Health"])
 
 
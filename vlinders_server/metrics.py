@@ -0,0 +1,144 @@
+"""
+Prometheus 指标
+
+按请求记录的指标直接使用 prometheus_client；每个 token 都要记录的 token 间延迟使用
+事件循环内的无锁直方图（FastHistogram），采集时才转换为 Prometheus 格式。
+在途、排队等瞬时值由采集回调读取，不占用请求路径。
+"""
+import bisect
+from typing import Any, Callable, Dict, Iterable, List, Sequence
+
+from prometheus_client import REGISTRY, Counter, Histogram
+from prometheus_client.core import HistogramMetricFamily, Metric
+
+TOKEN_BUCKETS = (1, 8, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 65536)
+
+
+class FastHistogram:
+    """
+    单标签（model）的无锁直方图，只能在事件循环线程中 observe
+
+    比 prometheus_client.Histogram 少了锁和标签查找，适合每个 token 都要记录的指标
+    """
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float]):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = list(buckets)
+        # model -> [各分桶计数（最后一个为 +Inf）, 总和]
+        self._series: Dict[str, List[Any]] = {}
+
+    def observe(self, model: str, value: float, count: int = 1) -> None:
+        """记录 count 个相同的观测值"""
+        series = self._series.get(model)
+        if series is None:
+            series = self._series[model] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += count
+        series[1] += value * count
+
+    def collect(self) -> Metric:
+        family = HistogramMetricFamily(self.name, self.documentation, labels=["model"])
+        for model, (counts, total) in self._series.items():
+            cumulative, buckets = 0, []
+            for bound, count in zip(self.buckets + [float("inf")], counts):
+                cumulative += count
+                buckets.append(("+Inf" if bound == float("inf") else str(bound), cumulative))
+            family.add_metric([model], buckets, total)
+        return family
+
+
+class CallbackCollector:
+    """采集时调用回调生成指标"""
+
+    def __init__(self, callback: Callable[[], Iterable[Metric]]):
+        self.callback = callback
+
+    def collect(self) -> Iterable[Metric]:
+        return self.callback()
+
+
+# 生成请求
+REQUESTS = Counter(
+    "vlinders_requests",
+    "Generation requests by outcome (success / error / aborted)",
+    ["model", "status"]
+)
+TOKENS = Counter(
+    "vlinders_tokens",
+    "Tokens processed (kind = prompt / completion)",
+    ["model", "kind"]
+)
+QUEUE_WAIT = Histogram(
+    "vlinders_queue_wait_seconds",
+    "Time a request waits for a scheduler slot",
+    ["model"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+TIME_TO_FIRST_TOKEN = Histogram(
+    "vlinders_time_to_first_token_seconds",
+    "Time from request start (including queueing) to the first output token",
+    ["model"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0)
+)
+INTER_TOKEN_LATENCY = FastHistogram(
+    "vlinders_inter_token_latency_seconds",
+    "Time between consecutive output tokens",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.015, 0.02, 0.03, 0.04, 0.05, 0.075, 0.1, 0.2, 0.5, 1.0)
+)
+RESPONSE_TIME = Histogram(
+    "vlinders_response_seconds",
+    "End-to-end generation latency (including queueing)",
+    ["model"],
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 60.0, 120.0, 300.0)
+)
+PROMPT_TOKENS = Histogram(
+    "vlinders_prompt_tokens",
+    "Prompt tokens per request",
+    ["model"],
+    buckets=TOKEN_BUCKETS
+)
+COMPLETION_TOKENS = Histogram(
+    "vlinders_completion_tokens",
+    "Completion tokens per request",
+    ["model"],
+    buckets=TOKEN_BUCKETS
+)
+
+REGISTRY.register(CallbackCollector(lambda: [INTER_TOKEN_LATENCY.collect()]))
+
+# 嵌入微批处理
+EMBEDDING_BATCH_SIZE = Histogram(
+    "vlinders_embedding_batch_size",
+    "Number of inputs per embedding forward pass",
+    ["model"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)
+)
+EMBEDDING_QUEUE_WAIT = Histogram(
+    "vlinders_embedding_queue_wait_seconds",
+    "Time an embedding input waits before its batch starts",
+    ["model"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+)
+
+# 语义缓存: result = hit / miss / false_hit
+SEMANTIC_CACHE_REQUESTS = Counter(
+    "vlinders_semantic_cache_requests",
+    "Semantic cache lookups by result",
+    ["model", "result"]
+)
+
+
+def histogram_snapshot(histogram: Histogram, **labels: str) -> Dict[str, Any]:
+    """读取直方图（指定标签）的累计分桶计数，用于 JSON 统计接口"""
+    snapshot: Dict[str, Any] = {"count": 0, "sum": 0.0, "buckets": {}}
+    for metric in histogram.collect():
+        for sample in metric.samples:
+            if any(sample.labels.get(key) != value for key, value in labels.items()):
+                continue
+            if sample.name.endswith("_bucket"):
+                snapshot["buckets"][sample.labels["le"]] = int(sample.value)
+            elif sample.name.endswith("_count"):
+                snapshot["count"] = int(sample.value)
+            elif sample.name.endswith("_sum"):
+                snapshot["sum"] = sample.value
+    return snapshot
@@ -1,116 +1,696 @@
 """
-API 限流中间件
+API 限流
+
+RateLimiter 按请求数（RPM / RPH）和 token 数（TPM / TPD）限流，分 user 和 tenant 两级，
+滑动窗口或 GCRA。准入时预留 prompt_tokens + max_tokens，生成结束后按实际用量调整；
+所有窗口由同一个 Lua 脚本在一次 Redis 往返中原子地检查和计数
 """
-from fastapi import HTTPException, Request, status
-from typing import Optional
+import asyncio
+import math
+from contextlib import AsyncExitStack
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
 import time
 
 from .cache import cache
+from .config import config
 from .utils import logger
 
+WINDOWS = {"minute": 60, "hour": 3600, "day": 86400}
+
+
+# 一次往返原子地检查并更新所有窗口（Redis 执行 Lua 脚本期间不处理其他命令）
+# KEYS: 每个窗口一个 key
+# ARGV: 算法（sliding / gcra）, 模式（check / force）, 然后每个 key 的 限额, 窗口秒数, 消耗
+#       消耗为 0 表示只查询，负数表示退还；force 模式不检查限额，直接计入（按实际用量结算）
+# 返回: {是否允许, 重试等待毫秒数, 等待最久的超限 key 的序号（从 1 开始，未超限为 0）,
+#        每个 key 的剩余额度...}
+# 任一窗口超限时不更新任何窗口，被拒绝的请求不占用额度
+_WINDOW_SCRIPT = """
+local algorithm = ARGV[1]
+local check = ARGV[2] == 'check'
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local allowed = 1
+local retry_after = 0
+local exceeded = 0
+local remaining = {}
+local updates = {}
+
+for i = 1, #KEYS do
+    local limit = tonumber(ARGV[3 * i])
+    local window = tonumber(ARGV[3 * i + 1])
+    local cost = tonumber(ARGV[3 * i + 2])
+    local wait = 0
+    if algorithm == 'gcra' then
+        -- 理论到达时间（TAT）: 每个单位推后 window / limit，最多领先当前时间一个窗口
+        local interval = window / limit
+        local tat = math.max(tonumber(redis.call('GET', KEYS[i]) or now), now)
+        local new_tat = math.max(tat + interval * cost, now)
+        if check and cost > 0 and new_tat - window > now then
+            wait = new_tat - window - now
+            remaining[i] = math.max(0, math.floor((window - (tat - now)) / interval))
+        else
+            remaining[i] = math.max(0, math.floor((window - (new_tat - now)) / interval))
+        end
+        updates[i] = new_tat
+    else
+        -- 滑动窗口: 上一个固定窗口的计数按未过去的比例计入
+        local bucket = math.floor(now / window)
+        local state = redis.call('HMGET', KEYS[i], 'b', 'c', 'p')
+        local stored = tonumber(state[1])
+        local current, previous = 0, 0
+        if stored == bucket then
+            current, previous = tonumber(state[2]), tonumber(state[3])
+        elseif stored == bucket - 1 then
+            previous = tonumber(state[2])
+        end
+        local elapsed = now - bucket * window
+        local used = previous * (1 - elapsed / window) + current
+        if check and cost > 0 and used + cost > limit then
+            if current + cost <= limit then
+                wait = (1 - (limit - cost - current) / previous) * window - elapsed
+            elseif current > 0 then
+                -- 等到下一个窗口中本窗口的计数衰减到足够小
+                wait = window - elapsed + (1 - (limit - cost) / current) * window
+            else
+                wait = window - elapsed
+            end
+            remaining[i] = math.max(0, math.floor(limit - used))
+        else
+            remaining[i] = math.max(0, math.floor(limit - used - cost))
+        end
+        -- 退还时先从本窗口扣减，本窗口不够再从上一个窗口扣减
+        local refund = math.min(current + cost, 0)
+        updates[i] = {bucket, math.max(current + cost, 0), math.max(previous + refund, 0)}
+    end
+    if wait > 0 then
+        allowed = 0
+        if wait > retry_after then
+            retry_after = wait
+            exceeded = i
+        end
+    end
+end
+
+if allowed == 1 then
+    for i = 1, #KEYS do
+        local window = tonumber(ARGV[3 * i + 1])
+        if tonumber(ARGV[3 * i + 2]) ~= 0 then
+            if algorithm == 'gcra' then
+                local ttl = math.ceil((updates[i] - now) * 1000)
+                if ttl > 0 then
+                    redis.call('SET', KEYS[i], updates[i], 'PX', ttl)
+                else
+                    redis.call('DEL', KEYS[i])
+                end
+            else
+                local update = updates[i]
+                redis.call('HSET', KEYS[i], 'b', update[1], 'c', update[2], 'p', update[3])
+                redis.call('PEXPIRE', KEYS[i], window * 2000)
+            end
+        end
+    end
+end
+
+return {allowed, math.ceil(retry_after * 1000), exceeded, unpack(remaining)}
+"""
+
+
+@dataclass
+class WindowCheck:
+    """一次窗口检查的结果"""
+    allowed: bool
+    # 被拒绝时距离可以重试的秒数
+    retry_after: float
+    # 等待最久的超限 key 的序号（未超限为 None）
+    exceeded: Optional[int]
+    # 每个 key 的剩余额度（允许时已扣除本次消耗）
+    remaining: List[int]
+
+
+class _LocalWindows:
+    """与 _WINDOW_SCRIPT 相同算法的进程内实现（未连接 Redis 时使用，只对单个 worker 准确）"""
+
+    def __init__(self):
+        self._state: Dict[str, Tuple[Any, float]] = {}
+
+    def evaluate(
+        self,
+        keys: List[str],
+        specs: List[Tuple[int, int, int]],
+        algorithm: str,
+        force: bool,
+        now: float
+    ) -> WindowCheck:
+        """
+        Args:
+            specs: 每个 key 的 (限额, 窗口秒数, 消耗)
+        """
+        retry_after = 0.0
+        exceeded = None
+        remaining: List[int] = []
+        updates = []
+
+        for index, (key, (limit, window, cost)) in enumerate(zip(keys, specs)):
+            state, expires_at = self._state.get(key, (None, 0.0))
+            if expires_at <= now:
+                state = None
+
+            wait = 0.0
+            if algorithm == "gcra":
+                interval = window / limit
+                tat = max(state if state is not None else now, now)
+                new_tat = max(tat + interval * cost, now)
+                if not force and cost > 0 and new_tat - window > now:
+                    wait = new_tat - window - now
+                    remaining.append(max(0, math.floor((window - (tat - now)) / interval)))
+                else:
+                    remaining.append(max(0, math.floor((window - (new_tat - now)) / interval)))
+                updates.append((key, cost, new_tat, new_tat))
+            else:
+                bucket = math.floor(now / window)
+                current, previous = 0, 0
+                if state is not None and state[0] == bucket:
+                    current, previous = state[1], state[2]
+                elif state is not None and state[0] == bucket - 1:
+                    previous = state[1]
+                elapsed = now - bucket * window
+                used = previous * (1 - elapsed / window) + current
+                if not force and cost > 0 and used + cost > limit:
+                    if current + cost <= limit:
+                        wait = (1 - (limit - cost - current) / previous) * window - elapsed
+                    elif current > 0:
+                        wait = window - elapsed + (1 - (limit - cost) / current) * window
+                    else:
+                        wait = window - elapsed
+                    remaining.append(max(0, math.floor(limit - used)))
+                else:
+                    remaining.append(max(0, math.floor(limit - used - cost)))
+                refund = min(current + cost, 0)
+                updates.append((
+                    key,
+                    cost,
+                    (bucket, max(current + cost, 0), max(previous + refund, 0)),
+                    now + window * 2
+                ))
+
+            if wait > retry_after:
+                retry_after = wait
+                exceeded = index
+
+        if exceeded is None:
+            for key, cost, state, expires_at in updates:
+                if cost != 0:
+                    self._state[key] = (state, expires_at)
+            if len(self._state) > 10000:
+                for key in [key for key, (_, end) in self._state.items() if end <= now]:
+                    del self._state[key]
+
+        return WindowCheck(exceeded is None, retry_after, exceeded, remaining)
+
+
+class WindowStore:
+    """
+    限流窗口的存储：连接了 Redis 时执行 _WINDOW_SCRIPT（计数在各 worker 间共享），
+    否则或脚本出错时使用进程内的同一算法
+    """
+
+    def __init__(self, algorithm: str = "sliding"):
+        if algorithm not in ("sliding", "gcra"):
+            raise ValueError(f"Unknown rate limit algorithm '{algorithm}'")
+        self.algorithm = algorithm
+        self._local = _LocalWindows()
+
+    async def evaluate(
+        self,
+        keys: List[str],
+        specs: List[Tuple[int, int, int]],
+        force: bool = False
+    ) -> WindowCheck:
+        """
+        原子地检查并计入各 key 的消耗（任一 key 超限时都不计入）
+
+        Args:
+            specs: 每个 key 的 (限额, 窗口秒数, 消耗)
+            force: 不检查限额，直接计入（结算实际用量、退还额度）
+        """
+        if cache.available:
+            args: List[Any] = [self.algorithm, "force" if force else "check"]
+            for spec in specs:
+                args.extend(spec)
+            try:
+                reply = await cache.eval_script(_WINDOW_SCRIPT, keys, args)
+            except Exception as e:
+                logger.warning(f"Rate limit script failed, using local counters: {e}")
+            else:
+                return WindowCheck(
+                    bool(reply[0]),
+                    int(reply[1]) / 1000,
+                    int(reply[2]) - 1 if int(reply[2]) else None,
+                    [int(value) for value in reply[3:]]
+                )
+
+        return self._local.evaluate(keys, specs, self.algorithm, force, time.time())
+
+
+class RateLimitExceeded(Exception):
+    """请求数或 token 数超出限额"""
+
+    def __init__(
+        self,
+        scope: str,
+        identifier: str,
+        kind: str,
+        window: str,
+        limit: int,
+        retry_after: float,
+        remaining: int = 0
+    ):
+        self.scope = scope
+        self.identifier = identifier
+        self.kind = kind
+        self.window = window
+        self.limit = limit
+        self.retry_after = retry_after
+        # 超限窗口当前的剩余额度（不足本次消耗）
+        self.remaining = remaining
+        super().__init__(f"{scope} '{identifier}' exceeded {limit} {kind} per {window}")
+
+
+def _identifiers(user: str, tenant: Optional[str]) -> Dict[str, Optional[str]]:
+    """
+    user / tenant 在 Redis key 中的标识
+
+    一次脚本调用同时访问 user 和 tenant 的 key，Redis Cluster 要求它们在同一个 slot，
+    因此都带上 tenant 的 hash tag（没有 tenant 时用 user 的），user 的计数按 tenant 区分
+    """
+    if tenant is None:
+        return {"user": f"{{{user}}}", "tenant": None}
+    return {"user": f"{{{tenant}}}:{user}", "tenant": f"{{{tenant}}}"}
+
+
+def _hash_tag(identifier: str) -> str:
+    return identifier[:identifier.index("}") + 1]
+
+
+@dataclass(frozen=True)
+class UsageLimit:
+    """scope（user / tenant）在 window 内最多使用 limit 个 kind（requests / tokens）"""
+    scope: str
+    kind: str
+    window: str
+    limit: int
+
+
+@dataclass
+class Reservation:
+    """准入时预留的 token，生成结束后调用 reconcile 按实际用量调整"""
+    limiter: "RateLimiter"
+    tokens: int
+    user: Optional[str] = None
+    tenant: Optional[str] = None
+    settled: bool = False
+
+    async def reconcile(self, actual_tokens: int) -> None:
+        """按实际用量（prompt + completion）调整，只生效一次"""
+        if self.settled:
+            return
+        self.settled = True
+
+        delta = actual_tokens - self.tokens
+        self.limiter.stats["reconciled_tokens"] += delta
+        if delta:
+            await self.limiter._settle(_identifiers(self.user, self.tenant), delta)
+
+    async def release(self) -> None:
+        """请求未执行（失败或被取消），退还全部预留"""
+        await self.reconcile(0)
+
+
+@dataclass
+class _Lease:
+    """本 worker 从 Redis 租用、尚未用完的额度（一个标识的一种限额的所有窗口共用）"""
+    # 每次租用量，不超过 1 时不租用（每次都访问 Redis）
+    size: int
+    # 有效期（最短的窗口）：过期后剩余额度在最短窗口中的计数已滑出，
+    # 但更长的窗口（小时、天）仍计着这部分，需要退还
+    ttl: float
+    tokens: int = 0
+    granted_at: float = 0.0
+    # 过期时未用完、尚未从更长窗口退还的额度
+    expired: int = 0
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+    @property
+    def leasing(self) -> bool:
+        return self.size > 1
+
+    def available(self) -> int:
+        if self.tokens and time.monotonic() - self.granted_at >= self.ttl:
+            self.expired += self.tokens
+            self.tokens = 0
+        return self.tokens
+
 
 class RateLimiter:
-    """基于 Redis 的 API 限流器"""
+    """
+    按请求数和 token 数限流（滑动窗口或 GCRA，见 _WINDOW_SCRIPT）
+
+    user 和 tenant 的所有限额在一次脚本调用中原子地检查和计数，超限时都不计数。
+    在 queue_timeout 内等待到可以重试，否则抛出 RateLimitExceeded。
+    请求数可以先于 token 单独计入（查缓存之前准入，未命中时再预留 token）
+
+    max_error > 0 时每个 worker 按 (标识, 请求数 / token 数) 一次从 Redis 租用一批额度，
+    在本地消耗，用完才再次执行脚本；结算退还的 token 也先还到本地租约。每批的大小为
+    最小限额 * max_error / workers，所有 worker 租用未用完的额度之和不超过 max_error
+    （另加每个 worker 至多一批退还的 token）。租约在最短的窗口后过期，未用完的额度
+    从更长的窗口中退还（下次访问该标识时）；关闭时退还剩余额度
+    """
 
     def __init__(
         self,
-        requests_per_minute: int = 60,
-        requests_per_hour: int = 1000
+        limits: List[UsageLimit],
+        queue_timeout: float = 0.0,
+        algorithm: str = "sliding",
+        max_error: float = 0.0,
+        workers: int = 1
     ):
-        self.requests_per_minute = requests_per_minute
-        self.requests_per_hour = requests_per_hour
+        self.limits = [limit for limit in limits if limit.limit > 0]
+        self.queue_timeout = queue_timeout
+        self.store = WindowStore(algorithm)
+        # (scope, kind) -> 该类限额的所有窗口
+        self._groups: Dict[Tuple[str, str], List[UsageLimit]] = {}
+        for limit in self.limits:
+            self._groups.setdefault((limit.scope, limit.kind), []).append(limit)
+        self._lease_sizes = {
+            group: int(min(limit.limit for limit in limits) * max_error / max(workers, 1))
+            for group, limits in self._groups.items()
+        }
+        # (scope, 标识, kind) -> 租约
+        self._leases: Dict[Tuple[str, str, str], _Lease] = {}
+        self.stats: Dict[str, int] = {
+            "admitted": 0,
+            "queued": 0,
+            "rejected": 0,
+            "reserved_tokens": 0,
+            "reconciled_tokens": 0,
+            # 由本地租约放行、未执行脚本的请求数
+            "local": 0,
+            "script_calls": 0,
+        }
+
+    @classmethod
+    def from_config(cls) -> "RateLimiter":
+        server = config.server
+        return cls(
+            [
+                UsageLimit("user", "requests", "minute", server.rate_limit_rpm),
+                UsageLimit("user", "requests", "hour", server.rate_limit_rph),
+                UsageLimit("user", "tokens", "minute", server.rate_limit_tpm),
+                UsageLimit("user", "tokens", "day", server.rate_limit_tpd),
+                UsageLimit("tenant", "requests", "minute", server.tenant_rate_limit_rpm),
+                UsageLimit("tenant", "tokens", "minute", server.tenant_rate_limit_tpm),
+                UsageLimit("tenant", "tokens", "day", server.tenant_rate_limit_tpd),
+            ],
+            queue_timeout=server.rate_limit_queue_timeout,
+            algorithm=server.rate_limit_algorithm,
+            max_error=server.rate_limit_lease_error,
+            workers=server.workers
+        )
 
-    async def check_rate_limit(
+    async def reserve(
         self,
-        identifier: str,
-        endpoint: Optional[str] = None
-    ) -> bool:
+        user: str,
+        tenant: Optional[str],
+        tokens: int,
+        requests: int = 1
+    ) -> Reservation:
         """
-        检查是否超过限流
-
-        Args:
-            identifier: 用户标识（user_id 或 IP）
-            endpoint: API 端点（可选）
+        计入 requests 个请求并预留 tokens 个 token
 
-        Returns:
-            是否允许请求
+        Raises:
+            RateLimitExceeded: 超出限额且等不到可以重试（或单个请求就超过了 token 限额）
         """
-        current_time = int(time.time())
-        minute_key = f"ratelimit:{identifier}:minute:{current_time // 60}"
-        hour_key = f"ratelimit:{identifier}:hour:{current_time // 3600}"
-
-        # 检查每分钟限制
-        minute_count = await cache.incr(minute_key)
-        if minute_count == 1:
-            await cache.expire(minute_key, 60)
-
-        if minute_count > self.requests_per_minute:
-            logger.warning(
-                f"Rate limit exceeded for {identifier}: "
-                f"{minute_count} requests in current minute"
+        deadline = time.monotonic() + self.queue_timeout
+        while True:
+            try:
+                await self._acquire(_identifiers(user, tenant), requests, tokens)
+            except RateLimitExceeded as e:
+                never_fits = e.kind == "tokens" and tokens > e.limit
+                if never_fits or time.monotonic() + e.retry_after > deadline:
+                    self.stats["rejected"] += 1
+                    logger.warning(f"Rate limit exceeded: {e}")
+                    raise
+                self.stats["queued"] += 1
+                await asyncio.sleep(e.retry_after)
+                continue
+
+            self.stats["admitted"] += requests
+            self.stats["reserved_tokens"] += tokens
+            return Reservation(self, tokens, user, tenant)
+
+    def _key(self, limit: UsageLimit, identifier: str) -> str:
+        return (
+            f"ratelimit:{self.store.algorithm}:{limit.scope}:{identifier}:"
+            f"{limit.kind}:{limit.window}"
+        )
+
+    def _lease(self, scope: str, identifier: str, kind: str) -> _Lease:
+        lease = self._leases.get((scope, identifier, kind))
+        if lease is None:
+            if len(self._leases) >= 10000:
+                self._prune_leases()
+            limits = self._groups[(scope, kind)]
+            lease = self._leases[(scope, identifier, kind)] = _Lease(
+                self._lease_sizes[(scope, kind)],
+                min(WINDOWS[limit.window] for limit in limits)
+            )
+        return lease
+
+    def _prune_leases(self) -> None:
+        for key, lease in list(self._leases.items()):
+            if not lease.lock.locked() and lease.available() == 0 and not lease.expired:
+                del self._leases[key]
+
+    def _expired_refunds(
+        self,
+        scope: str,
+        kind: str,
+        identifier: str,
+        lease: _Lease
+    ) -> List[Tuple[str, Tuple[int, int, int]]]:
+        """过期租约未用完的额度从比有效期更长的窗口中退还，返回 [(key, (限额, 窗口秒数, 消耗))]"""
+        lease.available()
+        refunds = [
+            (self._key(limit, identifier), (limit.limit, WINDOWS[limit.window], -lease.expired))
+            for limit in self._groups[(scope, kind)]
+            if lease.expired and WINDOWS[limit.window] > lease.ttl
+        ]
+        lease.expired = 0
+        return refunds
+
+    async def _force(self, updates: List[Tuple[str, Tuple[int, int, int]]]) -> None:
+        """一次脚本调用不检查限额地计入 [(key, (限额, 窗口秒数, 消耗))]"""
+        if updates:
+            self.stats["script_calls"] += 1
+            await self.store.evaluate(
+                [key for key, _ in updates], [spec for _, spec in updates], force=True
             )
-            return False
 
-        # 检查每小时限制
-        hour_count = await cache.incr(hour_key)
-        if hour_count == 1:
-            await cache.expire(hour_key, 3600)
+    async def record(self, user: str, tenant: Optional[str], tokens: int) -> None:
+        """计入不经过预留的 token 用量（如缓存命中返回的结果），不检查限额"""
+        if tokens > 0:
+            self.stats["reconciled_tokens"] += tokens
+            await self._settle(_identifiers(user, tenant), tokens)
+
+    async def _acquire(
+        self,
+        identifiers: Dict[str, Optional[str]],
+        requests: int,
+        tokens: int
+    ) -> None:
+        """计入请求数和 token 数：先从本地租约扣除，不够的部分一次脚本调用补足"""
+        costs = {"requests": requests, "tokens": tokens}
+        # (scope, kind, 标识, 租约, 消耗)
+        items = [
+            (scope, kind, identifier, self._lease(scope, identifier, kind), costs[kind])
+            for (scope, kind), identifier in (
+                (group, identifiers[group[0]]) for group in self._groups
+            )
+            if identifier is not None and costs[kind] > 0
+        ]
+
+        # 本地租约够用的直接扣除（同步执行，不会与其他协程交错）
+        taken = []
+        short = []
+        for item in items:
+            lease, cost = item[3], item[4]
+            if lease.leasing and lease.available() >= cost:
+                lease.tokens -= cost
+                taken.append(item)
+            else:
+                short.append(item)
+        if not short:
+            self.stats["local"] += 1
+            return
+
+        try:
+            # 同一租约的并发补充排队，先到的补充后，后到的通常可以直接从本地扣除
+            locks = sorted(
+                (item for item in short if item[3].leasing), key=lambda item: item[:3]
+            )
+            async with AsyncExitStack() as stack:
+                for item in locks:
+                    await stack.enter_async_context(item[3].lock)
+                remaining_short = []
+                for item in short:
+                    lease, cost = item[3], item[4]
+                    if lease.leasing and lease.available() >= cost:
+                        lease.tokens -= cost
+                        taken.append(item)
+                    else:
+                        remaining_short.append(item)
+                if remaining_short:
+                    # 先退还过期租约在长窗口中的计数，补充时按实际用量检查
+                    await self._force([
+                        refund
+                        for scope, kind, identifier, lease, _ in remaining_short
+                        for refund in self._expired_refunds(scope, kind, identifier, lease)
+                    ])
+                    await self._refill(remaining_short)
+        except BaseException:
+            # 未能全部准入，退还已从本地租约扣除的额度
+            for item in taken:
+                item[3].tokens += item[4]
+            raise
+
+    async def _refill(self, items: List[Tuple[str, str, str, _Lease, int]]) -> None:
+        """一次脚本调用计入各项不足的部分，并为租约多租一批"""
+        leftovers = []
+        needs = []
+        extras = []
+        for scope, kind, _, lease, cost in items:
+            # 原有的剩余额度先取出用于本次请求，等待脚本期间其他请求不能再用
+            leftover = lease.available()
+            lease.tokens = 0
+            leftovers.append(leftover)
+            needs.append(cost - leftover)
+            limit = min(limit.limit for limit in self._groups[(scope, kind)])
+            extras.append(min(lease.size, max(limit - needs[-1], 0)) if lease.leasing else 0)
+
+        try:
+            check = await self._evaluate(items, needs, extras)
+            if not check[0].allowed and any(extras):
+                # 接近限额：只租用剩余的部分
+                extras = [
+                    min(extra, max(min(remaining) - need, 0))
+                    for extra, need, remaining in zip(extras, needs, check[2])
+                ]
+                check = await self._evaluate(items, needs, extras)
+        except BaseException:
+            for (_, _, _, lease, _), leftover in zip(items, leftovers):
+                lease.tokens += leftover
+            raise
 
-        if hour_count > self.requests_per_hour:
-            logger.warning(
-                f"Rate limit exceeded for {identifier}: "
-                f"{hour_count} requests in current hour"
+        result, limits, _ = check
+        if not result.allowed:
+            for (_, _, _, lease, _), leftover in zip(items, leftovers):
+                lease.tokens += leftover
+            limit, identifier = limits[result.exceeded]
+            raise RateLimitExceeded(
+                limit.scope,
+                identifier,
+                limit.kind,
+                limit.window,
+                limit.limit,
+                result.retry_after,
+                result.remaining[result.exceeded]
             )
-            return False
 
-        return True
+        for (_, _, _, lease, _), extra in zip(items, extras):
+            if extra:
+                lease.tokens += extra
+                lease.granted_at = time.monotonic()
 
-    async def get_remaining_requests(
+    async def _evaluate(
         self,
-        identifier: str
-    ) -> dict:
-        """
-        获取剩余请求次数
+        items: List[Tuple[str, str, str, _Lease, int]],
+        needs: List[int],
+        extras: List[int]
+    ) -> Tuple[WindowCheck, List[Tuple[UsageLimit, str]], List[List[int]]]:
+        """返回 (检查结果, 每个 key 的 (限额, 标识), 每一项各窗口的剩余额度)"""
+        keys = []
+        specs = []
+        limits = []
+        spans = []
+        for (scope, kind, identifier, _, _), need, extra in zip(items, needs, extras):
+            group = self._groups[(scope, kind)]
+            spans.append((len(keys), len(keys) + len(group)))
+            for limit in group:
+                keys.append(self._key(limit, identifier))
+                specs.append((limit.limit, WINDOWS[limit.window], need + extra))
+                limits.append((limit, identifier))
 
-        Returns:
-            包含剩余次数的字典
-        """
-        current_time = int(time.time())
-        minute_key = f"ratelimit:{identifier}:minute:{current_time // 60}"
-        hour_key = f"ratelimit:{identifier}:hour:{current_time // 3600}"
-
-        minute_count = int(await cache.get(minute_key) or 0)
-        hour_count = int(await cache.get(hour_key) or 0)
-
-        return {
-            "requests_per_minute": self.requests_per_minute,
-            "remaining_minute": max(0, self.requests_per_minute - minute_count),
-            "requests_per_hour": self.requests_per_hour,
-            "remaining_hour": max(0, self.requests_per_hour - hour_count)
-        }
+        self.stats["script_calls"] += 1
+        result = await self.store.evaluate(keys, specs)
+        return result, limits, [result.remaining[start:end] for start, end in spans]
 
+    async def _settle(self, identifiers: Dict[str, Optional[str]], delta: int) -> None:
+        """按实际用量调整 token 计数：先在本地租约中增减，其余部分强制计入 Redis"""
+        updates = []
+        for scope, kind in self._groups:
+            identifier = identifiers[scope]
+            if kind != "tokens" or identifier is None:
+                continue
 
-# 全局限流器实例
-rate_limiter = RateLimiter()
+            amount = delta
+            lease = self._lease(scope, identifier, kind)
+            if lease.leasing and amount < 0:
+                if lease.available() == 0:
+                    lease.granted_at = time.monotonic()
+                lease.tokens -= amount
+                amount = 0
+                # 本地攒下太多退还的额度时，超出一批的部分还给 Redis
+                if lease.tokens > 2 * lease.size:
+                    amount = lease.size - lease.tokens
+                    lease.tokens = lease.size
+            elif lease.leasing:
+                used = min(amount, lease.available())
+                lease.tokens -= used
+                amount -= used
 
+            updates.extend(self._expired_refunds(scope, kind, identifier, lease))
+            if amount:
+                for limit in self._groups[(scope, kind)]:
+                    updates.append(
+                        (self._key(limit, identifier), (limit.limit, WINDOWS[limit.window], amount))
+                    )
 
-async def check_rate_limit(request: Request) -> None:
-    """
-    限流中间件依赖项
+        await self._force(updates)
 
-    用于 FastAPI 路由的 Depends
-    """
-    # 从请求中获取用户标识
-    # 优先使用认证用户 ID，否则使用 IP 地址
-    identifier = getattr(request.state, "user_id", None)
-    if not identifier:
-        identifier = request.client.host
-
-    # 检查限流
-    allowed = await rate_limiter.check_rate_limit(identifier)
-
-    if not allowed:
-        raise HTTPException(
-            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-            detail="Rate limit exceeded. Please try again later."
-        )
+    async def release_leases(self) -> None:
+        """退还所有租用未用完的额度（关闭时调用）"""
+        leases, self._leases = self._leases, {}
+        # 一次脚本调用只能访问同一 hash tag 的 key，按 tag 分别退还
+        updates: Dict[str, List[Tuple[str, Tuple[int, int, int]]]] = {}
+        for (scope, identifier, kind), lease in leases.items():
+            slot = updates.setdefault(_hash_tag(identifier), [])
+            slot.extend(self._expired_refunds(scope, kind, identifier, lease))
+            tokens = lease.available()
+            if not tokens:
+                continue
+            for limit in self._groups[(scope, kind)]:
+                slot.append(
+                    (self._key(limit, identifier), (limit.limit, WINDOWS[limit.window], -tokens))
+                )
+
+        for slot in updates.values():
+            await self._force(slot)
+
+    def get_stats(self) -> Dict[str, int]:
+        return dict(self.stats)
+
+
+# 全局限流器实例
+rate_limiter = RateLimiter.from_config()
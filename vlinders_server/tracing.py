@@ -0,0 +1,162 @@
+"""
+链路追踪（OpenTelemetry）
+
+每个 /internal 请求一个 SERVER span，上下文从 Vlinders-API 传来的 traceparent 头继承；
+请求处理的各阶段为其子 span:
+- auth: 内部认证
+- render_prompt: chat template 渲染、上下文裁剪和分词
+- queue: 等待调度器槽位
+- prefill: 提交到引擎至首个 token
+- decode: 首个 token 至生成结束
+- sse: 流式响应的序列化与发送
+
+采样: 根 span 按 TRACING_SAMPLE_RATE 采样，上游已做出采样决定时沿用上游的结果。
+未采样的请求不创建子 span，未开启追踪时中间件直接透传。
+"""
+import time
+from contextlib import nullcontext
+from typing import Any, ContextManager, Dict, Optional
+
+from opentelemetry import propagate, trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import (
+    BatchSpanProcessor, ConsoleSpanExporter, SimpleSpanProcessor
+)
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+from opentelemetry.trace import INVALID_SPAN, Span, SpanKind, Status, StatusCode
+
+from .config import config
+from .utils import logger
+
+Attributes = Optional[Dict[str, Any]]
+
+
+class TracingService:
+    """追踪器（未开启时所有方法都是空操作）"""
+
+    def __init__(self):
+        self.provider: Optional[TracerProvider] = None
+        self.tracer: trace.Tracer = trace.NoOpTracer()
+        # TRACING_EXPORTER=memory 时保存已结束的 span（用于测试）
+        self.memory_exporter: Optional[InMemorySpanExporter] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.provider is not None
+
+    def setup(self, exporter: Optional[str] = None, sample_rate: Optional[float] = None) -> None:
+        """
+        创建 TracerProvider（默认使用 TRACING_EXPORTER / TRACING_SAMPLE_RATE）
+
+        Args:
+            exporter: otlp / console / memory
+        """
+        self.shutdown()
+        exporter = exporter or config.server.tracing_exporter
+        if sample_rate is None:
+            sample_rate = config.server.tracing_sample_rate
+
+        provider = TracerProvider(
+            resource=Resource.create({"service.name": config.server.tracing_service_name}),
+            sampler=ParentBased(TraceIdRatioBased(sample_rate))
+        )
+        if exporter == "memory":
+            self.memory_exporter = InMemorySpanExporter()
+            provider.add_span_processor(SimpleSpanProcessor(self.memory_exporter))
+        elif exporter == "console":
+            provider.add_span_processor(BatchSpanProcessor(ConsoleSpanExporter()))
+        elif exporter == "otlp":
+            # 延迟导入：只有导出到 OTLP 时才需要安装 exporter
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+
+            provider.add_span_processor(
+                BatchSpanProcessor(OTLPSpanExporter(endpoint=config.server.tracing_endpoint))
+            )
+        else:
+            raise ValueError(f"Unknown tracing exporter '{exporter}'")
+
+        self.provider = provider
+        self.tracer = provider.get_tracer("vlinders_server")
+        logger.info(f"Tracing enabled (exporter={exporter}, sample_rate={sample_rate})")
+
+    def shutdown(self) -> None:
+        """导出剩余的 span 并关闭"""
+        if self.provider is not None:
+            self.provider.shutdown()
+        self.provider = None
+        self.tracer = trace.NoOpTracer()
+        self.memory_exporter = None
+
+    @staticmethod
+    def _recording() -> bool:
+        return trace.get_current_span().is_recording()
+
+    def span(self, name: str, attributes: Attributes = None) -> ContextManager[Span]:
+        """当前请求的子 span（作为当前 span，不能跨越异步生成器的 yield）"""
+        if not self._recording():
+            return nullcontext(INVALID_SPAN)
+        return self.tracer.start_as_current_span(name, attributes=attributes)
+
+    def start_span(self, name: str, attributes: Attributes = None) -> Span:
+        """当前请求的子 span（不设为当前 span，由调用方 end）"""
+        if not self._recording():
+            return INVALID_SPAN
+        return self.tracer.start_span(name, attributes=attributes)
+
+    def record(
+        self,
+        name: str,
+        start_ns: int,
+        end_ns: Optional[int] = None,
+        attributes: Attributes = None
+    ) -> None:
+        """按实际起止时间（time.time_ns()）补记一个已结束的子 span"""
+        if not self._recording():
+            return
+        span = self.tracer.start_span(name, attributes=attributes, start_time=start_ns)
+        span.end(end_time=end_ns or time.time_ns())
+
+
+class TracingMiddleware:
+    """为路径以 prefix 开头的 HTTP 请求创建 SERVER span"""
+
+    def __init__(self, app: Any, prefix: str = "/internal"):
+        self.app = app
+        self.prefix = prefix
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if (
+            scope["type"] != "http"
+            or not tracing.enabled
+            or not scope["path"].startswith(self.prefix)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        headers = {
+            key.decode("latin-1"): value.decode("latin-1") for key, value in scope["headers"]
+        }
+        attributes = {"http.request.method": scope["method"], "url.path": scope["path"]}
+        if "x-request-id" in headers:
+            attributes["vlinders.request_id"] = headers["x-request-id"]
+
+        with tracing.tracer.start_as_current_span(
+            f"{scope['method']} {scope['path']}",
+            context=propagate.extract(headers),
+            kind=SpanKind.SERVER,
+            attributes=attributes
+        ) as span:
+            async def send_with_status(message: Dict[str, Any]) -> None:
+                if message["type"] == "http.response.start":
+                    span.set_attribute("http.response.status_code", message["status"])
+                    if message["status"] >= 500:
+                        span.set_status(Status(StatusCode.ERROR))
+                await send(message)
+
+            await self.app(scope, receive, send_with_status)
+
+
+# 全局追踪实例
+tracing = TracingService()